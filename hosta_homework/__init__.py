@@ -1,3 +1,12 @@
 """Elliot Rivers's submission to the Hosta.ai application homework"""
-from . import data
-from . import model
+import importlib
+
+
+__all__ = ["data", "model"]
+
+
+def __getattr__(name):
+    # Imported on first use (PEP 562), so that e.g. the CLI's --help stays fast
+    if name in __all__:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
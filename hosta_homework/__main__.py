@@ -1,33 +1,164 @@
 from argparse import ArgumentParser
 import logging
-import json
 from pathlib import Path
+import sys
 from textwrap import dedent
 
+from . import logs
+from . import manifest
+from .cache import IndexCache
+from .metrics import Metrics
 from . import model
+from . import two_pass
 from . import data
 
 
 OUT_DIR = Path(__file__).parents[1] / "data" / "out"
 
-def main(log_level: int, force_overwrite: bool = False):
+def write_metrics(metrics: Metrics, report: Path | None = None, prometheus: Path | None = None):
+    """Write out the run report as json and/or in the Prometheus text format, if requested"""
+    if report is not None:
+        report.write_text(metrics.to_json())
+    if prometheus is not None:
+        prometheus.write_text(metrics.to_prometheus())
+
+def main(
+        log_level: int,
+        force_overwrite: bool = False,
+        validate: bool = False,
+        engine: str = "batch",
+        save_mode: str = "model",
+        cache_dir: Path | None = None,
+        cache_size: int = 1 << 30,
+        incremental: bool = False,
+        trace_memory: bool = False,
+        compression: str | None = None,
+        io_workers: int = 4,
+        codec: str | None = None,
+        low_memory: bool = False,
+        infer_parents: float | None = None,
+        check_dimensions: str | None = None,
+        dimension_tolerance: float = 0.5,
+    ) -> Metrics:
+    logging.basicConfig(level=log_level)
+
+    metrics = Metrics(trace_memory)
+    cache = None if cache_dir is None else IndexCache(cache_dir, cache_size)
+    if incremental:
+        manifest.process_incremental(
+            data.IMAGE_FILES,
+            data.CSV_FILE,
+            OUT_DIR,
+            engine=engine,
+            save_mode=save_mode,
+            compression=compression,
+            validate=validate,
+            cache=cache,
+            metrics=metrics,
+            io_workers=io_workers,
+            codec=codec,
+            infer_parents=infer_parents,
+            check_dimensions=check_dimensions)
+    elif low_memory:
+        two_pass.process_two_pass(
+            data.IMAGE_FILES,
+            data.CSV_FILE,
+            OUT_DIR,
+            engine=engine,
+            save_mode=save_mode,
+            force=force_overwrite,
+            compression=compression,
+            metrics=metrics,
+            infer_parents=infer_parents,
+            check_dimensions=check_dimensions,
+            dimension_tolerance=dimension_tolerance,
+            validate=validate,
+            cache=cache,
+            io_workers=io_workers,
+            codec=codec)
+    else:
+        room = model.Room(
+            data.IMAGE_FILES, validate=validate, cache=cache, metrics=metrics, io_workers=io_workers, codec=codec)
+        room.process_corrections(data.CSV_FILE, engine=engine, keep_rows=check_dimensions is not None)
+        if check_dimensions is not None:
+            room.check_dimensions(rel_tol=dimension_tolerance, reject=check_dimensions == "reject")
+        if infer_parents is not None:
+            room.infer_parents(min_confidence=infer_parents)
+        room.save_images(OUT_DIR, force=force_overwrite, mode=save_mode, compression=compression)
+
+    if cache is not None:
+        metrics.count("cache_hits", cache.hits)
+        metrics.count("cache_misses", cache.misses)
+    return metrics
+
+def batch_main(
+        log_level: int,
+        root: Path,
+        output_dir: Path,
+        workers: int | None,
+        force_overwrite: bool = False,
+        validate: bool = False,
+        engine: str = "batch",
+        save_mode: str = "model",
+        cache_dir: Path | None = None,
+        cache_size: int = 1 << 30,
+        incremental: bool = False,
+        trace_memory: bool = False,
+        compression: str | None = None,
+        io_workers: int = 4,
+        codec: str | None = None,
+        low_memory: bool = False,
+        infer_parents: float | None = None,
+        check_dimensions: str | None = None,
+        dimension_tolerance: float = 0.5,
+    ) -> Metrics:
+    """Process every room found under root; return the metrics of all rooms together"""
+    # Only imported here, as multiprocessing is a noticeable part of the CLI's start-up time
+    from . import batch
+
     logging.basicConfig(level=log_level)
 
-    room = model.Room(data.IMAGE_FILES)
-    room.process_corrections(data.CSV_FILE)
-    room.save_images(OUT_DIR, force=force_overwrite)
+    jobs = batch.find_rooms(root, output_dir)
+    logging.info("Found %d rooms under %s", len(jobs), root)
 
-def print_stats():
-    num_ops_with_parents_now = 0
+    results = batch.run_batch(
+        jobs,
+        workers=workers,
+        force=force_overwrite,
+        validate=validate,
+        engine=engine,
+        save_mode=save_mode,
+        cache_dir=cache_dir,
+        cache_size=cache_size,
+        incremental=incremental,
+        trace_memory=trace_memory,
+        compression=compression,
+        io_workers=io_workers,
+        codec=codec,
+        low_memory=low_memory,
+        infer_parents=infer_parents,
+        check_dimensions=check_dimensions,
+        dimension_tolerance=dimension_tolerance)
+    failures = [r.name for r in results if not r.ok]
+    logging.info("Processed %d rooms: %d succeeded, %d failed",
+        len(results), len(results) - len(failures), len(failures))
+    for name in failures:
+        logging.error("Failed room: %s", name)
 
-    for new_file in OUT_DIR.glob("*.json"):
-        with open(new_file) as f:
-            data = json.load(f)
-        for op in data['ops_3d']:
-            if 'parent_id' in op:
-                num_ops_with_parents_now += 1
+    metrics = Metrics(trace_memory)
+    for result in results:
+        if result.metrics is not None:
+            metrics.merge(result.metrics)
+    metrics.count("rooms", len(results))
+    metrics.count("rooms_failed", len(failures))
+    return metrics
 
-    logging.info("%d ops_3d were updated to include a parent link", num_ops_with_parents_now)
+def print_stats(metrics: Metrics):
+    """Log a summary of the run, from its metrics"""
+    logging.info("%d ops_3d were updated to include a parent link", metrics.counters.get("parent_links_written", 0))
+    logging.info("Join outcomes: %s", ", ".join(f"{name}={count}" for name, count in metrics.join_outcomes.items()))
+    logging.info("Stage timings: %s", ", ".join(
+        f"{name}={stage.seconds:.3f}s" for name, stage in metrics.stages.items() if stage.calls))
 
 if __name__ == "__main__":
     parser = ArgumentParser(
@@ -35,8 +166,12 @@ if __name__ == "__main__":
         description=dedent("""\
             Process image files and a correction CSV into output files. 
 
-            All the input files are hard-coded for the sake of this example:
-                inputs are processed from data/ and emitted to data/out/"""),
+            By default, the input files are hard-coded for the sake of this example:
+                inputs are processed from data/ and emitted to data/out/
+
+            With --batch-root, every directory underneath the root that contains
+            image json files and one correction CSV is processed as a room, in
+            parallel, and emitted to the same relative path under --output-dir"""),
         )
 
     parser.add_argument(
@@ -45,13 +180,220 @@ if __name__ == "__main__":
         default="INFO",
         help="Specify which log level to emit at. Default: INFO")
 
+    parser.add_argument(
+        "--log-format",
+        choices=["text", "json"],
+        default="text",
+        help="Write log records as text lines, or as json lines with their structured fields. Default: text")
+
+    parser.add_argument(
+        "--log-background",
+        action="store_true",
+        help="Format and write log records in a background thread, off the processing thread")
+
+    parser.add_argument(
+        "--log-aggregate",
+        type=int,
+        nargs="?",
+        const=5,
+        metavar="SAMPLES",
+        help=dedent("""\
+            Only log the first SAMPLES records of each message about an op_3d (e.g. of
+            each kind of join outcome); count the rest, and log a summary of them at the
+            end of the run. Other records, such as progress and errors, are all logged.
+            Default SAMPLES: 5"""))
+
+    parser.add_argument(
+        "--log-rate-limit",
+        type=float,
+        metavar="PER_SECOND",
+        help="Log at most this many records of each message per second (after the --log-aggregate samples)")
+
     parser.add_argument(
         "--force-overwrite",
         action="store_true",
         help="Set this flag if you want to force output file clobbering")
 
+    parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="Fully validate image files against the data model instead of only the fields needed for corrections")
+
+    parser.add_argument(
+        "--codec",
+        choices=model.codec.CODECS,
+        help=dedent("""\
+            How to parse and serialize image files: 'pydantic' validates everything
+            (as --validate); 'lazy' only what corrections need; 'orjson' (lazy too) and
+            'msgspec' (validating) are faster, but need those packages; 'compact'
+            (validating) keeps ops in arrays, which takes several times less memory.
+            Default: pydantic with --validate, otherwise lazy"""))
+
+    parser.add_argument(
+        "--engine",
+        choices=model.join.ENGINES.keys(),
+        default="batch",
+        help=dedent("""\
+            How to join ops_3d against the corrections. 'batch' joins all ops at once
+            and logs a summary; 'reference' joins one op at a time and logs each;
+            'identity' joins like batch, then retries the ops that failed through
+            every alias of their objects (imageIds and all the CSV image columns).
+            Default: batch"""))
+
+    parser.add_argument(
+        "--save-mode",
+        choices=["model", "splice", *model.links.LINK_MODES],
+        default="model",
+        help=dedent("""\
+            How to write output files. 'model' re-serializes the parsed images;
+            'splice' copies the input files byte-for-byte, only inserting parent_ids;
+            'links' and 'jsonpatch' only write a table of the parent links of the room
+            (binary, or as JSON Patch), which hosta_homework.model.links can apply.
+            Default: model"""))
+
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help=dedent("""\
+            Only rewrite the outputs whose inputs, or relevant corrections, changed since
+            the last run, as recorded in a manifest.json alongside the outputs"""))
+
+    parser.add_argument(
+        "--low-memory",
+        action="store_true",
+        help=dedent("""\
+            Keep only one image in memory at a time, at the price of parsing every image
+            twice (see hosta_homework.two_pass). Ignored with --incremental"""))
+
+    parser.add_argument(
+        "--infer-parents",
+        type=float,
+        nargs="?",
+        const=0.5,
+        metavar="MIN_CONFIDENCE",
+        help=dedent("""\
+            After the join, give the hosted ops_3d that still have no parent the nearest
+            wall of their image, if the confidence of the match (0 to 1) is at least
+            MIN_CONFIDENCE (see hosta_homework.model.spatial). Default MIN_CONFIDENCE: 0.5"""))
+
+    parser.add_argument(
+        "--check-dimensions",
+        choices=["flag", "reject"],
+        help=dedent("""\
+            After the join, compare the dimensions of each op_3d with those of its CSV row
+            (see hosta_homework.model.dimensions). 'flag' logs the ops that disagree;
+            'reject' also undoes their corrections"""))
+
+    parser.add_argument(
+        "--dimension-tolerance",
+        type=float,
+        default=0.5,
+        help="Relative tolerance of --check-dimensions (with a floor of 0.5ft). Default: 0.5")
+
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        help="Cache parsed inputs in this directory, so that unchanged inputs are not re-parsed on later runs")
+
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=1024,
+        help="Upper bound on the size of the --cache-dir, in MiB. Default: 1024")
+
+    parser.add_argument(
+        "--batch-root",
+        type=Path,
+        help="Process every room found under this directory instead of the hard-coded example")
+
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        default=OUT_DIR,
+        help="Where to emit batch outputs. Default: data/out/")
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes for batch processing. Default: one per CPU")
+
+    parser.add_argument(
+        "--report",
+        type=Path,
+        help="Write a json run report (stage timings, join outcomes and counters) to this file")
+
+    parser.add_argument(
+        "--prometheus",
+        type=Path,
+        help="Write the run metrics to this file in the Prometheus text format")
+
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Also measure the peak memory of each stage. Slows the run down considerably")
+
+    parser.add_argument(
+        "--compress",
+        choices=["gzip", "zstd"],
+        help="Compress output files (zstd requires the zstandard package: poetry install -E zstd)")
+
+    parser.add_argument(
+        "--io-workers",
+        type=int,
+        default=4,
+        help="Number of threads reading and writing files, per room. Default: 4")
+
     args = parser.parse_args()
 
     log_level = logging.getLevelNamesMapping()[args.log_level]
-    main(log_level, args.force_overwrite)
-    print_stats()
+    session = logs.configure(
+        log_level,
+        json_lines=args.log_format == "json",
+        background=args.log_background,
+        samples=args.log_aggregate,
+        rate_limit=args.log_rate_limit)
+    if args.batch_root:
+        metrics = batch_main(
+            log_level,
+            args.batch_root,
+            args.output_dir,
+            args.workers,
+            args.force_overwrite,
+            args.validate,
+            args.engine,
+            args.save_mode,
+            args.cache_dir,
+            args.cache_size << 20,
+            args.incremental,
+            args.trace_memory,
+            args.compress,
+            args.io_workers,
+            args.codec,
+            args.low_memory,
+            args.infer_parents,
+            args.check_dimensions,
+            args.dimension_tolerance)
+        write_metrics(metrics, args.report, args.prometheus)
+        session.close()
+        sys.exit(1 if metrics.counters["rooms_failed"] else 0)
+
+    metrics = main(
+        log_level,
+        args.force_overwrite,
+        args.validate,
+        args.engine,
+        args.save_mode,
+        args.cache_dir,
+        args.cache_size << 20,
+        args.incremental,
+        args.trace_memory,
+        args.compress,
+        args.io_workers,
+        args.codec,
+        args.low_memory,
+        args.infer_parents,
+        args.check_dimensions,
+        args.dimension_tolerance)
+    write_metrics(metrics, args.report, args.prometheus)
+    print_stats(metrics)
+    session.close()
@@ -0,0 +1,314 @@
+"""Batch processing of many rooms in a bounded process pool
+
+A "room" on disk is a directory containing some image json files and exactly one
+correction CSV file, e.g.:
+
+    root/
+        room_a/
+            3d3fde25-....json
+            763fdd40-....json
+            EXP_ObjectID_HostID.csv
+        floor_2/room_b/
+            ...
+
+Every such directory under a root is discovered with find_rooms and processed
+with run_batch. Outputs mirror the directory layout of the root underneath the
+output directory.
+
+Rooms are independent of one another, so each is processed in its own worker
+process. A failure in one room is recorded in its RoomResult and does not affect
+any of the others.
+"""
+import collections
+from concurrent.futures import FIRST_COMPLETED, BrokenExecutor, ProcessPoolExecutor, wait
+import logging
+import os
+from pathlib import Path
+import time
+import traceback
+import typing
+
+from . import logs, manifest, model, two_pass
+from .cache import IndexCache
+from .metrics import Metrics
+
+class RoomJob(typing.NamedTuple):
+    """Everything a worker needs to know to process one room
+
+    Attributes:
+        name (str): Human-readable name of the room (its path relative to the batch root)
+        image_files (list[Path]): The image json files that comprise the room
+        csv_file (Path | None): The correction CSV file for the room, or None if it is ambiguous
+        output_dir (Path): Where the processed image files should be written
+    """
+    name: str
+    image_files: typing.List[Path]
+    csv_file: Path | None
+    output_dir: Path
+
+
+class RoomResult(typing.NamedTuple):
+    """Outcome of processing one room
+
+    Attributes:
+        name (str): Name of the room, as in RoomJob.name
+        ok (bool): Whether the room was processed successfully
+        seconds (float): Wall time spent on the room
+        error (str | None): Formatted traceback of the failure, if any
+        metrics (Metrics | None): Metrics of processing the room, as far as it got
+    """
+    name: str
+    ok: bool
+    seconds: float
+    error: str | None = None
+    metrics: Metrics | None = None
+
+
+def find_rooms(root: os.PathLike, output_dir: os.PathLike) -> typing.List[RoomJob]:
+    """Discover every room directory under root
+
+    A directory is considered a room if it directly contains at least one
+    *.json file and at least one *.csv file. Rooms with more than one CSV
+    are still returned, so that they are reported as failures rather than
+    silently skipped.
+
+    Parameters:
+        root (PathLike): Directory to search (recursively) for rooms
+        output_dir (PathLike): Root of the output tree
+
+    Returns:
+        A list of RoomJobs, sorted by room name
+    """
+    root = Path(root)
+    output_dir = Path(output_dir)
+
+    jobs = []
+    for directory in sorted([root, *(p for p in root.rglob("*") if p.is_dir())]):
+        image_files = sorted(directory.glob("*.json"))
+        csv_files = sorted(directory.glob("*.csv"))
+        if not image_files or not csv_files:
+            continue
+
+        relative = directory.relative_to(root)
+        if len(csv_files) > 1:
+            logging.warning("Room '%s' has multiple correction files: %s", relative, csv_files)
+
+        jobs.append(RoomJob(
+            name=str(relative),
+            image_files=image_files,
+            csv_file=csv_files[0] if len(csv_files) == 1 else None,
+            output_dir=output_dir / relative))
+
+    return jobs
+
+
+def process_room(
+        job: RoomJob,
+        force: bool = False,
+        validate: bool = False,
+        engine: str = "batch",
+        save_mode: str = "model",
+        cache_dir: os.PathLike | None = None,
+        cache_size: int = 1 << 30,
+        incremental: bool = False,
+        trace_memory: bool = False,
+        compression: str | None = None,
+        io_workers: int = 4,
+        codec: str | None = None,
+        low_memory: bool = False,
+        infer_parents: float | None = None,
+        check_dimensions: str | None = None,
+        dimension_tolerance: float = 0.5,
+    ) -> RoomResult:
+    """Process a single room: parse, correct and save
+
+    Any exception is caught and recorded in the returned RoomResult so that
+    this function is safe to run in a worker process.
+
+    Parameters:
+        job (RoomJob): The room to process
+        force (bool, optional): if true, clobber output data files if they already exist
+        validate (bool, optional): if true, fully validate the image files (see model.Room)
+        engine (str, optional): which join engine to use (see model.Room.process_corrections)
+        save_mode (str, optional): how to write the output files (see model.Room.save_images)
+        cache_dir (PathLike, optional): directory of a parsed-input cache to use (see cache.IndexCache)
+        cache_size (int, optional): upper bound on the size of the cache, in bytes
+        incremental (bool, optional): if true, only rewrite outputs whose inputs changed (see manifest)
+        trace_memory (bool, optional): if true, measure the peak memory of each stage (see metrics)
+        compression (str, optional): "gzip" or "zstd" to compress the output files
+        io_workers (int, optional): number of threads reading and writing files (see model.Room)
+        codec (str, optional): how to parse and serialize image files (see model.Room)
+        low_memory (bool, optional): if true, keep only one image in memory at a time (see two_pass)
+        infer_parents (float, optional): if given, infer missing parents with this minimum confidence (see model.Room)
+        check_dimensions (str, optional): "flag" or "reject" to check the dimensions of corrections (see model.Room)
+        dimension_tolerance (float, optional): relative tolerance of the dimension check
+
+    Returns:
+        A RoomResult describing the outcome
+    """
+    start = time.perf_counter()
+    metrics = Metrics(trace_memory)
+    try:
+        if job.csv_file is None:
+            raise ValueError(f"Room '{job.name}' does not have exactly one correction file")
+
+        cache = None if cache_dir is None else IndexCache(cache_dir, cache_size)
+
+        Path(job.output_dir).mkdir(parents=True, exist_ok=True)
+        if incremental:
+            manifest.process_incremental(
+                job.image_files,
+                job.csv_file,
+                job.output_dir,
+                engine=engine,
+                save_mode=save_mode,
+                compression=compression,
+                validate=validate,
+                cache=cache,
+                metrics=metrics,
+                io_workers=io_workers,
+                codec=codec,
+                infer_parents=infer_parents,
+                check_dimensions=check_dimensions)
+        elif low_memory:
+            two_pass.process_two_pass(
+                job.image_files,
+                job.csv_file,
+                job.output_dir,
+                engine=engine,
+                save_mode=save_mode,
+                force=force,
+                compression=compression,
+                metrics=metrics,
+                infer_parents=infer_parents,
+                check_dimensions=check_dimensions,
+                dimension_tolerance=dimension_tolerance,
+                validate=validate,
+                cache=cache,
+                io_workers=io_workers,
+                codec=codec)
+        else:
+            room = model.Room(
+                job.image_files,
+                validate=validate,
+                cache=cache,
+                metrics=metrics,
+                io_workers=io_workers,
+                codec=codec)
+            room.process_corrections(job.csv_file, engine=engine, keep_rows=check_dimensions is not None)
+            if check_dimensions is not None:
+                room.check_dimensions(rel_tol=dimension_tolerance, reject=check_dimensions == "reject")
+            if infer_parents is not None:
+                room.infer_parents(min_confidence=infer_parents)
+            room.save_images(job.output_dir, force=force, mode=save_mode, compression=compression)
+    except Exception:
+        return RoomResult(job.name, False, time.perf_counter() - start, traceback.format_exc(), metrics)
+
+    if cache is not None:
+        metrics.count("cache_hits", cache.hits)
+        metrics.count("cache_misses", cache.misses)
+    return RoomResult(job.name, True, time.perf_counter() - start, metrics=metrics)
+
+
+def run_batch(
+        jobs: typing.Sequence[RoomJob],
+        workers: int | None = None,
+        **options,
+    ) -> typing.List[RoomResult]:
+    """Process many rooms in a bounded pool of worker processes
+
+    At most 2 * workers rooms are in flight at any time, so that very large
+    batches do not queue up thousands of pending jobs in the pool at once.
+
+    If a worker process dies (e.g. killed for running out of memory), the pool
+    is replaced and the rooms that were in flight are run again one at a time,
+    so that only the room that kills its worker is recorded as failed.
+
+    Parameters:
+        jobs (list[RoomJob]): The rooms to process
+        workers (int, optional): Number of worker processes. Default: one per CPU
+        **options: Passed on to process_room for every job
+
+    Returns:
+        A RoomResult for every job, in the same order as jobs
+    """
+    workers = workers or os.cpu_count() or 1
+    results = {}
+    pending = {}
+    queue = collections.deque(enumerate(jobs))
+    # Jobs that were in flight when a worker process died
+    suspects = []
+    # Indices of the jobs whose output directory was empty before they were submitted
+    fresh = set()
+
+    def record(index, result):
+        results[index] = result
+        if result.ok:
+            logging.info("[%d/%d] Processed room '%s' in %.2fs",
+                len(results), len(jobs), result.name, result.seconds)
+        else:
+            logging.error("[%d/%d] Failed to process room '%s':\n%s",
+                len(results), len(jobs), result.name, result.error)
+
+    def submit_next(pool):
+        if not queue:
+            return False
+        index, job = queue.popleft()
+        if not os.path.isdir(job.output_dir) or not os.listdir(job.output_dir):
+            fresh.add(index)
+        try:
+            pending[pool.submit(process_room, job, **options)] = (index, job)
+        except BrokenExecutor:
+            queue.appendleft((index, job))
+            return False
+        return True
+
+    while queue:
+        broken = False
+        with _pool(workers) as pool:
+            while len(pending) < 2 * workers and submit_next(pool):
+                pass
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, job = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except BrokenExecutor:
+                        # A worker process died, taking the pool and every room in flight with it
+                        broken = True
+                        suspects.append((index, job))
+                        continue
+                    except Exception:
+                        # process_room catches everything, so this is e.g. a result that would not pickle
+                        result = RoomResult(job.name, False, 0.0, traceback.format_exc())
+                    record(index, result)
+
+                    if not broken:
+                        submit_next(pool)
+
+        # Any one of the suspects may have killed the pool, so run each of them on
+        # its own: only the room that kills its worker again is recorded as failed
+        for index, job in suspects:
+            # A suspect may have written some of its outputs before the pool broke
+            force = options.get("force", False) or index in fresh
+            record(index, _run_alone(job, **{**options, "force": force}))
+        suspects.clear()
+
+    return [results[i] for i in range(len(jobs))]
+
+
+def _pool(workers: int) -> ProcessPoolExecutor:
+    # Workers log like this process (see hosta_homework.logs), if it was set up with logs.configure
+    return ProcessPoolExecutor(
+        max_workers=workers, initializer=logs.configure_worker, initargs=(logs.worker_config(),))
+
+
+def _run_alone(job: RoomJob, **options) -> RoomResult:
+    """Process one room in a worker process of its own, recording its death as a failure"""
+    with _pool(1) as pool:
+        try:
+            return pool.submit(process_room, job, **options).result()
+        except Exception:
+            return RoomResult(job.name, False, 0.0, traceback.format_exc())
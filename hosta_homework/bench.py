@@ -0,0 +1,337 @@
+"""Benchmark harness for the correction pipeline
+
+Times each stage of processing a synthetic room (see hosta_homework.synthetic)
+separately, for each combination of the requested pipeline options, and stores
+the results as json so that they can be compared across commits:
+
+    python -m hosta_homework.bench --ops-per-image 100000 --output before.json
+    ... change things ...
+    python -m hosta_homework.bench --ops-per-image 100000 --output after.json
+    python -m hosta_homework.bench --compare before.json after.json
+
+Stages are those that the pipeline itself records in its Metrics (see
+hosta_homework.metrics.STAGES), so each piece of work is counted once:
+  - read: reading the image files and the CSV
+  - validate: decoding (and maybe validating) every image with a codec
+  - index: building the Room's and the CorrectionFile's lookup tables
+  - join: Room.process_corrections
+  - serialize, write: Room.save_images
+
+Stages that run in several threads (reading images ahead, writing outputs) add up
+the time of every thread; "total" is the wall time of the whole run instead.
+Each stage, and the total, reports the minimum over --repeat runs.
+
+With --startup, the fixed cost of a CLI invocation is measured instead, i.e. the
+wall time of fresh interpreters running:
+  - import: importing hosta_homework.__main__
+  - help: python -m hosta_homework --help
+  - small_room: python -m hosta_homework on a small synthetic room
+
+With --memory, the memory that a parsed Room takes with each codec is measured
+too (with tracemalloc, which slows everything down, so separately from the
+timings):
+  - retained: bytes still allocated once the Room is constructed
+  - peak: the most bytes allocated at once while constructing it
+"""
+from argparse import ArgumentParser
+from contextlib import contextmanager
+import datetime
+import gc
+import itertools
+import json
+import logging
+from pathlib import Path
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing
+
+from . import model
+from . import synthetic
+from .metrics import STAGES, Metrics
+
+
+STARTUP_STAGES = ("import", "help", "small_room")
+MEMORY_STATS = ("retained", "peak")
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def _timer(timings: typing.Dict[str, float], stage: str):
+    start = time.perf_counter()
+    yield
+    timings[stage] = time.perf_counter() - start
+
+
+def time_stages(
+        image_files: typing.List[Path],
+        csv_file: Path,
+        output_dir: Path,
+        codec: str = "lazy",
+        engine: str = "batch",
+        save_mode: str = "model",
+    ) -> typing.Dict[str, float]:
+    """Run the pipeline once over a room, timing each stage
+
+    Returns:
+        Time of each of STAGES, as recorded in the run's Metrics, and the wall time "total", in seconds
+    """
+    metrics = Metrics()
+    timings = {}
+    with _timer(timings, "total"):
+        (model.Room(image_files, metrics=metrics, codec=codec)
+            .process_corrections(csv_file, engine=engine)
+            .save_images(output_dir, force=True, mode=save_mode))
+    timings.update((stage, metrics.stages[stage].seconds) for stage in STAGES)
+    return timings
+
+
+def _time_command(args: typing.Sequence[str], repeat: int) -> float:
+    """Get the minimum wall time of running a command, in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(args, check=True, stdout=subprocess.DEVNULL, cwd=Path(__file__).parents[1])
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def time_startup(repeat: int = 5, ops_per_image: int = 50) -> typing.Dict[str, float]:
+    """Time the fixed cost of CLI invocations, each in a fresh interpreter
+
+    Returns:
+        Minimum wall time of each of STARTUP_STAGES, in seconds
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        synthetic.generate_room(Path(tmp) / "rooms" / "room", ops_per_image=ops_per_image)
+        return {
+            "import": _time_command([sys.executable, "-c", "import hosta_homework.__main__"], repeat),
+            "help": _time_command([sys.executable, "-m", "hosta_homework", "--help"], repeat),
+            "small_room": _time_command([
+                sys.executable, "-m", "hosta_homework",
+                "--batch-root", str(Path(tmp) / "rooms"),
+                "--output-dir", str(Path(tmp) / "out"),
+                "--workers", "1",
+                "--force-overwrite",
+                "--log-level", "WARNING",
+            ], repeat),
+        }
+
+
+def measure_memory(image_files: typing.List[Path], codec: str = "lazy") -> typing.Dict[str, int]:
+    """Measure the memory that a Room of image_files takes with codec
+
+    Returns:
+        Bytes of each of MEMORY_STATS
+    """
+    gc.collect()
+    # Metrics(trace_memory=True) leaves tracemalloc running, so count from here rather than from zero
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    try:
+        room = model.Room(image_files, codec=codec)
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+    del room
+    return {"retained": retained - before, "peak": peak - before}
+
+
+def _git_commit() -> typing.Tuple[str | None, bool]:
+    """Get the current commit, and whether the work tree is dirty"""
+    cwd = Path(__file__).parent
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=cwd, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=cwd, capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, dirty
+
+
+def run_benchmark(
+        num_images: int = 3,
+        ops_per_image: int = 1000,
+        csv_rows: int = 0,
+        seed: int = 0,
+        repeat: int = 3,
+        codecs: typing.Sequence[str] = ("lazy",),
+        engines: typing.Sequence[str] = tuple(model.join.ENGINES),
+        save_modes: typing.Sequence[str] = ("model", "splice"),
+        startup: bool = False,
+        memory: bool = False,
+    ) -> typing.Dict[str, typing.Any]:
+    """Generate a synthetic room and benchmark every combination of options on it
+
+    Parameters:
+        num_images, ops_per_image, csv_rows, seed: Passed on to synthetic.generate_room
+        repeat (int, optional): Number of runs of each combination; the fastest is reported
+        codecs (list[str], optional): Image codecs to benchmark (see model.codec)
+        engines (list[str], optional): Join engines to benchmark
+        save_modes (list[str], optional): Room.save_images modes to benchmark
+        startup (bool, optional): Also time the fixed cost of CLI invocations (see time_startup)
+        memory (bool, optional): Also measure the memory of a Room with each codec (see measure_memory)
+
+    Returns:
+        A json-serializable report
+    """
+    commit, dirty = _git_commit()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            "num_images": num_images,
+            "ops_per_image": ops_per_image,
+            "csv_rows": csv_rows,
+            "seed": seed,
+            "repeat": repeat,
+        },
+        "runs": [],
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        image_files, csv_file = synthetic.generate_room(
+            Path(tmp) / "room", num_images, ops_per_image, csv_rows, seed)
+        output_dir = Path(tmp) / "out"
+        output_dir.mkdir()
+        num_ops = sum(len(model.LazyImageFile.model_validate_json(f.read_bytes()).ops_3d) for f in image_files)
+        report["params"]["num_ops"] = num_ops
+
+        for codec, engine, save_mode in itertools.product(codecs, engines, save_modes):
+            runs = [time_stages(image_files, csv_file, output_dir, codec, engine, save_mode) for _ in range(repeat)]
+            stages = {stage: min(run[stage] for run in runs) for stage in STAGES}
+            report["runs"].append({
+                "codec": codec,
+                "engine": engine,
+                "save_mode": save_mode,
+                "stages": stages,
+                "total": min(run["total"] for run in runs),
+                "join_ops_per_second": num_ops / stages["join"] if stages["join"] else None,
+            })
+            logger.info("codec=%s engine=%s save_mode=%s: %s", codec, engine, save_mode,
+                ", ".join(f"{stage}={seconds:.4f}s" for stage, seconds in stages.items()))
+
+        if memory:
+            report["memory"] = {codec: measure_memory(image_files, codec) for codec in codecs}
+            for codec, stats in report["memory"].items():
+                logger.info("memory codec=%s: %s", codec,
+                    ", ".join(f"{stat}={size / 2**20:.1f}MiB" for stat, size in stats.items()))
+
+    if startup:
+        report["startup"] = time_startup(repeat)
+        logger.info("startup: %s", ", ".join(f"{stage}={seconds:.4f}s" for stage, seconds in report["startup"].items()))
+
+    return report
+
+
+def _run_codec(run: typing.Dict[str, typing.Any]) -> str:
+    # Reports from before codecs were selectable only record whether images were validated
+    if "codec" in run:
+        return run["codec"]
+    return "pydantic" if run["validate"] else "lazy"
+
+
+def compare(old: typing.Dict[str, typing.Any], new: typing.Dict[str, typing.Any]) -> str:
+    """Format a comparison table of two reports from run_benchmark
+
+    Runs are matched up by their options; the ratio is new/old (lower is better).
+    """
+    def key(run):
+        return _run_codec(run), run["engine"], run["save_mode"]
+
+    old_runs = {key(run): run for run in old["runs"]}
+    lines = [f"{'codec':<9}{'engine':<11}{'save':<8}{'stage':<14}{'old':>10}{'new':>10}{'ratio':>8}"]
+    for run in new["runs"]:
+        old_run = old_runs.get(key(run))
+        if old_run is None:
+            continue
+        for stage in [*STAGES, "total"]:
+            old_time = old_run["stages"].get(stage) if stage != "total" else old_run["total"]
+            new_time = run["stages"][stage] if stage != "total" else run["total"]
+            if old_time is None:
+                continue
+            ratio = new_time / old_time if old_time else float("inf")
+            lines.append(
+                f"{_run_codec(run):<9}{run['engine']:<11}{run['save_mode']:<8}{stage:<14}"
+                f"{old_time:>10.4f}{new_time:>10.4f}{ratio:>8.2f}")
+
+    if "startup" in old and "startup" in new:
+        for stage in STARTUP_STAGES:
+            old_time, new_time = old["startup"].get(stage), new["startup"].get(stage)
+            if old_time is None or new_time is None:
+                continue
+            ratio = new_time / old_time if old_time else float("inf")
+            lines.append(f"{'startup':<28}{stage:<14}{old_time:>10.4f}{new_time:>10.4f}{ratio:>8.2f}")
+
+    # Memory in MiB
+    for codec, stats in new.get("memory", {}).items():
+        old_stats = old.get("memory", {}).get(codec)
+        if old_stats is None:
+            continue
+        for stat in MEMORY_STATS:
+            old_size, new_size = old_stats[stat] / 2**20, stats[stat] / 2**20
+            ratio = new_size / old_size if old_size else float("inf")
+            lines.append(f"{codec:<9}{'memory':<19}{stat:<14}{old_size:>10.1f}{new_size:>10.1f}{ratio:>8.2f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog="hosta_homework.bench", description="Benchmark the correction pipeline")
+    parser.add_argument("--images", type=int, default=3, help="Number of images. Default: 3")
+    parser.add_argument("--ops-per-image", type=int, default=1000, help="Number of ops_3d per image. Default: 1000")
+    parser.add_argument("--csv-rows", type=int, default=0, help="Pad the CSV to at least this many rows")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed. Default: 0")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per combination; the fastest counts. Default: 3")
+    parser.add_argument("--codecs", nargs="+", default=["lazy"], choices=model.codec.CODECS,
+        help="Image codecs to run. Default: lazy")
+    parser.add_argument("--validate", action="store_true", help="Also benchmark fully validated (pydantic) models")
+    parser.add_argument("--engines", nargs="+", default=list(model.join.ENGINES), choices=model.join.ENGINES,
+        help="Join engines to run. Default: all")
+    parser.add_argument("--save-modes", nargs="+", default=["model", "splice"],
+        choices=["model", "splice", *model.links.LINK_MODES], help="Save modes to run. Default: model splice")
+    parser.add_argument("--startup", action="store_true",
+        help="Also time the fixed cost of CLI invocations (import, --help and a small room)")
+    parser.add_argument("--memory", action="store_true",
+        help="Also measure the memory that a parsed room takes with each codec")
+    parser.add_argument("--output", type=Path, help="Write the json report here (default: stdout)")
+    parser.add_argument("--compare", nargs=2, type=Path, metavar=("OLD", "NEW"),
+        help="Instead of benchmarking, compare two json reports")
+    args = parser.parse_args()
+
+    if args.compare:
+        old, new = (json.loads(path.read_text()) for path in args.compare)
+        print(compare(old, new))
+    else:
+        # Per-op logging would dominate the reference engine's timings
+        logging.basicConfig(level=logging.ERROR, format="%(message)s")
+        logger.setLevel(logging.INFO)
+        report = run_benchmark(
+            args.images,
+            args.ops_per_image,
+            args.csv_rows,
+            args.seed,
+            args.repeat,
+            [*args.codecs, "pydantic"] if args.validate and "pydantic" not in args.codecs else args.codecs,
+            args.engines,
+            args.save_modes,
+            args.startup,
+            args.memory)
+
+        report_json = json.dumps(report, indent=2)
+        if args.output:
+            args.output.write_text(report_json)
+        else:
+            print(report_json)
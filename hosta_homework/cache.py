@@ -0,0 +1,131 @@
+"""Persistent on-disk cache of parsed input files
+
+Parsing the inputs (decoding the UTF-16 CSV, decoding and possibly validating every
+image json) and building their indexes is the bulk of the work of a run. When the
+same rooms are re-run with few or no changed files, that work can be skipped by
+unpickling the result of a previous run instead.
+
+Entries are keyed by what was built (e.g. "image-LazyImageFile") and by the input
+file, which is identified either by a hash of its contents (robust), or by its
+path, size and modification time (cheaper, but trusts the filesystem).
+
+The cache is bounded in size: when it grows beyond max_bytes, the least recently
+used entries are evicted. Recency is tracked with the entries' mtimes, so that
+several processes (e.g. batch workers) can safely share one cache directory.
+
+Note: entries are pickles, so only point this at a directory you trust.
+"""
+import hashlib
+import logging
+import os
+from pathlib import Path
+import pickle
+import tempfile
+import typing
+
+
+# Bump this whenever the pickled representations change, to invalidate old entries
+CACHE_VERSION = 2
+
+KEY_MODES = ("content", "stat")
+
+T = typing.TypeVar("T")
+
+
+class IndexCache:
+    """A size-bounded, LRU, on-disk cache of parsed files
+
+    Attributes:
+        directory (Path): Where cache entries are stored
+        max_bytes (int): Upper bound on the total size of all entries
+        key_mode (str): "content" to key files by content hash, "stat" by path, size and mtime
+        hits (int): Number of lookups that were served from the cache
+        misses (int): Number of lookups that had to be built
+    """
+
+    def __init__(self, directory: os.PathLike, max_bytes: int = 1 << 30, key_mode: str = "content"):
+        """IndexCache constructor
+
+        Parameters:
+            directory (PathLike): Where to store cache entries (created if needed)
+            max_bytes (int, optional): Upper bound on the total size of all entries. Default: 1GiB
+            key_mode (str, optional): "content" (default) or "stat"; see the module docstring
+        """
+        if key_mode not in KEY_MODES:
+            raise ValueError(f"Unknown cache key mode '{key_mode}'")
+
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.key_mode = key_mode
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, path: os.PathLike, kind: str) -> str:
+        """Compute the cache key of building kind from the file at path"""
+        digest = hashlib.blake2b(f"{CACHE_VERSION}:{kind}:".encode(), digest_size=20)
+        if self.key_mode == "content":
+            with open(path, "rb") as f:
+                digest.update(hashlib.file_digest(f, "blake2b").digest())
+        else:
+            stat = os.stat(path)
+            digest.update(f"{Path(path).resolve()}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return digest.hexdigest()
+
+    def get_or_build(self, path: os.PathLike, kind: str, build: typing.Callable[[], T]) -> T:
+        """Get the cached result of building kind from path, or build and cache it
+
+        Parameters:
+            path (PathLike): The input file
+            kind (str): Name of what is built from it; part of the cache key
+            build (callable): Builds the result from scratch on a cache miss
+
+        Returns:
+            The (possibly cached) result of build()
+        """
+        entry = self.directory / f"{self.key(path, kind)}.pickle"
+        try:
+            with open(entry, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logging.warning("Discarding unreadable cache entry %s", entry, exc_info=True)
+        else:
+            self.hits += 1
+            # Mark as recently used
+            os.utime(entry)
+            return value
+
+        self.misses += 1
+        value = build()
+        self._put(entry, value)
+        return value
+
+    def _put(self, entry: Path, value):
+        """Atomically write a cache entry, then evict old entries if needed"""
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f.name, entry)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        for e in os.scandir(self.directory):
+            if e.name.endswith(".pickle"):
+                try:
+                    stat = e.stat()
+                except FileNotFoundError:
+                    continue  # Evicted by somebody else
+                entries.append((stat.st_mtime_ns, stat.st_size, e.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
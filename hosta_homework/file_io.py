@@ -0,0 +1,210 @@
+"""Concurrent and atomic file I/O
+
+Reading and writing image files is mostly waiting on the filesystem (especially
+on network storage), so it is done in a pool of threads, overlapped with the
+CPU-bound work of parsing and serializing:
+  - prefetch runs a function (e.g. read_text) over many files in a thread pool,
+    a bounded number of files ahead of the consumer, and yields results in order
+  - open_text opens an input text file, transparently decompressing it if it is
+    gzip-compressed, and detecting its encoding from its byte order mark
+  - read_bytes reads a whole file, transparently decompressing it if it is
+    gzip- or zstd-compressed
+  - atomic_write writes a file to a temporary file in the same directory, fsyncs
+    it, then renames it into place, so that a crash never leaves a truncated
+    output behind.
+    Outputs can optionally be compressed with gzip, or zstd (which requires the
+    zstandard package)
+"""
+import codecs
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import gzip
+import io
+import os
+from pathlib import Path
+import threading
+import typing
+
+
+# Compression name -> file name suffix
+COMPRESSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+T = typing.TypeVar("T")
+R = typing.TypeVar("R")
+
+
+def prefetch(fn: typing.Callable[[T], R], items: typing.Iterable[T], workers: int = 4) -> typing.Iterator[R]:
+    """Map fn over items in a thread pool, yielding results in order
+
+    At most 2 * workers items are in flight at once, so that a slow consumer
+    does not end up with every file in memory.
+
+    Parameters:
+        fn (callable): Function to apply to every item, e.g. read_text
+        items (iterable): The items
+        workers (int, optional): Number of threads. With 1 or less, fn is simply called in this thread
+
+    Yields:
+        fn(item) for every item, in order
+    """
+    if workers <= 1:
+        yield from map(fn, items)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def read_text(path: os.PathLike) -> str:
+    """Read (and decode) a whole text file"""
+    with open(path, "r") as f:
+        return f.read()
+
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Checked in order: the UTF-32 marks start with the UTF-16 ones
+_BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+
+def detect_encoding(head: bytes) -> str:
+    """Guess the encoding of a text from its first bytes
+
+    A byte order mark decides; otherwise, NUL bytes in the first two bytes
+    (i.e. ASCII text in UTF-16) give away BOM-less UTF-16, and anything else is
+    taken to be UTF-8.
+    """
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return encoding
+    if head[:2].endswith(b"\x00"):
+        return "utf-16-le"
+    if head[:2].startswith(b"\x00"):
+        return "utf-16-be"
+    return "utf-8"
+
+
+def open_text(path: os.PathLike, newline: str | None = "") -> io.TextIOWrapper:
+    """Open an input text file for streaming, whatever its compression and encoding
+
+    Parameters:
+        path (PathLike): The file; it may be gzip-compressed (detected from its contents, not its name)
+        newline (str, optional): As for open(); defaults to "", as the csv module expects
+
+    Returns:
+        A text stream of the (decompressed, decoded) contents
+    """
+    with open(path, "rb") as f:
+        is_gzip = f.read(2) == _GZIP_MAGIC
+    binary = gzip.open(path, "rb") if is_gzip else open(path, "rb")
+    try:
+        encoding = detect_encoding(binary.peek(4)[:4])
+        return io.TextIOWrapper(binary, encoding=encoding, newline=newline)
+    except BaseException:
+        binary.close()
+        raise
+
+
+def read_bytes(path: os.PathLike) -> bytes:
+    """Read a whole file, decompressing it if it is compressed (detected from its contents)"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data.startswith(_GZIP_MAGIC):
+        return gzip.decompress(data)
+    if data.startswith(_ZSTD_MAGIC):
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd decompression requires the zstandard package (poetry install -E zstd)") from None
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+def compressed_path(path: os.PathLike, compression: str | None) -> Path:
+    """Add the file name suffix of compression to path"""
+    path = Path(path)
+    if compression is None:
+        return path
+    return path.with_name(path.name + COMPRESSIONS[compression])
+
+
+def _open_compressor(f: typing.BinaryIO, compression: str | None):
+    if compression is None:
+        return None
+    if compression == "gzip":
+        # A fixed mtime keeps the output reproducible
+        return gzip.GzipFile(fileobj=f, mode="wb", mtime=0)
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd compression requires the zstandard package (poetry install -E zstd)") from None
+        return zstandard.ZstdCompressor().stream_writer(f, closefd=False)
+    raise ValueError(f"Unknown compression '{compression}'")
+
+
+def atomic_write(
+        path: os.PathLike,
+        data: str | bytes | typing.Iterable[bytes | memoryview],
+        compression: str | None = None,
+    ):
+    """Write data to path through a temporary file and an atomic rename
+
+    The temporary file is fsynced before it is renamed, and the directory after,
+    so that even after a crash, path is either its old or its new contents, in full.
+
+    Parameters:
+        path (PathLike): The final path of the file (including any compression suffix)
+        data (str | bytes | iterable[bytes]): The contents; str is encoded to utf-8
+        compression (str, optional): "gzip" or "zstd" to compress the contents
+    """
+    path = Path(path)
+    if isinstance(data, str):
+        data = data.encode()
+    if isinstance(data, bytes):
+        data = (data,)
+
+    # Unlike tempfile's, this is created with the usual permissions (i.e. honouring the umask)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            compressor = _open_compressor(f, compression)
+            out = f if compressor is None else compressor
+            for chunk in data:
+                out.write(chunk)
+            if compressor is not None:
+                compressor.close()
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    _fsync_directory(path.parent)
+
+
+def _fsync_directory(directory: Path):
+    """Make a rename in directory durable (where directories can be opened, i.e. not on Windows)"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass  # Some file systems do not support fsyncing directories
+    finally:
+        os.close(fd)
@@ -0,0 +1,310 @@
+"""Logging set-up of the CLI: background handling, JSON lines, and aggregation
+
+The reference join engine logs a line per op_3d, so on large rooms the cost of
+formatting records and writing them out synchronously adds up. configure()
+sets up the root logger with any of:
+  - background: records are only put on a queue by the logging thread
+    (QueueHandler), and formatted and written by a QueueListener thread
+  - json_lines: each record is written as one json object, with its structured
+    fields (e.g. the outcome and item_id of an op_3d's join, see
+    hosta_homework.model.image_file) as keys of their own
+  - aggregation: of the records of each op_3d (those with an "outcome" field),
+    only the first few of each message (i.e. of each format string, whatever
+    its arguments) are let through, then at most rate_limit per second; the
+    rest are only counted, and a summary of what was suppressed is logged when
+    the run ends. Other records, such as batch progress and errors, are all
+    logged
+
+Filtering happens before records are queued, so suppressed records cost only
+their creation. That, too, is reduced while a session is active, by not
+collecting what none of its formats use: the thread's and multiprocessing
+process's names (through logging's public logThreads and logMultiprocessing
+flags, as in the logging HOWTO's "Optimization" section).
+
+Worker processes of hosta_homework.batch set up their logging alike, through
+worker_config and configure_worker.
+"""
+import atexit
+from contextlib import contextmanager
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+import typing
+
+
+TEXT_FORMAT = logging.BASIC_FORMAT
+
+# Attributes of every LogRecord; any others were passed as extra=
+_RECORD_ATTRIBUTES = {*logging.makeLogRecord({}).__dict__, "message", "asctime", "taskName"}
+
+# The active LoggingSession, if configure() was used
+_session = None
+# Whether _close_session is registered to run at exit (once, however many sessions there are)
+_atexit_registered = False
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formats each record as a json object on a single line
+
+    Keys: time (ISO 8601, UTC), level, logger, message, then any extra fields
+    of the record, and exception if it has exc_info.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        line.update((key, value) for key, value in record.__dict__.items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            line["exception"] = self.formatException(record.exc_info)
+        return json.dumps(line, default=str)
+
+
+class _MessageCount:
+    __slots__ = ("logged", "suppressed", "tokens", "updated", "record")
+
+    def __init__(self, record: logging.LogRecord):
+        self.logged = 0
+        self.suppressed = 0
+        self.tokens = 0.0
+        self.updated = 0.0
+        self.record = record
+
+
+class AggregatingFilter(logging.Filter):
+    """Lets through the first records of each message, then at most rate_limit per second
+
+    Messages are told apart by logger, level and format string. Only records
+    with the extra field named by field are aggregated, and never those of
+    level ERROR or above; every other record is let through.
+
+    Attributes:
+        samples (int): Number of records of each message that are always let through
+        rate_limit (float | None): Records per second of each message let through after those, or None for none
+        field (str | None): Extra field that marks the records to aggregate, or None to aggregate every record
+    """
+
+    def __init__(self, samples: int = 5, rate_limit: float | None = None, field: str | None = "outcome"):
+        super().__init__()
+        self.samples = samples
+        self.rate_limit = rate_limit
+        self.field = field
+        self.closed = False
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.closed or record.levelno >= logging.ERROR:
+            return True
+        if self.field is not None and not hasattr(record, self.field):
+            return True
+        key = (record.name, record.levelno, record.msg)
+        with self._lock:
+            count = self._counts.get(key)
+            if count is None:
+                count = self._counts[key] = _MessageCount(record)
+            if count.logged < self.samples:
+                count.logged += 1
+                return True
+
+            if self.rate_limit:
+                # A token bucket holding up to one second's worth of records
+                now = time.monotonic()
+                if count.updated:
+                    count.tokens = min(self.rate_limit, count.tokens + (now - count.updated) * self.rate_limit)
+                else:
+                    count.tokens = self.rate_limit
+                count.updated = now
+                if count.tokens >= 1:
+                    count.tokens -= 1
+                    count.logged += 1
+                    return True
+
+            count.suppressed += 1
+            return False
+
+    def summary(self) -> typing.List[typing.Tuple[logging.LogRecord, int, int]]:
+        """Get, for each message with suppressed records: its first record, and how many were logged and suppressed"""
+        with self._lock:
+            return [(count.record, count.logged, count.suppressed) for count in self._counts.values() if count.suppressed]
+
+    def log_summary(self):
+        """Stop filtering, and log a line for each message that had suppressed records"""
+        self.closed = True
+        for record, logged, suppressed in self.summary():
+            logging.getLogger(record.name).log(
+                record.levelno,
+                "Suppressed %d more (of %d) records like: %s",
+                suppressed,
+                logged + suppressed,
+                record.msg.splitlines()[0].rstrip() if isinstance(record.msg, str) else record.msg,
+                extra={"suppressed": suppressed, "total": logged + suppressed})
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that leaves formatting to the listener
+
+    QueueHandler formats records before queueing them, so that they can be
+    pickled to another process; these stay in this one.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class LoggingConfig(typing.NamedTuple):
+    """Options of configure() (see there), e.g. to repeat them in worker processes"""
+    level: int = logging.INFO
+    json_lines: bool = False
+    background: bool = False
+    samples: int | None = None
+    rate_limit: float | None = None
+
+
+class LoggingSession:
+    """The handlers that configure() installed on the root logger
+
+    Attributes:
+        config (LoggingConfig): The options it was configured with
+        handler (logging.Handler): The handler that writes records out
+        aggregator (AggregatingFilter | None): Filter of repeated records, if aggregating
+        listener (QueueListener | None): The background thread, if any
+    """
+
+    def __init__(self, config: LoggingConfig, stream: typing.TextIO | None = None):
+        self.config = config
+        self.handler = logging.StreamHandler(stream)
+        self.handler.setFormatter(JsonLinesFormatter() if config.json_lines else logging.Formatter(TEXT_FORMAT))
+
+        self.aggregator = None
+        if config.samples is not None or config.rate_limit is not None:
+            self.aggregator = AggregatingFilter(config.samples or 0, config.rate_limit)
+
+        self.listener = None
+        self.closed = False
+        if config.background:
+            records = queue.SimpleQueue()
+            self.listener = logging.handlers.QueueListener(records, self.handler, respect_handler_level=True)
+            self.root_handler = _DeferredQueueHandler(records)
+        else:
+            self.root_handler = self.handler
+        if self.aggregator is not None:
+            self.root_handler.addFilter(self.aggregator)
+
+    def start(self):
+        self._collected = (logging.logThreads, logging.logMultiprocessing)
+        logging.logThreads, logging.logMultiprocessing = False, False
+        root = logging.getLogger()
+        self._previous = (root.handlers[:], root.level)
+        for handler in self._previous[0]:
+            root.removeHandler(handler)
+        root.addHandler(self.root_handler)
+        root.setLevel(self.config.level)
+        if self.listener is not None:
+            self.listener.start()
+
+    def close(self):
+        """Log the summary of suppressed records, wait until every record is written, and restore the previous set-up"""
+        global _session
+        if self.closed:
+            return
+        self.closed = True
+        if self.aggregator is not None:
+            self.aggregator.log_summary()
+        if self.listener is not None:
+            self.listener.stop()
+        self.handler.flush()
+
+        root = logging.getLogger()
+        root.removeHandler(self.root_handler)
+        handlers, level = self._previous
+        for handler in handlers:
+            root.addHandler(handler)
+        root.setLevel(level)
+        logging.logThreads, logging.logMultiprocessing = self._collected
+        if _session is self:
+            _session = None
+
+
+def configure(
+        level: int = logging.INFO,
+        json_lines: bool = False,
+        background: bool = False,
+        samples: int | None = None,
+        rate_limit: float | None = None,
+        stream: typing.TextIO | None = None,
+    ) -> LoggingSession:
+    """Set up the root logger, replacing its handlers until the session is closed
+
+    Parameters:
+        level (int, optional): Level of the root logger
+        json_lines (bool, optional): Write records as json lines, rather than as text
+        background (bool, optional): Format and write records in a background thread
+        samples (int, optional):
+            Aggregate the repeated messages of each op_3d: let only this many records
+            of each through, then count the rest (see AggregatingFilter). Default: no aggregation
+        rate_limit (float, optional):
+            After the samples, still let through this many records of each message per second
+        stream (TextIO, optional): Where to write records. Default: sys.stderr
+
+    Returns:
+        The LoggingSession; close it at the end of the run, to log the summary
+        of suppressed records and flush the background thread
+    """
+    global _session, _atexit_registered
+    if _session is not None:
+        _session.close()
+    _session = LoggingSession(LoggingConfig(level, json_lines, background, samples, rate_limit), stream or sys.stderr)
+    _session.start()
+    if not _atexit_registered:
+        # Also if the run fails, so that the queued records are not lost
+        atexit.register(_close_session)
+        _atexit_registered = True
+    return _session
+
+
+def _close_session():
+    if _session is not None:
+        _session.close()
+
+
+@contextmanager
+def logging_session(*args, **kwargs):
+    """Like configure(), closing the session on exit"""
+    session = configure(*args, **kwargs)
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def worker_config() -> LoggingConfig | None:
+    """Get the options of the active session, to pass to configure_worker in a worker process"""
+    return None if _session is None else _session.config
+
+
+def configure_worker(config: LoggingConfig | None):
+    """Set up logging in a worker process like in its parent (meant as a process pool's initializer)
+
+    Each worker aggregates its own records, and logs its summary when it exits.
+    Without a config (i.e. the parent did not use configure), the inherited set-up is kept.
+    """
+    global _session
+    if config is None:
+        return
+    # Only imported here, as multiprocessing is a noticeable part of the CLI's start-up time
+    import multiprocessing.util
+
+    # A forked worker inherits its parent's session, which is the parent's to close
+    _session = None
+    session = configure(*config)
+    # Pool workers exit without running atexit handlers, but do run multiprocessing finalizers
+    multiprocessing.util.Finalize(session, session.close, exitpriority=10)
@@ -0,0 +1,209 @@
+"""Incremental reprocessing of a room, driven by a run manifest
+
+After each run, a manifest is written alongside the outputs which records, for
+each input image file:
+  - the hash of the input file
+  - the hash of the parent links resolved for it (i.e. the net effect of the
+    CSV rows that are relevant to it)
+  - the name and hash of the output file
+as well as the hash of the correction CSV, and the options that shape the
+outputs (join engine, codec, save mode and compression).
+
+On the next run, if neither the CSV, any image nor the options have changed,
+and all outputs are still as they were written, nothing is done at all.
+Otherwise the room is processed (which benefits from hosta_homework.cache, if
+used), but only the images whose input, parent links or output changed are
+rewritten; or all of them, if the options changed.
+
+Images are recorded by their resolved path, so that the same files given
+relative to another working directory are still recognised.
+
+Parent links are recorded, rather than raw CSV rows, because whether a CSV row
+is relevant to an image depends on every image of the room: a parent may live
+in another image than its child.
+"""
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import tempfile
+import typing
+
+from . import model
+
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 2
+
+
+def file_hash(path: os.PathLike) -> str:
+    """Hash the contents of a file"""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "blake2b").hexdigest()
+
+
+def links_hash(image) -> str:
+    """Hash the parent links of every op_3d of a parsed image"""
+    digest = hashlib.blake2b()
+    for op_3d in image.ops_3d:
+        digest.update(f"{op_3d.parent_id or ''}\n".encode())
+    return digest.hexdigest()
+
+
+class RunManifest:
+    """The manifest of a previous run, as stored in an output directory
+
+    Attributes:
+        path (Path): Where the manifest is stored
+        csv_hash (str | None): Hash of the correction CSV
+        options (dict[str, str | None] | None):
+            The "engine", "codec", "save_mode" and "compression" the outputs were written with
+        images (dict[str, dict[str, str]]):
+            For each resolved input image path: its "input_hash", "links_hash",
+            "output" (file name) and "output_hash"
+    """
+
+    def __init__(self, output_dir: os.PathLike):
+        """Load the manifest of output_dir, or start an empty one
+
+        Parameters:
+            output_dir (PathLike): The output directory of a room
+        """
+        self.path = Path(output_dir) / MANIFEST_NAME
+        self.csv_hash = None
+        self.options = None
+        self.images = {}
+
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logging.warning("Ignoring unreadable manifest %s", self.path)
+            return
+
+        if stored.get("version") == MANIFEST_VERSION:
+            self.csv_hash = stored["csv_hash"]
+            self.options = stored["options"]
+            self.images = stored["images"]
+
+    def output_is_current(self, image_file: str, output_dir: os.PathLike) -> bool:
+        """Check that the recorded output of image_file still exists, unmodified"""
+        entry = self.images.get(image_file)
+        if entry is None:
+            return False
+        try:
+            return file_hash(Path(output_dir) / entry["output"]) == entry["output_hash"]
+        except FileNotFoundError:
+            return False
+
+    def save(self):
+        """Atomically write the manifest"""
+        stored = {
+            "version": MANIFEST_VERSION,
+            "csv_hash": self.csv_hash,
+            "options": self.options,
+            "images": self.images,
+        }
+        with tempfile.NamedTemporaryFile("w", dir=self.path.parent, suffix=".tmp", delete=False) as f:
+            json.dump(stored, f, indent=2)
+        os.replace(f.name, self.path)
+
+
+def process_incremental(
+        image_files: typing.List[os.PathLike],
+        csv_file: os.PathLike,
+        output_dir: os.PathLike,
+        engine: str = "batch",
+        save_mode: str = "model",
+        compression: str | None = None,
+        infer_parents: float | None = None,
+        check_dimensions: str | None = None,
+        **room_options,
+    ) -> typing.List[Path]:
+    """Process a room, only rewriting outputs that would change
+
+    Parameters:
+        image_files (list[PathLike]): List of images file paths that comprise the room
+        csv_file (PathLike): Path to the room's correction csv
+        output_dir (PathLike): Where outputs, and the manifest, are stored
+        engine (str, optional): which join engine to use (see model.Room.process_corrections)
+        save_mode (str, optional): how to write the output files (see model.Room.save_images)
+        compression (str, optional): how to compress the output files (see model.Room.save_images)
+        infer_parents (float, optional): not supported; must be None
+        check_dimensions (str, optional): not supported; must be None
+        **room_options: Passed on to model.Room
+
+    Returns:
+        The paths of the output files that were (re)written
+    """
+    if save_mode in model.links.LINK_MODES:
+        # The manifest tracks one output per image, whereas a link table covers the whole room
+        raise ValueError(f"Save mode '{save_mode}' does not support incremental processing")
+    # The manifest does not record these options, so a run that only changed them would do nothing
+    if infer_parents is not None:
+        raise ValueError("Inferring parents does not support incremental processing")
+    if check_dimensions is not None:
+        raise ValueError("Checking dimensions does not support incremental processing")
+
+    manifest = RunManifest(output_dir)
+    keys = [str(Path(j).resolve()) for j in image_files]
+    input_hashes = [file_hash(j) for j in image_files]
+    csv_hash = file_hash(csv_file)
+
+    options = {
+        "engine": engine,
+        "codec": room_options.get("codec") or ("pydantic" if room_options.get("validate") else "lazy"),
+        "save_mode": save_mode,
+        "compression": compression,
+    }
+    # Any of them may change every output
+    same_options = options == manifest.options
+    unchanged = (
+        csv_hash == manifest.csv_hash
+        and same_options
+        and set(keys) == set(manifest.images)
+        and all(manifest.images[k]["input_hash"] == h for k, h in zip(keys, input_hashes))
+        and all(manifest.output_is_current(k, output_dir) for k in keys))
+    if unchanged:
+        logging.info("Room outputs in %s are up to date", output_dir)
+        return []
+
+    room = model.Room(image_files, **room_options).process_corrections(csv_file, engine=engine)
+
+    stale = set()
+    for index, (key, input_hash, image) in enumerate(zip(keys, input_hashes, room.images)):
+        entry = manifest.images.get(key, {})
+        if (not same_options
+                or entry.get("input_hash") != input_hash
+                or entry.get("links_hash") != links_hash(image)
+                or not manifest.output_is_current(key, output_dir)):
+            stale.add(index)
+
+    logging.info("Rewriting %d of %d images in %s", len(stale), len(keys), output_dir)
+    room.save_images(output_dir, force=True, mode=save_mode, only=stale, compression=compression)
+
+    written = []
+    new_images = {}
+    for index, (key, input_hash, image) in enumerate(zip(keys, input_hashes, room.images)):
+        out_filepath = room.output_path(output_dir, image, compression)
+        if index in stale:
+            written.append(out_filepath)
+            output_hash = file_hash(out_filepath)
+        else:
+            # Already checked to be current
+            output_hash = manifest.images[key]["output_hash"]
+        new_images[key] = {
+            "input_hash": input_hash,
+            "links_hash": links_hash(image),
+            "output": out_filepath.name,
+            "output_hash": output_hash,
+        }
+    manifest.csv_hash = csv_hash
+    manifest.options = options
+    manifest.images = new_images
+    manifest.save()
+
+    return written
@@ -0,0 +1,195 @@
+"""Run metrics: per-stage timings and memory, and counters
+
+A Metrics object is threaded through Room and CorrectionFile, which record into
+it the wall time (and optionally the peak traced memory) of each stage of a run:
+  - read: reading (and, for the CSV, decoding and splitting) input files
+  - validate: parsing image json into models
+  - index: building the ID lookup tables
+  - join: resolving parent links
+  - serialize: rendering output files
+  - write: writing output files
+
+as well as counters, such as the number of ops_3d that ended with each join
+outcome. At the end of a run, the metrics can be reported as json, or in the
+Prometheus text exposition format (e.g. for the node_exporter textfile collector).
+
+Peak memory is measured with tracemalloc, which has a significant overhead, so it
+is off unless requested with trace_memory=True. Note that tracemalloc's peak is
+process-wide, so the peaks of stages that run in several threads at once overlap.
+
+Stages may be recorded from several threads (e.g. by hosta_homework.file_io's
+pools); their seconds are then the sum over all threads.
+"""
+from contextlib import contextmanager
+import json
+import threading
+import time
+import tracemalloc
+import typing
+
+
+STAGES = ("read", "validate", "index", "join", "serialize", "write")
+
+
+class StageMetrics:
+    """Accumulated measurements of one stage
+
+    Attributes:
+        seconds (float): Total wall time spent in the stage
+        calls (int): Number of times the stage was entered
+        peak_bytes (int | None): Highest traced memory seen during the stage, if traced
+    """
+    __slots__ = ("seconds", "calls", "peak_bytes")
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.peak_bytes = None
+
+    def as_dict(self) -> typing.Dict[str, typing.Any]:
+        return {"seconds": self.seconds, "calls": self.calls, "peak_bytes": self.peak_bytes}
+
+
+class Metrics:
+    """Metrics of one run, possibly aggregated over several rooms
+
+    Attributes:
+        trace_memory (bool): Whether peak memory is measured
+        stages (dict[str, StageMetrics]): Measurements of each stage, in STAGES order
+        counters (dict[str, int]): Named counters
+        join_outcomes (dict[str, int]): Number of ops_3d that ended with each JoinOutcome
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        """Metrics constructor
+
+        Parameters:
+            trace_memory (bool, optional):
+                if true, measure the peak memory of each stage with tracemalloc
+                (started on first use, if not already tracing)
+        """
+        self.trace_memory = trace_memory
+        self.stages = {name: StageMetrics() for name in STAGES}
+        self.counters = {}
+        self.join_outcomes = {}
+        self._init_threading()
+
+    def _init_threading(self):
+        self._lock = threading.Lock()
+        # Per thread: the peaks of the stages currently entered, innermost last
+        self._local = threading.local()
+
+    @property
+    def _open_peaks(self) -> typing.List[int]:
+        try:
+            return self._local.open_peaks
+        except AttributeError:
+            self._local.open_peaks = []
+            return self._local.open_peaks
+
+    @contextmanager
+    def stage(self, name: str):
+        """Measure the enclosed block as (part of) stage name
+
+        Stages may be nested; an outer stage's time and peak include the inner's.
+        """
+        stage = self.stages.setdefault(name, StageMetrics())
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self._suspend_peak()
+            self._open_peaks.append(0)
+
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            seconds = time.perf_counter() - start
+            peak = None
+            if self.trace_memory:
+                open_peaks = self._open_peaks
+                peak = max(open_peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if open_peaks:
+                    open_peaks[-1] = max(open_peaks[-1], peak)
+                tracemalloc.reset_peak()
+
+            with self._lock:
+                stage.seconds += seconds
+                stage.calls += 1
+                if peak is not None:
+                    stage.peak_bytes = max(stage.peak_bytes or 0, peak)
+
+    def _suspend_peak(self):
+        """Save the peak of the innermost open stage, before tracemalloc's peak is reset"""
+        if self._open_peaks:
+            self._open_peaks[-1] = max(self._open_peaks[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+
+    def count(self, name: str, value: int = 1):
+        """Add value to the counter name"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def count_join(self, join_result):
+        """Count the outcomes of a join (a hosta_homework.model.join.JoinResult)"""
+        for outcome, value in join_result.counts().items():
+            key = outcome.name.lower()
+            self.join_outcomes[key] = self.join_outcomes.get(key, 0) + value
+
+    def merge(self, other: "Metrics"):
+        """Add the measurements of other into these (e.g. to aggregate rooms)"""
+        for name, theirs in other.stages.items():
+            ours = self.stages.setdefault(name, StageMetrics())
+            ours.seconds += theirs.seconds
+            ours.calls += theirs.calls
+            if theirs.peak_bytes is not None:
+                ours.peak_bytes = max(ours.peak_bytes or 0, theirs.peak_bytes)
+        for name, value in other.counters.items():
+            self.count(name, value)
+        for name, value in other.join_outcomes.items():
+            self.join_outcomes[name] = self.join_outcomes.get(name, 0) + value
+
+    def __getstate__(self):
+        # Neither locks nor open stages survive being sent to another process
+        state = self.__dict__.copy()
+        del state["_lock"], state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_threading()
+
+    def report(self) -> typing.Dict[str, typing.Any]:
+        """Get a json-serializable run report"""
+        return {
+            "stages": {name: stage.as_dict() for name, stage in self.stages.items()},
+            "join_outcomes": dict(self.join_outcomes),
+            "counters": dict(self.counters),
+        }
+
+    def to_json(self, indent: int | None = 2) -> str:
+        """Render the run report as json"""
+        return json.dumps(self.report(), indent=indent)
+
+    def to_prometheus(self, prefix: str = "hosta") -> str:
+        """Render the metrics in the Prometheus text exposition format"""
+        lines = [
+            f"# HELP {prefix}_stage_seconds Wall time spent in each stage of the run",
+            f"# TYPE {prefix}_stage_seconds gauge",
+            *(f'{prefix}_stage_seconds{{stage="{name}"}} {stage.seconds!r}' for name, stage in self.stages.items()),
+        ]
+        if any(stage.peak_bytes is not None for stage in self.stages.values()):
+            lines += [
+                f"# HELP {prefix}_stage_peak_bytes Peak traced memory during each stage of the run",
+                f"# TYPE {prefix}_stage_peak_bytes gauge",
+                *(f'{prefix}_stage_peak_bytes{{stage="{name}"}} {stage.peak_bytes}'
+                    for name, stage in self.stages.items() if stage.peak_bytes is not None),
+            ]
+        lines += [
+            f"# HELP {prefix}_join_outcomes_total Number of ops_3d that ended with each join outcome",
+            f"# TYPE {prefix}_join_outcomes_total counter",
+            *(f'{prefix}_join_outcomes_total{{outcome="{name}"}} {value}' for name, value in self.join_outcomes.items()),
+        ]
+        for name, value in self.counters.items():
+            lines += [f"# TYPE {prefix}_{name}_total counter", f"{prefix}_{name}_total {value}"]
+        return "\n".join(lines) + "\n"
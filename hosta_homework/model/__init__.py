@@ -2,11 +2,40 @@
 
 In particular:
     - ImageFile: representation of image json files
+    - LazyImageFile: unvalidated, fast-path representation of image json files
+    - codec: registry of the above, and optional faster (orjson, msgspec) or smaller (compact) ones
+    - struct_image_file: msgspec structs of image json files (the msgspec codec)
+    - op_store: column-wise storage of ops_3d (the compact codec)
     - CorrectionFile: representation of csv files
     - Room: container representing all images in a room
+    - links: sidecar tables of the parent links that processing a Room makes
+    - dimensions: cross-check of the dimensions of ops_3d against those of their corrections
+    - hierarchy: parent/child index of the objects of a Room
+    - identity: index of every alias (item_id, imageIds, CSV Object_ID) of every object of a Room
+    - spatial: inference of missing parents from the geometry of ops_3d
 """
+import importlib
 
-from .correction_file import CorrectionFile
-from .image_file import ImageFile
-from .room import Room
+
+# Exported name -> defining submodule. These are only imported on first use (PEP 562),
+# so that using a light submodule (e.g. join, for the CLI's --help) does not pay for pydantic
+_EXPORTS = {
+    "CorrectionFile": ".correction_file",
+    "ImageFile": ".image_file",
+    "LazyImageFile": ".lazy_image_file",
+    "Room": ".room",
+}
+_SUBMODULES = {
+    "codec", "correction_file", "dimensions", "hierarchy", "identity", "image_file", "join", "lazy_image_file", "links",
+    "op_store", "room", "spatial", "splice", "struct_image_file"}
+
+__all__ = [*_EXPORTS, *sorted(_SUBMODULES)]
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        return getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    if name in _SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
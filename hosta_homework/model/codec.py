@@ -0,0 +1,64 @@
+"""Registry of image file codecs
+
+A codec is a class that parses image json files into a representation that
+hosta_homework.model.Room can process, and serializes them back. All of them are
+duck-typed alike: they have model_validate_json and model_dump_json (named after
+pydantic's), image_info and ops_3d, and their ops_3d share the correction logic
+of ImageFile.Op3D.
+
+    - pydantic: ImageFile. The reference: validates everything, but is the slowest
+    - lazy: LazyImageFile. Does not validate; parses and serializes with pydantic-core
+    - orjson: OrjsonImageFile. Likewise, with orjson (optional dependency)
+    - msgspec: StructImageFile. Validates everything, like ImageFile, but into
+      msgspec structs, which is several times faster (optional dependency)
+    - compact: CompactImageFile. Validates with ImageFile, then keeps each image's
+      ops_3d column-wise in an OpStore, which takes several times less memory
+
+All of them give the same output as ImageFile.model_dump_json(exclude_unset=True),
+except that the lazy ones pass through fields that ImageFile does not model.
+Optional codecs are only imported when asked for.
+"""
+import importlib
+import importlib.util
+import typing
+
+
+# Codec name -> (module, class, required package)
+_CODECS = {
+    "pydantic": (".image_file", "ImageFile", None),
+    "lazy": (".lazy_image_file", "LazyImageFile", None),
+    "orjson": (".lazy_image_file", "OrjsonImageFile", "orjson"),
+    "msgspec": (".struct_image_file", "StructImageFile", "msgspec"),
+    "compact": (".op_store", "CompactImageFile", None),
+}
+
+CODECS = tuple(_CODECS)
+
+# Codecs that validate, and so write exactly what ImageFile does, and give UUIDs (not strings) as unique_ids
+VALIDATING = frozenset({"pydantic", "msgspec", "compact"})
+
+
+def is_available(name: str) -> bool:
+    """Check whether the package that codec name requires (if any) is installed"""
+    requirement = _CODECS[name][2]
+    return requirement is None or importlib.util.find_spec(requirement) is not None
+
+
+def available_codecs() -> typing.List[str]:
+    """Get the names of the codecs that can be used here"""
+    return [name for name in CODECS if is_available(name)]
+
+
+def get_codec(name: str) -> type:
+    """Get the image file class of codec name
+
+    Raises:
+        ValueError: if there is no such codec, or the package it requires is not installed
+    """
+    try:
+        module, cls, requirement = _CODECS[name]
+    except KeyError:
+        raise ValueError(f"Unknown codec '{name}'") from None
+    if not is_available(name):
+        raise ValueError(f"The {name} codec requires the {requirement} package")
+    return getattr(importlib.import_module(module, __package__), cls)
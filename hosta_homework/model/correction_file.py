@@ -1,17 +1,38 @@
 """Model and functionality of a CSV correction-file
 
 For lack of better name, that's what I've called it
+
+Correction files can get very large (millions of rows), so rather than keeping a
+model instance per row, the parsed data is stored column-wise in typed arrays:
+  - ID columns are dictionary-encoded into integer codes (see CorrectionFile.ids)
+  - Dimension columns are parsed into floats, in normalized units (see parse_dimension)
 """
+from array import array
 import csv
+import functools
+from itertools import compress, count
+import logging
+import math
 from pathlib import Path
 import re
+import sys
+import typing
 
 from pydantic import BaseModel, Field, create_model
 
+from ..metrics import Metrics
+from .. import file_io
+
+
+T = typing.TypeVar("T")
+
 
 class CorrectionEntry(BaseModel):
     """Entry in the CSV file
 
+    CorrectionFile does not keep an instance of this per row (see the module
+    docstring); it serves as the schema of the expected columns.
+
     Subclass with class method CorrectionEntry.with_images,
     in case you ever wanted not exactly 3 image ID columns
 
@@ -36,9 +57,12 @@ class CorrectionEntry(BaseModel):
     host_id: str = Field(alias="Host_ID")
 
     @classmethod
+    @functools.cache
     def with_images(cls, num_images: int):
         """Create a version of CorrectionEntry with added ImageN_Object_ID fields
 
+        Building a pydantic model is slow, so each version is only created once.
+
         Parameters:
           num_images (int): Number of 1-indexed image columns to add to a subclass
 
@@ -52,15 +76,150 @@ class CorrectionEntry(BaseModel):
         )
 
 
+# Multipliers to convert a dimension's unit into feet (lengths) or square feet (areas)
+UNITS = {
+    "ft": 1.0,
+    "lf": 1.0,
+    "in": 1 / 12,
+    "m": 1 / 0.3048,
+    "cm": 1 / 30.48,
+    "mm": 1 / 304.8,
+    "sf": 1.0,
+    "sq ft": 1.0,
+    "ft²": 1.0,
+    "m²": 1 / 0.3048 ** 2,
+}
+
+_IMAGE_COLUMN = re.compile(r"Image(\d+)_Object_ID")
+
+_DIMENSION = re.compile(r"\s*([-+]?(?:\d+\.?\d*|\.\d+))\s*(.*?)\s*$")
+
+
+def parse_dimension(value: str) -> float:
+    """Parse a dimension cell like "2.88 ft" or "20.25 SF" into a number of (square) feet
+
+    Parameters:
+        value (str): The raw cell value
+
+    Returns:
+        The normalized value, or NaN if the cell is empty
+
+    Raises:
+        ValueError: if the cell can't be parsed or its unit is unknown
+    """
+    if not value:
+        return math.nan
+
+    match = _DIMENSION.match(value)
+    if not match:
+        raise ValueError(f"Cannot parse dimension '{value}'")
+
+    number, unit = match.groups()
+    try:
+        return float(number) * UNITS[unit.lower() or "ft"]
+    except KeyError:
+        raise ValueError(f"Unknown unit in dimension '{value}'") from None
+
+
+def _merge_columns(columns: typing.List[typing.Dict[str, T]]) -> typing.Dict[str, T]:
+    """Merge per image column dictionaries into one, where later columns take precedence
+
+    Reuses (and consumes) the last column's dictionary.
+    """
+    if not columns:
+        return {}
+    merged = columns[-1]
+    for column in reversed(columns[:-1]):
+        for key, value in column.items():
+            merged.setdefault(key, value)
+        column.clear()
+    return merged
+
+
+class CorrectionRow:
+    """Lightweight view of one row of a CorrectionFile
+
+    Exposes the same attributes as CorrectionEntry, except that dimensions
+    are floats in normalized units (see parse_dimension) rather than strings.
+    """
+    __slots__ = ("_file", "index")
+
+    def __init__(self, correction_file: "CorrectionFile", index: int):
+        self._file = correction_file
+        self.index = index
+
+    @property
+    def object_id(self) -> str:
+        return self._file.ids[self._file.object_ids[self.index]]
+
+    @property
+    def host_id(self) -> str:
+        return self._file.ids[self._file.host_ids[self.index]]
+
+    @property
+    def family_and_type(self) -> str:
+        return self._file.family_and_type[self.index]
+
+    def image_object_id(self, column: str) -> str:
+        """Get the value of an ImageN_Object_ID column for this row ("" if ignorable)"""
+        return self._file.ids[self._file.image_object_ids[column][self.index]]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            # Not a dimension; also keeps unpickling from recursing before _file is set
+            raise AttributeError(name)
+        try:
+            return self._file.dimensions[name][self.index]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __eq__(self, other):
+        return isinstance(other, CorrectionRow) and (self._file, self.index) == (other._file, other.index)
+
+    def __hash__(self):
+        return hash((id(self._file), self.index))
+
+    def __repr__(self):
+        return f"CorrectionRow(object_id={self.object_id!r}, host_id={self.host_id!r})"
+
+
 class CorrectionFile:
     """Representation of the entire CSV Correction file
 
+    The file is read in a single streaming pass, which builds corrections_by_id and
+    object_id_to_image_id as rows arrive. Of the rows themselves, only those which
+    are corrections (i.e. have a Host_ID and an ImageN_Object_ID), and only their
+    Object_ID and Host_ID, are kept; so memory only grows with the indexes.
+    With keep_rows=True, every row which has an Object_ID or Host_ID is kept, with
+    all of its columns.
+
     Attributes:
-        data (list[CorrectionEntry]): 
-            All parsed data rows from the input file (if they have an Object_ID or Host_ID)
+        ids (list[str]):
+            Every distinct ID string in the kept rows. ID columns store indexes into this list.
+            Code 0 is always the empty string, which also stands in for ignorable
+            ("0" or "") values of the ImageN_Object_ID columns
+
+        num_rows (int): Number of rows in the file which have an Object_ID or Host_ID
+
+        object_ids (array[int]): Code of the Object_ID of each kept row
+
+        host_ids (array[int]): Code of the Host_ID of each kept row
+
+        image_object_ids (dict[str, array[int]]):
+            Codes of each ImageN_Object_ID column (only with keep_rows)
+
+        family_and_type (list[str]): The "Family and Type" of each row (only with keep_rows)
+
+        dimensions (dict[str, array[float]]):
+            The height, depth, width, trim_length and area of each row, in feet
+            or square feet; NaN where not specified or unparseable (only with keep_rows)
 
-        corrections_by_id (dict[str, CorrectionEntry): 
-            The CorrectionEntries in self.data, indexed by ImageN_Object_ID.
+        invalid_dimensions (dict[int, list[str]]):
+            For each kept row with dimension cells that could not be parsed (see
+            parse_dimension), the names of those dimensions (only with keep_rows)
+
+        corrections_by_id (dict[str, CorrectionRow): 
+            The rows, indexed by ImageN_Object_ID.
             Note: objects present in multiple images will exist in this dictionary under
                   every applicable ID.
             Also note: sometimes, there are multiple rows representing the same objects; 
@@ -70,8 +229,8 @@ class CorrectionFile:
         object_id_to_image_id (dict[str, str]):
             Mapping between IDs in the columns Object_ID/Host_ID to the respective ImageN_Object_ID
             Note: a particular object_id can be referred to by multiple image object IDs; this 
-                  mapping has picked *one* of them, subject to the whims of python dictionary
-                  ordering. Since all the data is accessible by any IDs, it shouldn't matter in
+                  mapping has picked *one* of them: the one in the last image column.
+                  Since all the data is accessible by any IDs, it shouldn't matter in
                   practice, but if in the future, that distinction matters, this logic should
                   be amended
 
@@ -79,37 +238,163 @@ class CorrectionFile:
     not only 3, as in the example data.
     """
 
-    def __init__(self, csv_file: Path):
+    _dimension_columns = {
+        "height": "Height",
+        "depth": "Depth",
+        "width": "Width",
+        "trim_length": "Trim Length",
+        "area": "Area",
+    }
+
+    def __init__(self, csv_file: Path, metrics: Metrics | None = None, keep_rows: bool = False):
         """CorrectionFile constructor
 
         Parameters:
-            csv_path (Path): A path to a CSV file featuring corrections for processed Images
+            csv_path (Path):
+                A path to a CSV file featuring corrections for processed Images.
+                It may be gzip-compressed, and UTF-8 or UTF-16 encoded (see file_io.open_text)
+            metrics (hosta_homework.metrics.Metrics, optional): where to record the time spent parsing
+            keep_rows (bool, optional): if true, keep all the columns of every row, not only of corrections
         """
-        # Read in data where Object_ID and Host_ID are both specified
-        with open(csv_file, encoding='utf-16') as f:
-            reader = csv.DictReader(f, dialect=csv.excel_tab)
-            self._image_keys = {field for field in reader.fieldnames if re.match(r"Image\d_Object_ID", field)}
-            self._row_model = CorrectionEntry.with_images(len(self._image_keys))
-            self.data = [self._row_model.model_validate(r) for r in reader if r["Object_ID"] or r["Host_ID"]]
-
-        ignore_values = {"0", ""}
-
-        self.corrections_by_id = {
-            getattr(entry, id_): entry
-            for id_ in self._image_keys
-            for entry in self.data
-            if getattr(entry, id_) not in ignore_values and entry.host_id
-        }
-
-        self.object_id_to_image_id = {
-            entry.object_id: getattr(entry, id_)
-            for id_ in self._image_keys
-            for entry in self.data
-            if getattr(entry, id_) not in ignore_values
-        }
+        if metrics is None:
+            metrics = Metrics()
+
+        self.ids = [""]
+        codes = {"": 0}
+
+        def encode(value: str) -> int:
+            try:
+                return codes[value]
+            except KeyError:
+                codes[value] = len(self.ids)
+                self.ids.append(value)
+                return codes[value]
+
+        self.keep_rows = keep_rows
+        self.num_rows = 0
+        self.object_ids = array("l")
+        self.host_ids = array("l")
+        self.image_object_ids = {}
+        self.family_and_type = []
+        self.dimensions = {}
+        self.invalid_dimensions = {}
+
+        with metrics.stage("read"), file_io.open_text(csv_file) as f:
+            reader = csv.reader(f, dialect=csv.excel_tab)
+            header = next(reader, [])
+            self._image_keys = sorted(
+                (field for field in header if _IMAGE_COLUMN.fullmatch(field)),
+                key=lambda field: int(_IMAGE_COLUMN.fullmatch(field).group(1)))
+
+            # The row model documents (and here, checks) the expected columns
+            row_model = CorrectionEntry.with_images(len(self._image_keys))
+            columns = {f.alias or name for name, f in row_model.model_fields.items()}
+            missing = columns - set(header)
+            if missing:
+                raise ValueError(f"Correction file ({csv_file}) is missing columns: {sorted(missing)}")
+
+            column_index = {field: i for i, field in enumerate(header)}
+            object_column = column_index["Object_ID"]
+            host_column = column_index["Host_ID"]
+            family_column = column_index["Family and Type"]
+            image_columns = [column_index[key] for key in self._image_keys]
+            if keep_rows:
+                self.image_object_ids = {key: array("l") for key in self._image_keys}
+                self.dimensions = {name: array("d") for name in self._dimension_columns}
+            kept_image_ids = list(zip(self.image_object_ids.values(), image_columns))
+            kept_dimensions = [
+                (name, values, column_index[self._dimension_columns[name]])
+                for name, values in self.dimensions.items()]
+
+            # Built per image column (later rows taking precedence), then merged (later columns taking precedence)
+            corrections = [{} for _ in image_columns]
+            object_to_image = [{} for _ in image_columns]
+
+            for r in reader:
+                if len(r) < len(header):
+                    if not r:
+                        continue  # Blank line
+                    # Short row; as csv.DictReader would, treat the missing cells as empty
+                    r += [""] * (len(header) - len(r))
+
+                object_id = r[object_column]
+                host_id = r[host_column]
+                if not (object_id or host_id):
+                    continue
+                self.num_rows += 1
+
+                image_ids = [(i, r[column]) for i, column in enumerate(image_columns) if r[column] not in ("", "0")]
+                if not (keep_rows or (host_id and image_ids)):
+                    # Only contributes to object_id_to_image_id
+                    for image_column, image_id in image_ids:
+                        object_to_image[image_column][object_id] = image_id
+                    continue
+
+                index = len(self.object_ids)
+                self.object_ids.append(encode(object_id))
+                self.host_ids.append(encode(host_id))
+                for image_column, image_id in image_ids:
+                    object_to_image[image_column][object_id] = image_id
+                    if host_id:
+                        corrections[image_column][image_id] = index
+
+                if keep_rows:
+                    for values, column in kept_image_ids:
+                        value = r[column]
+                        values.append(0 if value == "0" else encode(value))
+                    self.family_and_type.append(sys.intern(r[family_column]))
+                    for name, values, column in kept_dimensions:
+                        try:
+                            values.append(parse_dimension(r[column]))
+                        except ValueError as e:
+                            # One bad cell should not abort the whole file; check_dimensions reports these
+                            values.append(math.nan)
+                            self.invalid_dimensions.setdefault(index, []).append(name)
+                            logging.warning("%s (row %d, Object_ID %s)", e, reader.line_num, object_id)
+
+        if self.invalid_dimensions:
+            metrics.count("invalid_dimension_rows", len(self.invalid_dimensions))
+
+        with metrics.stage("index"):
+            self.object_id_to_image_id = _merge_columns(object_to_image)
+            self.corrections_by_id = _merge_columns(corrections)
+            for image_id, index in self.corrections_by_id.items():
+                self.corrections_by_id[image_id] = CorrectionRow(self, index)
+
+    def build_indexes(self):
+        """(Re)build corrections_by_id and object_id_to_image_id from the columns
+
+        The constructor already builds them as it reads the file; this requires keep_rows.
+        Later image columns, and later rows within a column, take precedence.
+        """
+        if not self.keep_rows:
+            raise ValueError("Rebuilding the indexes of a CorrectionFile requires keep_rows=True")
+
+        decode = self.ids.__getitem__
+
+        self.corrections_by_id = {}
+        self.object_id_to_image_id = {}
+        for key in self._image_keys:
+            column = self.image_object_ids[key]
+
+            # Rows with an image ID (nonzero code) and a Host_ID are corrections
+            has_host = map(min, zip(column, self.host_ids))
+            self.corrections_by_id.update(
+                (image_id, CorrectionRow(self, i))
+                for image_id, i in compress(zip(map(decode, column), count()), has_host))
+
+            self.object_id_to_image_id.update(
+                compress(zip(map(decode, self.object_ids), map(decode, column)), column))
+
+    def __len__(self):
+        """Get the number of kept rows (see object_ids): all of them with keep_rows, otherwise only corrections"""
+        return len(self.object_ids)
+
+    def row(self, index: int) -> CorrectionRow:
+        """Get a view of the row at index"""
+        return CorrectionRow(self, index)
 
     @property
     def num_images(self):
         """Get the number of image columns this CSV represents"""
         return len(self._image_keys)
-
@@ -0,0 +1,113 @@
+"""Cross-check of the dimensions of each op_3d against those of its correction
+
+Both the CSV and the images give the width, height and depth of objects (the
+CSV in the dimension columns of each row, which CorrectionFile parses into
+feet, and ops_3d in feet). A join that matched an op to the wrong row usually
+shows as dimensions that disagree, so checking them catches bad joins.
+
+The dimensions in the images are estimates, snapped to standard sizes, so they
+are only expected to agree within a tolerance, as in math.isclose:
+
+    |csv - op| <= max(rel_tol * max(|csv|, |op|), abs_tol)
+
+Dimensions that are missing on either side are not compared. Those that the
+CSV gives, but in cells that could not be parsed (see
+CorrectionFile.invalid_dimensions), are not compared either, but reported as
+invalid: a category of their own, apart from the mismatches.
+
+As in hosta_homework.model.join, each step is done for every op at once, as
+bulk operations over columns, rather than op by op.
+"""
+from array import array
+import math
+import operator
+from operator import attrgetter
+import typing
+
+
+DIMENSIONS = ("width", "height", "depth")
+
+
+class DimensionCheck(typing.NamedTuple):
+    """Per-op results of a dimension check, in Room order
+
+    Attributes:
+        rows (array[int]): Index of each op's correction row in the CorrectionFile, or -1 if it has none
+        deviations (array[float]):
+            The largest relative difference between the CSV's and the op's dimensions,
+            over the dimensions known on both sides; NaN where there were none
+        mismatched (array[int]): 1 where a dimension differs beyond the tolerance, else 0
+        invalid (array[int]): 1 where a checked dimension's cell in the CSV row could not be parsed, else 0
+    """
+    rows: array
+    deviations: array
+    mismatched: array
+    invalid: array
+
+    def mismatches(self) -> typing.List[int]:
+        """Get the indexes of the mismatched ops"""
+        return [index for index, mismatched in enumerate(self.mismatched) if mismatched]
+
+    def invalids(self) -> typing.List[int]:
+        """Get the indexes of the ops whose CSV row has unparseable dimensions"""
+        return [index for index, invalid in enumerate(self.invalid) if invalid]
+
+
+def check_dimensions(
+        images,
+        correction_file,
+        rel_tol: float = 0.5,
+        abs_tol: float = 0.5,
+    ) -> DimensionCheck:
+    """Compare the dimensions of every op with a correction against those of its CSV row
+
+    Parameters:
+        images (list[ImageFile | LazyImageFile]): The images of a Room
+        correction_file (CorrectionFile): parsed corrections, with keep_rows=True
+        rel_tol (float, optional): Relative tolerance (see the module documentation)
+        abs_tol (float, optional): Absolute tolerance, in feet
+
+    Raises:
+        ValueError: if correction_file was not parsed with keep_rows=True
+    """
+    if not correction_file.keep_rows:
+        raise ValueError("Checking dimensions requires a CorrectionFile parsed with keep_rows=True")
+
+    ops = [op_3d for image in images for op_3d in image.ops_3d]
+    corrections = map(correction_file.corrections_by_id.get, (str(op_3d.item_id) for op_3d in ops))
+    rows = array("l", [-1 if row is None else row.index for row in corrections])
+
+    # Only the ops with a correction are compared
+    matched = [index for index, row in enumerate(rows) if row >= 0]
+    matched_ops = list(map(ops.__getitem__, matched))
+    matched_rows = list(map(rows.__getitem__, matched))
+
+    # Per matched op, over the dimensions so far; -1 until one was compared
+    largest = [-1.0] * len(matched)
+    mismatches = [False] * len(matched)
+    for name in DIMENSIONS:
+        expected = list(map(correction_file.dimensions[name].__getitem__, matched_rows))
+        actual = [math.nan if value is None else value for value in map(attrgetter(name), matched_ops)]
+        # NaN wherever either side is missing, and every comparison with NaN is False
+        differences = [abs(e - a) for e, a in zip(expected, actual)]
+        scales = list(map(max, map(abs, expected), map(abs, actual)))
+        mismatches = list(map(operator.or_, mismatches, [
+            difference > rel_tol * scale and difference > abs_tol
+            for difference, scale in zip(differences, scales)]))
+        largest = list(map(max, largest, [
+            (difference / scale if scale else 0.0) if difference == difference else -1.0
+            for difference, scale in zip(differences, scales)]))
+
+    deviations = array("d", [math.nan]) * len(ops)
+    mismatched = array("b", bytes(len(ops)))
+    for index, deviation, mismatch in zip(matched, largest, mismatches):
+        if deviation >= 0:
+            deviations[index] = deviation
+        mismatched[index] = mismatch
+
+    invalid = array("b", bytes(len(ops)))
+    if correction_file.invalid_dimensions:
+        for index, row in zip(matched, matched_rows):
+            if not set(DIMENSIONS).isdisjoint(correction_file.invalid_dimensions.get(row, ())):
+                invalid[index] = 1
+    return DimensionCheck(rows, deviations, mismatched, invalid)
@@ -0,0 +1,153 @@
+"""In-memory index of the parent/child hierarchy of a Room's objects
+
+Correction processing only records each op's parent as its parent_id. Walking
+the hierarchy (e.g. from an interior wall to its doors, windows and cabinets)
+from that alone takes a scan over every op per step. A Hierarchy indexes it once,
+in linear time, so that parent and child lookups take constant time, and can
+then be kept up to date as parent_ids change (see Room.hierarchy), by refreshing
+only the objects whose ops changed.
+
+Objects are keyed by str(unique_id). The same object appears as an op in every
+image it was seen in, so a node may stand for several ops. Its parent is that of
+the last of its ops (in Room order) which has a parent_id.
+
+The parent_ids come from data, so the hierarchy is not guaranteed to be a forest:
+  - orphans are objects whose parent_id is not the unique_id of any object
+  - cycles are chains of parent_ids that loop back onto themselves
+Queries never loop forever on either.
+"""
+import typing
+
+
+class Hierarchy:
+    """Parent/child index of the objects of a room
+
+    Attributes:
+        supercategories (dict[str, str]): The supercategory of every object
+    """
+
+    def __init__(self):
+        self.supercategories = {}
+        self._ops = {}
+        self._parents = {}
+        # Ordered sets, for deterministic query results
+        self._children = {}
+        self._by_supercategory = {}
+
+    @classmethod
+    def from_room(cls, room) -> "Hierarchy":
+        """Index every op of every image of a Room"""
+        hierarchy = cls()
+        for image in room.images:
+            for op_3d in image.ops_3d:
+                hierarchy.add(op_3d)
+        return hierarchy
+
+    def add(self, op_3d):
+        """Index an op (of any codec), as one more sighting of its object"""
+        key = str(op_3d.unique_id)
+        supercategory = op_3d.supercategory
+        self._ops.setdefault(key, []).append(op_3d)
+        previous = self.supercategories.get(key)
+        if previous != supercategory:
+            if previous is not None:
+                del self._by_supercategory[previous][key]
+            self._by_supercategory.setdefault(supercategory, {})[key] = None
+            self.supercategories[key] = supercategory
+        parent_id = op_3d.parent_id
+        if parent_id is not None:
+            self._set_parent(key, str(parent_id))
+
+    def refresh(self, unique_id):
+        """Update the parent of an object, after the parent_id of any of its ops changed"""
+        key = str(unique_id)
+        parent_ids = (op_3d.parent_id for op_3d in reversed(self._ops.get(key, ())))
+        parent_id = next((parent_id for parent_id in parent_ids if parent_id is not None), None)
+        self._set_parent(key, None if parent_id is None else str(parent_id))
+
+    def _set_parent(self, key: str, parent: str | None):
+        previous = self._parents.get(key)
+        if previous == parent:
+            return
+        if previous is not None:
+            del self._children[previous][key]
+        if parent is None:
+            self._parents.pop(key, None)
+        else:
+            self._parents[key] = parent
+            self._children.setdefault(parent, {})[key] = None
+
+    def __contains__(self, unique_id) -> bool:
+        return str(unique_id) in self.supercategories
+
+    def __len__(self) -> int:
+        return len(self.supercategories)
+
+    def parent_of(self, unique_id) -> str | None:
+        """Get the unique_id of an object's parent, if it has one"""
+        return self._parents.get(str(unique_id))
+
+    def children_of(self, unique_id) -> typing.List[str]:
+        """Get the unique_ids of an object's children"""
+        return list(self._children.get(str(unique_id), ()))
+
+    def ancestors(self, unique_id) -> typing.List[str]:
+        """Get the unique_ids of an object's parent, grandparent and so on, nearest first
+
+        On a cycle, this stops before repeating an object.
+        """
+        key = str(unique_id)
+        seen = {key}
+        ancestors = []
+        while (key := self._parents.get(key)) is not None and key not in seen:
+            seen.add(key)
+            ancestors.append(key)
+        return ancestors
+
+    def subtree(self, unique_id) -> typing.List[str]:
+        """Get the unique_ids of an object and all of its descendants, depth first"""
+        root = str(unique_id)
+        seen = {root}
+        subtree = []
+        stack = [root]
+        while stack:
+            key = stack.pop()
+            subtree.append(key)
+            children = [child for child in self._children.get(key, ()) if child not in seen]
+            seen.update(children)
+            stack.extend(reversed(children))
+        return subtree
+
+    def of_supercategory(self, supercategory: str) -> typing.List[str]:
+        """Get the unique_ids of every object of a supercategory (e.g. "interior_wall")"""
+        return list(self._by_supercategory.get(supercategory, ()))
+
+    def roots(self) -> typing.List[str]:
+        """Get the unique_ids of the objects without a parent"""
+        return [key for key in self.supercategories if key not in self._parents]
+
+    def orphans(self) -> typing.List[str]:
+        """Get the unique_ids of the objects whose parent is not an indexed object"""
+        return [key for key, parent in self._parents.items() if parent not in self.supercategories]
+
+    def cycles(self) -> typing.List[typing.List[str]]:
+        """Find every cycle of parent links, each as a list of unique_ids in parent order
+
+        Every object has at most one parent, so each chain of parents is walked
+        once overall, which takes linear time.
+        """
+        cycles = []
+        done = set()
+        for start in self._parents:
+            if start in done:
+                continue
+            # Walk up until reaching an object done before, the top, or this walk's own path
+            path = {}
+            key = start
+            while key is not None and key not in done and key not in path:
+                path[key] = len(path)
+                key = self._parents.get(key)
+            if key in path:
+                cycles.append(list(path)[path[key]:])
+            done.update(path)
+        return cycles
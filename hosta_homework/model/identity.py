@@ -0,0 +1,152 @@
+"""Cross-image object identity index
+
+The same physical object goes by many IDs:
+  - in each image it appears in, it is an op with an image-local item_id
+  - each op lists, in imageIds, the item_ids of the same object in (some of) the
+    other images
+  - in the correction CSV, it is an Object_ID (or Host_ID), which the
+    ImageN_Object_ID columns tie to its item_id in each image
+  - across images, its ops may or may not share one unique_id
+
+The rest of the model only ever follows one of these aliases at a time (e.g.
+CorrectionFile.object_id_to_image_id keeps a single ImageN_Object_ID per object,
+and Room.image_id_to_unique_id ignores imageIds), so a join fails whenever it
+happens to hold an alias that the next lookup does not know.
+
+IdentityIndex merges every alias of an object into one equivalence class, with
+a union-find (disjoint-set) over all of them, and then indexes each class's
+unique_ids and corrections. Looking up any alias takes (amortized) constant time.
+
+Item IDs and CSV object IDs are both numbers, but unrelated ones, so they are
+kept apart by prefixing them (see item_key and object_key).
+"""
+import typing
+
+
+def item_key(item_id) -> str:
+    """Key of an image item_id (as in ops_3d[].item_id, imageIds and ImageN_Object_ID)"""
+    return f"i:{item_id}"
+
+
+def object_key(object_id: str) -> str:
+    """Key of a CSV Object_ID or Host_ID"""
+    return f"o:{object_id}"
+
+
+class UnionFind:
+    """Disjoint-set forest over hashable elements, with path halving and union by size"""
+
+    def __init__(self):
+        self._parents = {}
+        self._sizes = {}
+
+    def __contains__(self, element) -> bool:
+        return element in self._parents
+
+    def add(self, element):
+        """Add element as a class of its own, unless it is already known"""
+        if element not in self._parents:
+            self._parents[element] = element
+            self._sizes[element] = 1
+
+    def find(self, element):
+        """Get the representative of element's class (adding element, if unknown)"""
+        parents = self._parents
+        if element not in parents:
+            self.add(element)
+            return element
+        while (parent := parents[element]) != element:
+            parents[element] = element = parents[parent]
+        return element
+
+    def union(self, a, b):
+        """Merge the classes of a and b; return the representative of the merged class"""
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if self._sizes[a] < self._sizes[b]:
+            a, b = b, a
+        self._parents[b] = a
+        self._sizes[a] += self._sizes.pop(b)
+        return a
+
+    def classes(self) -> typing.Dict[typing.Any, typing.List[typing.Any]]:
+        """Get the members of every class, by representative"""
+        classes = {}
+        for element in self._parents:
+            classes.setdefault(self.find(element), []).append(element)
+        return classes
+
+
+class IdentityIndex:
+    """Every alias of every object of a room (and its corrections), merged into one class per object
+
+    Attributes:
+        aliases (UnionFind): The classes of item_keys and object_keys
+    """
+
+    def __init__(self):
+        self.aliases = UnionFind()
+        self._unique_ids = {}    # Representative -> unique_ids of the class, in Room order
+        self._items = {}         # Representative -> item_ids of the class which are ops of the room
+        self._corrections = {}   # Representative -> first correction of any item_id of the class
+
+    @classmethod
+    def build(cls, images, correction_file) -> "IdentityIndex":
+        """Build the index of a room's images and its CorrectionFile, in linear time
+
+        With a CorrectionFile parsed with keep_rows=True, every ImageN_Object_ID of
+        every row is an alias of its Object_ID; otherwise, only the one that
+        CorrectionFile.object_id_to_image_id kept.
+        """
+        index = cls()
+        union = index.aliases.union
+
+        # An op without an item_id is no alias of anything (and all of them are not one object)
+        ops = [op_3d for image in images for op_3d in image.ops_3d if op_3d.item_id is not None]
+        for op_3d in ops:
+            key = item_key(op_3d.item_id)
+            index.aliases.add(key)
+            for alias in op_3d.imageIds or ():
+                union(key, item_key(alias))
+
+        if correction_file.keep_rows:
+            decode = correction_file.ids.__getitem__
+            for column in correction_file.image_object_ids.values():
+                for object_code, image_code in zip(correction_file.object_ids, column):
+                    if object_code and image_code:
+                        union(object_key(decode(object_code)), item_key(decode(image_code)))
+        for object_id, image_id in correction_file.object_id_to_image_id.items():
+            union(object_key(object_id), item_key(image_id))
+
+        # Index the classes only once they are complete
+        find = index.aliases.find
+        for op_3d in ops:
+            representative = find(item_key(op_3d.item_id))
+            # A dict as an ordered set
+            index._unique_ids.setdefault(representative, {})[op_3d.unique_id] = None
+            index._items.setdefault(representative, []).append(str(op_3d.item_id))
+        index._unique_ids = {representative: list(ids) for representative, ids in index._unique_ids.items()}
+        for image_id, correction in correction_file.corrections_by_id.items():
+            index._corrections.setdefault(find(item_key(image_id)), correction)
+        return index
+
+    def _representative(self, key: str):
+        return self.aliases.find(key) if key in self.aliases else None
+
+    def unique_ids(self, key: str) -> typing.List[typing.Any]:
+        """Get every unique_id of the object with alias key (an item_key or object_key)"""
+        return self._unique_ids.get(self._representative(key), [])
+
+    def item_ids(self, key: str) -> typing.List[str]:
+        """Get the item_ids of every op of the object with alias key"""
+        return self._items.get(self._representative(key), [])
+
+    def correction(self, key: str):
+        """Get a correction (CorrectionRow) of any alias of the object with alias key, if there is one"""
+        return self._corrections.get(self._representative(key))
+
+    def same_object(self, a: str, b: str) -> bool:
+        """Check whether two aliases are of the same object"""
+        representative = self._representative(a)
+        return representative is not None and representative == self._representative(b)
@@ -41,7 +41,25 @@ from uuid import UUID
 from pydantic import BaseModel, Field
 
 from .correction_file import CorrectionFile
-
+from .join import JoinOutcome
+
+
+# Log messages of Op3D.process_correction, which logs once per op
+_NO_CORRECTION_MESSAGE = "Nothing to correct for item_id, '%s'"
+_NO_HOST_IMAGE_ID_MESSAGE = dedent("""\
+    Cannot convert CSV host_id '%s' to Image_ObjectId
+        (In processing item_id, '%s')""")
+_NO_UNIQUE_ID_MESSAGE = dedent("""\
+    Cannot convert CSV Image_ObjectId '%s' to unique_id
+        (In processing item_id, '%s' with parent Image_ObjectId, '%s')""")
+_SUCCESS_MESSAGE = dedent("""\
+    Successfully updated Op3D record: 
+        Op3D.unique_id: %s
+        Op3D.item_id: %s
+        Op3D.parent_id: %s
+        parent Host_ID: %s
+        parent Object_ID: %s
+    """)
 
 class ImageFile(BaseModel):
     """Model of an entire image file json schema to be interpreted by the system
@@ -131,6 +149,12 @@ class ImageFile(BaseModel):
         parent_structure: str | None = None
         subcategory: str | None = None
 
+        def clear_parent_id(self):
+            """Unset parent_id altogether, as if it never was in the input"""
+            self.parent_id = None
+            # So that it is excluded from the output again (see model_dump_json's exclude_unset)
+            self.model_fields_set.discard("parent_id")
+
         def process_correction(
                 self, 
                 correction_file: CorrectionFile, 
@@ -142,6 +166,9 @@ class ImageFile(BaseModel):
                 correction_file (CorrectionFile): parsed corrections from the CSV
                 image_to_unique_id (dict[str, str]): mapping of image IDs to respective unique_id
 
+            Returns:
+                A JoinOutcome: SUCCESS, or which step failed
+
             Assumptions:
             
               From analyzing the data files, I found that for any image file, I_n,
@@ -166,6 +193,9 @@ class ImageFile(BaseModel):
               3. Convert the ObjectId to a unique_id by cross-referencing with the image files
 
               (If any step fails a lookup, log a message and make no changes)
+
+            This is the reference implementation of the join; see also
+            hosta_homework.model.join.batch_join for a faster equivalent.
             """
             # Broken into multiple try/except blocks for tracing/logging convenience
 
@@ -175,49 +205,41 @@ class ImageFile(BaseModel):
             try:
                 correction = correction_file.corrections_by_id[id_key]
             except KeyError:
-                logging.info("Nothing to correct for item_id, '%s'", id_key)
-                return
+                logging.info(_NO_CORRECTION_MESSAGE, id_key, extra={"outcome": "no_correction", "item_id": id_key})
+                return JoinOutcome.NO_CORRECTION
 
             ## Step 2: Correction.HostID -> ObjectId
             try: 
                 parent_host_id = correction.host_id
                 parent_image_id = correction_file.object_id_to_image_id[parent_host_id]
             except KeyError:
-                logging.warn(dedent("""\
-                    Cannot convert CSV host_id '%s' to Image_ObjectId
-                        (In processing item_id, '%s')"""),
+                logging.warning(_NO_HOST_IMAGE_ID_MESSAGE,
                     parent_host_id,
-                    id_key)
-                return
+                    id_key,
+                    extra={"outcome": "no_host_image_id", "item_id": id_key, "host_id": parent_host_id})
+                return JoinOutcome.NO_HOST_IMAGE_ID
 
             ## Step 3: ObjectId -> unique_id
             try: 
                 unique_id = image_to_unique_id[parent_image_id]
             except KeyError:
-                logging.warn(dedent("""\
-                    Cannot convert CSV Image_ObjectId '%s' to unique_id
-                        (In processing item_id, '%s' with parent Image_ObjectId, '%s')"""),
+                logging.warning(_NO_UNIQUE_ID_MESSAGE,
                     parent_image_id,
                     id_key,
-                    parent_host_id)
-                return
+                    parent_host_id,
+                    extra={"outcome": "no_unique_id", "item_id": id_key, "host_id": parent_host_id})
+                return JoinOutcome.NO_UNIQUE_ID
 
             # Update field in self so that it will be serialized
             self.parent_id = unique_id
-            logging.info(dedent("""\
-                Successfully updated Op3D record: 
-                    Op3D.unique_id: %s
-                    Op3D.item_id: %s
-                    Op3D.parent_id: %s
-                    parent Host_ID: %s
-                    parent Object_ID: %s
-                """),
+            logging.info(_SUCCESS_MESSAGE,
                 str(self.unique_id),
                 id_key,
                 unique_id,
                 parent_host_id,
-                parent_image_id)
-                    
+                parent_image_id,
+                extra={"outcome": "success", "item_id": id_key, "parent_id": str(unique_id)})
+            return JoinOutcome.SUCCESS
 
 
     image_info: ImageInfo = Field(
@@ -241,8 +263,10 @@ class ImageFile(BaseModel):
         Parameters:
             correction_file (CorrectionFile): parsed corrections from the CSV
             image_to_unique_id (dict[str, str]): mapping of image IDs to respective unique_id
+
+        Returns:
+            The JoinOutcome of each op_3d, in order
         """
         logging.info("Processing corrections for image file, '%s'", self.image_info.file_name)
-        for op_3d in self.ops_3d:
-            op_3d.process_correction(correction_file, image_to_unique_id)
+        return [op_3d.process_correction(correction_file, image_to_unique_id) for op_3d in self.ops_3d]
 
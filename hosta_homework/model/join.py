@@ -0,0 +1,170 @@
+"""Engines that join a Room's ops_3d against a CorrectionFile
+
+The join resolves, for every Op3D:
+
+    item_id -> correction -> Host_ID -> parent ImageN_Object_ID -> parent unique_id
+
+Three engines are provided:
+  - reference: delegates to ImageFile.Op3D.process_correction one op at a time.
+        This is the readable, per-op definition of the join, with a log line per op.
+  - batch: performs each step of the join for every op of every image at once,
+        as a chain of bulk dictionary lookups (map(dict.get, ...)), and then
+        applies the results. It logs only a summary.
+  - identity: joins like batch, then retries the ops that failed through every
+        alias of the objects involved (see hosta_homework.model.identity).
+
+All return a JoinResult with one entry per op, in Room order (image by image,
+op by op). reference and batch must always agree on the resulting parent_ids;
+identity must agree with them on every op that they resolve.
+"""
+from array import array
+import enum
+import logging
+import typing
+
+from .identity import IdentityIndex, item_key, object_key
+
+
+class JoinOutcome(enum.IntEnum):
+    """Result of joining one Op3D, i.e. which step (if any) failed"""
+    SUCCESS = 0
+    NO_CORRECTION = 1       # No correction in the CSV for the op's item_id
+    NO_HOST_IMAGE_ID = 2    # The correction's Host_ID has no ImageN_Object_ID
+    NO_UNIQUE_ID = 3        # The parent's ImageN_Object_ID is not an item_id in any image
+    REJECTED = 4            # Joined, but then rejected by a check (see Room.check_dimensions)
+
+
+class JoinResult(typing.NamedTuple):
+    """Per-op results of a join, in Room order
+
+    Attributes:
+        parent_ids (list[UUID | str | None]): Resolved parent unique_id of each op, if any
+        outcomes (array[int]): JoinOutcome of each op
+        host_ids (list[str | None]): Host_ID of each op's correction, if any
+        parent_image_ids (list[str | None]): ImageN_Object_ID of each op's parent, if any
+    """
+    parent_ids: typing.List[typing.Any]
+    outcomes: array
+    host_ids: typing.List[str | None]
+    parent_image_ids: typing.List[str | None]
+
+    def counts(self) -> typing.Dict[JoinOutcome, int]:
+        """Count the ops that ended with each JoinOutcome"""
+        return {outcome: self.outcomes.count(outcome) for outcome in JoinOutcome}
+
+
+def reference_join(images, correction_file, image_to_unique_id) -> JoinResult:
+    """Join one op at a time with ImageFile.Op3D.process_correction
+
+    Parameters:
+        images (list[ImageFile | LazyImageFile]): The images of a Room
+        correction_file (CorrectionFile): parsed corrections from the CSV
+        image_to_unique_id (dict[str, str]): mapping of image IDs to respective unique_id
+    """
+    outcomes = array("b")
+    for image in images:
+        outcomes.extend(image.process_corrections(correction_file, image_to_unique_id))
+
+    ops = [op_3d for image in images for op_3d in image.ops_3d]
+    corrections = map(correction_file.corrections_by_id.get, (str(op_3d.item_id) for op_3d in ops))
+    host_ids = [None if c is None else c.host_id for c in corrections]
+    parent_image_ids = list(map(correction_file.object_id_to_image_id.get, host_ids))
+    parent_ids = [
+        op_3d.parent_id if outcome == JoinOutcome.SUCCESS else None
+        for op_3d, outcome in zip(ops, outcomes)]
+
+    return JoinResult(parent_ids, outcomes, host_ids, parent_image_ids)
+
+
+def batch_join(images, correction_file, image_to_unique_id) -> JoinResult:
+    """Join every op of every image at once, then apply the results
+
+    Parameters:
+        images (list[ImageFile | LazyImageFile]): The images of a Room
+        correction_file (CorrectionFile): parsed corrections from the CSV
+        image_to_unique_id (dict[str, str]): mapping of image IDs to respective unique_id
+    """
+    ops = [op_3d for image in images for op_3d in image.ops_3d]
+
+    # Cast to str because of inconsistencies in the data format
+    item_ids = [str(op_3d.item_id) for op_3d in ops]
+
+    ## Step 1: Get corrections
+    rows = list(map(correction_file.corrections_by_id.get, item_ids))
+
+    ## Step 2: Correction.HostID -> ObjectId
+    decode = correction_file.ids.__getitem__
+    host_codes = correction_file.host_ids
+    host_ids = [None if row is None else decode(host_codes[row.index]) for row in rows]
+    parent_image_ids = list(map(correction_file.object_id_to_image_id.get, host_ids))
+
+    ## Step 3: ObjectId -> unique_id
+    parent_ids = list(map(image_to_unique_id.get, parent_image_ids))
+
+    # The first step to yield None is the one that failed
+    outcomes = array("b", [
+        JoinOutcome.NO_CORRECTION if host_id is None
+        else JoinOutcome.NO_HOST_IMAGE_ID if parent_image_id is None
+        else JoinOutcome.NO_UNIQUE_ID if parent_id is None
+        else JoinOutcome.SUCCESS
+        for host_id, parent_image_id, parent_id in zip(host_ids, parent_image_ids, parent_ids)])
+
+    for op_3d, parent_id in zip(ops, parent_ids):
+        if parent_id is not None:
+            op_3d.parent_id = parent_id
+
+    result = JoinResult(parent_ids, outcomes, host_ids, parent_image_ids)
+    logging.info("Joined %d ops_3d: %s", len(ops),
+        ", ".join(f"{outcome.name}={count}" for outcome, count in result.counts().items()))
+    return result
+
+
+def identity_join(images, correction_file, image_to_unique_id) -> JoinResult:
+    """Join like batch_join, then resolve what it could not through an IdentityIndex
+
+    For an op that batch_join did not resolve, a correction of any alias of its
+    object is used, and the parent is any op of any alias of the Host_ID's object.
+
+    Parameters:
+        images (list[ImageFile | LazyImageFile]): The images of a Room
+        correction_file (CorrectionFile): parsed corrections from the CSV
+        image_to_unique_id (dict[str, str]): mapping of image IDs to respective unique_id
+    """
+    result = batch_join(images, correction_file, image_to_unique_id)
+    index = IdentityIndex.build(images, correction_file)
+
+    ops = (op_3d for image in images for op_3d in image.ops_3d)
+    resolved = 0
+    for i, (op_3d, outcome) in enumerate(zip(ops, result.outcomes)):
+        if outcome == JoinOutcome.SUCCESS:
+            continue
+        correction = index.correction(item_key(op_3d.item_id))
+        if correction is None:
+            continue
+
+        host_id = correction.host_id
+        parent_unique_ids = index.unique_ids(object_key(host_id))
+        result.host_ids[i] = host_id
+        if not parent_unique_ids:
+            result.outcomes[i] = (
+                JoinOutcome.NO_UNIQUE_ID if host_id in correction_file.object_id_to_image_id
+                else JoinOutcome.NO_HOST_IMAGE_ID)
+            continue
+
+        op_3d.parent_id = result.parent_ids[i] = parent_unique_ids[0]
+        result.parent_image_ids[i] = index.item_ids(object_key(host_id))[0]
+        result.outcomes[i] = JoinOutcome.SUCCESS
+        resolved += 1
+
+    logging.info("Resolved %d more ops_3d through their aliases", resolved)
+    return result
+
+
+ENGINES = {
+    "reference": reference_join,
+    "batch": batch_join,
+    "identity": identity_join,
+}
+
+# Engines that make use of every column of every row, i.e. of a CorrectionFile parsed with keep_rows=True
+KEEP_ROWS_ENGINES = {"identity"}
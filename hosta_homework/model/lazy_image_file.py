@@ -0,0 +1,146 @@
+"""Fast-path, unvalidated counterpart to hosta_homework.model.image_file
+
+Correction processing only ever reads Op3D.item_id and Op3D.unique_id, and only
+ever writes Op3D.parent_id. Building (and validating) the whole pydantic tree for
+every Op3D, Detection and UnoccludeDetection is therefore wasted effort for the
+common case.
+
+LazyImageFile keeps the decoded json as plain python objects (via pydantic-core's
+json parser and serializer, which are implemented in Rust and faster than even the
+C-accelerated stdlib json module) and only exposes the handful of fields that the correction
+logic needs. Everything else passes through untouched, untyped and unvalidated.
+
+The duck-typed API mirrors ImageFile closely enough that the two are interchangeable
+from the perspective of hosta_homework.model.Room; in fact, the correction logic
+is shared verbatim with the pydantic models (see ImageFile.Op3D.process_correction).
+
+Note: unlike ImageFile, which silently drops json fields that it doesn't model
+      (e.g. `trimLength` in some of the example data), this passes them through.
+"""
+import typing
+
+import pydantic_core
+
+try:
+    import orjson
+except ImportError:  # Optional, see OrjsonImageFile
+    orjson = None
+
+from .image_file import ImageFile
+
+
+# pydantic's model_fields is a (slow) property
+_OP_3D_FIELDS = frozenset(ImageFile.Op3D.model_fields)
+
+
+class LazyImageFile:
+    """Unvalidated representation of an image file json
+
+    Attributes:
+        image_info (ImageFile.ImageInfo):
+            Validated image metadata (it is tiny, so there's no reason not to)
+
+        ops_3d (list[LazyOp3D]):
+            Thin wrappers around each raw element of ops_3d[]
+    """
+
+    class LazyOp3D:
+        """Thin, mutable view over a raw element of ops_3d[]
+
+        The fields used by correction processing are exposed as properties;
+        any other field of ImageFile.Op3D is accessible as a plain (raw) attribute.
+        """
+        __slots__ = ("_raw",)
+
+        def __init__(self, raw: typing.Dict[str, typing.Any]):
+            self._raw = raw
+
+        @property
+        def item_id(self) -> int | None:
+            return self._raw.get("item_id")
+
+        @property
+        def unique_id(self) -> str:
+            return self._raw["unique_id"]
+
+        @property
+        def imageIds(self) -> typing.List[str] | None:
+            return self._raw.get("imageIds")
+
+        @property
+        def parent_id(self) -> str | None:
+            return self._raw.get("parent_id")
+
+        @parent_id.setter
+        def parent_id(self, value):
+            # Stringify, as UUIDs would be upon serialization
+            self._raw["parent_id"] = None if value is None else str(value)
+
+        @property
+        def model_fields_set(self) -> typing.Set[str]:
+            """The fields present in the input, or set since (Named for parity with ImageFile)"""
+            return set(self._raw)
+
+        def clear_parent_id(self):
+            """Remove parent_id altogether, as if it never was in the input"""
+            self._raw.pop("parent_id", None)
+
+        def __getattr__(self, name):
+            if name in _OP_3D_FIELDS:
+                return self._raw.get(name)
+            raise AttributeError(name)
+
+        # The correction logic only touches the properties above, so share it
+        process_correction = ImageFile.Op3D.process_correction
+
+
+    def __init__(self, raw: typing.Dict[str, typing.Any]):
+        """LazyImageFile constructor
+
+        Parameters:
+            raw (dict): A decoded image file json document
+        """
+        self._raw = raw
+        self.image_info = ImageFile.ImageInfo.model_validate(raw["image_info"])
+        self.ops_3d = [self.LazyOp3D(op) for op in raw["ops_3d"]]
+
+    @classmethod
+    def model_validate_json(cls, json_data: str | bytes) -> "LazyImageFile":
+        """Parse an image file json string (Named for parity with ImageFile)"""
+        return cls(pydantic_core.from_json(json_data))
+
+    def model_dump_json(self, exclude_unset: bool = True, indent: int | None = None) -> str:
+        """Serialize this image file back to a json string (Named for parity with ImageFile)
+
+        Parameters:
+            exclude_unset (bool, optional):
+                Accepted for parity with ImageFile. The raw data only ever holds
+                fields that were present in the input or set since, so this is
+                always effectively true.
+            indent (int, optional): Indentation of the output, or None for compact output
+        """
+        return pydantic_core.to_json(self._raw, indent=indent).decode()
+
+    # Likewise, only touches image_info.file_name and ops_3d
+    process_corrections = ImageFile.process_corrections
+
+
+class OrjsonImageFile(LazyImageFile):
+    """LazyImageFile, parsed and serialized with orjson instead of pydantic-core
+
+    Requires the optional orjson package.
+    """
+
+    @classmethod
+    def model_validate_json(cls, json_data: str | bytes) -> "OrjsonImageFile":
+        """Parse an image file json string (Named for parity with ImageFile)"""
+        return cls(orjson.loads(json_data))
+
+    def model_dump_json(self, exclude_unset: bool = True, indent: int | None = None) -> str:
+        """Serialize this image file back to a json string (Named for parity with ImageFile)
+
+        orjson only indents by 2; any other indent falls back to LazyImageFile's serializer.
+        """
+        if indent not in (None, 2):
+            return super().model_dump_json(exclude_unset, indent)
+        return orjson.dumps(self._raw, option=orjson.OPT_INDENT_2 if indent else 0).decode()
@@ -0,0 +1,326 @@
+"""Sidecar tables of the parent links made by correction processing
+
+Consumers that only need the restored parent_id links do not need a whole copy
+of every image file. A LinkTable holds just the links of one room, i.e. for every
+op_3d that the join gave a parent:
+
+    (image, op index, op unique_id, parent unique_id, resolution path)
+
+where the resolution path is the item_id -> Host_ID -> parent ImageN_Object_ID
+chain that led to the parent (see hosta_homework.model.join). Parents inferred
+from geometry (see hosta_homework.model.spatial) have an empty Host_ID and
+parent ImageN_Object_ID.
+
+It is stored in one of two formats:
+  - "binary": a little-endian columnar file; a header, then each column in turn
+        (integer columns as packed arrays, string columns as NUL-separated utf-8)
+  - "jsonpatch": json lines, one per image: {"image": file_name, "patch": [...]},
+        where the patch is an RFC 6902 JSON Patch of the original image file. Each
+        link is a "test" of the op's unique_id (so that a patch is never applied
+        to the wrong file) and an "add" of its parent_id (which, per the RFC,
+        replaces any existing value). The resolution path rides along as extra
+        members of the "add", which JSON Patch implementations must ignore
+
+read_links reads either format back; LinkTable.apply and LinkTable.patch then
+apply the links to original image files on demand.
+"""
+from array import array
+import json
+import os
+import struct
+import sys
+import typing
+
+from .join import JoinOutcome
+from . import splice
+from .. import file_io
+
+
+# Format -> file name
+FORMATS = {"binary": "parent_links.bin", "jsonpatch": "parent_links.patch.jsonl"}
+
+# Room.save_images modes that write a link table -> its format
+LINK_MODES = {"links": "binary", "jsonpatch": "jsonpatch"}
+
+_MAGIC = b"HLNK"
+_VERSION = 1
+_HEADER = struct.Struct("<4sBII")  # magic, version, number of images, number of links
+_LENGTH = struct.Struct("<I")
+
+
+class Link(typing.NamedTuple):
+    """One parent link, and how it was resolved"""
+    op_index: int
+    unique_id: str
+    parent_id: str
+    item_id: str
+    host_id: str
+    parent_object_id: str
+
+
+class LinkTable:
+    """The parent links of a room, column by column
+
+    Attributes:
+        file_names (list[str]): image_info.file_name of each image of the room
+        image_indexes (array[int]): For each link, the index of its image in file_names
+        op_indexes (array[int]): For each link, the index of its op within the image's ops_3d
+        unique_ids, parent_ids, item_ids, host_ids, parent_object_ids (list[str]):
+            For each link, the fields of Link
+    """
+    _STRING_COLUMNS = ("unique_ids", "parent_ids", "item_ids", "host_ids", "parent_object_ids")
+
+    def __init__(
+            self,
+            file_names: typing.List[str],
+            image_indexes: typing.Iterable[int] = (),
+            op_indexes: typing.Iterable[int] = (),
+            unique_ids: typing.List[str] | None = None,
+            parent_ids: typing.List[str] | None = None,
+            item_ids: typing.List[str] | None = None,
+            host_ids: typing.List[str] | None = None,
+            parent_object_ids: typing.List[str] | None = None,
+        ):
+        self.file_names = list(file_names)
+        self.image_indexes = array("I", image_indexes)
+        self.op_indexes = array("I", op_indexes)
+        self.unique_ids = unique_ids or []
+        self.parent_ids = parent_ids or []
+        self.item_ids = item_ids or []
+        self.host_ids = host_ids or []
+        self.parent_object_ids = parent_object_ids or []
+        # See _by_image
+        self._index = None
+
+    @classmethod
+    def from_room(cls, room) -> "LinkTable":
+        """Collect the links that process_corrections (and infer_parents, if run) made in a Room"""
+        if room.join_result is None:
+            raise ValueError("The room has not been processed yet")
+        inferred = {inference.op_index: inference.parent_id for inference in room.inferences or ()}
+
+        table = cls([image.image_info.file_name for image in room.images])
+        ops = ((image_index, op_index, op_3d)
+            for image_index, image in enumerate(room.images)
+                for op_index, op_3d in enumerate(image.ops_3d))
+        result = room.join_result
+        for index, ((image_index, op_index, op_3d), outcome, parent_id, host_id, parent_object_id) in enumerate(zip(
+                ops, result.outcomes, result.parent_ids, result.host_ids, result.parent_image_ids)):
+            if outcome != JoinOutcome.SUCCESS:
+                if index not in inferred:
+                    continue
+                parent_id, host_id, parent_object_id = inferred[index], "", ""
+            table.image_indexes.append(image_index)
+            table.op_indexes.append(op_index)
+            table.unique_ids.append(str(op_3d.unique_id))
+            table.parent_ids.append(str(parent_id))
+            table.item_ids.append(str(op_3d.item_id))
+            table.host_ids.append(host_id)
+            table.parent_object_ids.append(parent_object_id)
+        return table
+
+    def __len__(self):
+        return len(self.op_indexes)
+
+    def extend(self, other: "LinkTable"):
+        """Append the images and links of other to this table"""
+        offset = len(self.file_names)
+        self.file_names.extend(other.file_names)
+        self.image_indexes.extend(index + offset for index in other.image_indexes)
+        self.op_indexes.extend(other.op_indexes)
+        for name in self._STRING_COLUMNS:
+            getattr(self, name).extend(getattr(other, name))
+
+    def _by_image(self) -> typing.Tuple[typing.Dict[str, int], typing.Dict[int, typing.List[int]]]:
+        """Get the index of each file name (its first, if repeated), and the rows of the links of each image
+
+        Built once, rather than scanning every link for every image; and again
+        if images or links were appended since (columns are only ever appended to).
+        """
+        size = (len(self.file_names), len(self))
+        if self._index is None or self._index[0] != size:
+            images = {}
+            for image_index, file_name in enumerate(self.file_names):
+                images.setdefault(file_name, image_index)
+            rows = {}
+            for row, image_index in enumerate(self.image_indexes):
+                rows.setdefault(image_index, []).append(row)
+            self._index = (size, images, rows)
+        return self._index[1:]
+
+    def _links(self, image_index: int) -> typing.List[Link]:
+        rows = self._by_image()[1].get(image_index, ())
+        columns = [self.op_indexes, *(getattr(self, name) for name in self._STRING_COLUMNS)]
+        return [Link(*(column[row] for column in columns)) for row in rows]
+
+    def links(self, file_name: str) -> typing.List[Link]:
+        """Get the links of one image, by its image_info.file_name"""
+        image_index = self._by_image()[0].get(file_name)
+        return [] if image_index is None else self._links(image_index)
+
+    ## Binary format
+
+    def to_bytes(self) -> bytes:
+        """Encode the table in the binary format"""
+        chunks = [
+            _HEADER.pack(_MAGIC, _VERSION, len(self.file_names), len(self)),
+            _pack_strings(self.file_names),
+        ]
+        for column in (self.image_indexes, self.op_indexes):
+            if sys.byteorder == "big":
+                column = array("I", column)
+                column.byteswap()
+            chunks.append(column.tobytes())
+        chunks.extend(_pack_strings(getattr(self, name)) for name in self._STRING_COLUMNS)
+        return b"".join(chunks)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "LinkTable":
+        """Decode a table in the binary format"""
+        magic, version, num_images, num_links = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError("Not a parent link table")
+        if version != _VERSION:
+            raise ValueError(f"Unsupported parent link table version {version}")
+
+        pos = _HEADER.size
+        file_names, pos = _unpack_strings(data, pos, num_images)
+        int_columns = []
+        for _ in range(2):
+            column = array("I")
+            column.frombytes(data[pos:pos + num_links * column.itemsize])
+            if sys.byteorder == "big":
+                column.byteswap()
+            int_columns.append(column)
+            pos += num_links * column.itemsize
+        string_columns = []
+        for _ in cls._STRING_COLUMNS:
+            column, pos = _unpack_strings(data, pos, num_links)
+            string_columns.append(column)
+        return cls(file_names, *int_columns, *string_columns)
+
+    ## JSON Patch format
+
+    def to_json_patch(self) -> typing.Iterator[str]:
+        """Encode the table as JSON Patch lines, one per image with links"""
+        for image_index, file_name in enumerate(self.file_names):
+            patch = []
+            for link in self._links(image_index):
+                path = f"/ops_3d/{link.op_index}"
+                patch.append({"op": "test", "path": f"{path}/unique_id", "value": link.unique_id})
+                patch.append({
+                    "op": "add",
+                    "path": f"{path}/parent_id",
+                    "value": link.parent_id,
+                    "item_id": link.item_id,
+                    "host_id": link.host_id,
+                    "parent_object_id": link.parent_object_id,
+                })
+            if patch:
+                yield json.dumps({"image": file_name, "patch": patch}) + "\n"
+
+    @classmethod
+    def from_json_patch(cls, lines: typing.Iterable[str]) -> "LinkTable":
+        """Decode JSON Patch lines, as written by to_json_patch"""
+        table = cls([])
+        for line in lines:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            image_index = len(table.file_names)
+            table.file_names.append(entry["image"])
+            unique_ids = {}
+            for operation in entry["patch"]:
+                _, ops_3d, op_index, field = operation["path"].split("/")
+                if ops_3d != "ops_3d" or field not in ("unique_id", "parent_id"):
+                    raise ValueError(f"Unexpected JSON Patch path '{operation['path']}'")
+                if operation["op"] == "test":
+                    unique_ids[int(op_index)] = operation["value"]
+                    continue
+                table.image_indexes.append(image_index)
+                table.op_indexes.append(int(op_index))
+                table.unique_ids.append(unique_ids[int(op_index)])
+                table.parent_ids.append(operation["value"])
+                table.item_ids.append(operation["item_id"])
+                table.host_ids.append(operation["host_id"])
+                table.parent_object_ids.append(operation["parent_object_id"])
+        return table
+
+    ## Applying the links
+
+    def apply(self, image: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        """Set the parent_ids of a decoded image file json, in place
+
+        Raises:
+            ValueError: if an op's unique_id is not the one the link was made for
+        """
+        ops_3d = image["ops_3d"]
+        for link in self.links(image["image_info"]["file_name"]):
+            op_3d = ops_3d[link.op_index]
+            if op_3d["unique_id"] != link.unique_id:
+                raise ValueError(
+                    f"ops_3d[{link.op_index}] has unique_id '{op_3d['unique_id']}', not '{link.unique_id}'")
+            op_3d["parent_id"] = link.parent_id
+        return image
+
+    def patch(self, data: bytes) -> bytes:
+        """Set the parent_ids of a raw image file json, leaving every other byte as it was
+
+        Raises:
+            ValueError: if an op's unique_id is not the one the link was made for
+        """
+        # Only needed here, and slow-ish to import (see hosta_homework.model's lazy imports)
+        import pydantic_core
+
+        image = pydantic_core.from_json(data)
+        self.apply(image)
+        spans = splice.scan_ops(data)
+        parent_ids = [op_3d.get("parent_id") for op_3d in image["ops_3d"]]
+        changed = splice.changed_parent_ids(data, spans, parent_ids)
+        return b"".join(splice.splice_parent_ids(data, spans, changed))
+
+
+def _pack_strings(strings: typing.Sequence[str]) -> bytes:
+    blob = b"\0".join(s.encode() for s in strings)
+    return _LENGTH.pack(len(blob)) + blob
+
+
+def _unpack_strings(data: bytes, pos: int, count: int) -> typing.Tuple[typing.List[str], int]:
+    (length,) = _LENGTH.unpack_from(data, pos)
+    pos += _LENGTH.size
+    blob = bytes(data[pos:pos + length])
+    strings = [s.decode() for s in blob.split(b"\0")] if count else []
+    if len(strings) != count:
+        raise ValueError("Corrupt parent link table")
+    return strings, pos + length
+
+
+def write_links(
+        path: os.PathLike,
+        table: LinkTable,
+        format: str = "binary",
+        compression: str | None = None,
+    ):
+    """Write a LinkTable to path (atomically, see file_io.atomic_write)
+
+    Parameters:
+        path (PathLike): The final path of the file (including any compression suffix)
+        table (LinkTable): The links
+        format (str, optional): "binary" (default) or "jsonpatch"
+        compression (str, optional): "gzip" or "zstd" to compress the file
+    """
+    if format == "binary":
+        data = table.to_bytes()
+    elif format == "jsonpatch":
+        data = "".join(table.to_json_patch())
+    else:
+        raise ValueError(f"Unknown link table format '{format}'")
+    file_io.atomic_write(path, data, compression)
+
+
+def read_links(path: os.PathLike) -> LinkTable:
+    """Read a LinkTable written by write_links, in either format and with any compression"""
+    data = file_io.read_bytes(path)
+    if data.startswith(_MAGIC):
+        return LinkTable.from_bytes(data)
+    return LinkTable.from_json_patch(data.decode().splitlines())
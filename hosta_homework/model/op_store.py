@@ -0,0 +1,425 @@
+"""Compact, column-wise storage of the ops_3d of an image
+
+A parsed ImageFile holds a pydantic model per Op3D, with a list object and a
+float object per coordinate, a string object per category, a UUID object (and
+its int) per ID, and more models for nested detections. That per-op object
+overhead is most of the memory that a Room takes.
+
+An OpStore instead keeps the ops_3d of an image as a struct of arrays, with
+one column per field:
+  - coordinates (centre, height_bottom...) as float64 arrays
+  - other numbers as float64 or int64 arrays (quantity, which may be either, as
+    float64, which holds ints exactly up to 2**53; any larger ones are kept aside)
+  - strings (supercategory, unit...) as codes into a table of distinct strings,
+    16-bit, or 32-bit once a store has more distinct strings than that
+  - UUIDs as 16 bytes each, in one bytearray
+  - the rarely used, nested fields (detections, imageIds) as compact json bytes
+plus, per op, bitmasks of which fields were set (for exclude_unset), and of
+which were None.
+
+CompactOp3D is a flyweight view of one op of a store, with the same attributes
+as ImageFile.Op3D; views are created on access, and hold nothing but their
+store and index. CompactImageFile is the "compact" codec (see
+hosta_homework.model.codec) built on them: it validates with ImageFile's
+models, so that it accepts and outputs exactly the same, and moves the ops of
+each image into an OpStore a chunk at a time as they are validated.
+
+See hosta_homework.bench --memory for a comparison of the memory that each
+codec takes.
+"""
+from array import array
+import math
+import typing
+from uuid import UUID
+
+import pydantic
+import pydantic_core
+
+from .image_file import ImageFile
+
+
+# Fields of ImageFile.Op3D, by how they are stored
+_UUIDS = ("unique_id", "parent_id")
+_STRINGS = ("supercategory", "unit", "quantity_field", "wall_type", "parent_structure", "subcategory")
+_INTS = ("item_id", "level")
+_FLOATS = (
+    "sqft", "width", "height", "length", "perimeter", "thickness", "thickness_bottom", "thickness_top",
+    "totalArea", "depth")
+_NUMBERS = ("quantity",)  # float | int
+_BOOLS = ("baseboard", "chair_guard", "wall_protection", "molding", "corner_guard")
+_POINTS = (
+    "bottom_width_left", "bottom_width_right", "height_bottom", "height_top", "centre", "depth_back", "depth_front")
+_JSON = ("imageIds", "detections", "detections_unocclude")
+
+# Every int of at most this magnitude is exactly a float64
+_EXACT_INTS = 2 ** 53
+
+# Ops validated at once when parsing, and the validator for them
+_CHUNK = 256
+_OPS = pydantic.TypeAdapter(typing.List[ImageFile.Op3D])
+
+# In ImageFile.Op3D's order, which is that of its output
+FIELDS = tuple(ImageFile.Op3D.model_fields)
+_BITS = {name: 1 << i for i, name in enumerate(FIELDS)}
+
+
+class OpStore:
+    """The ops_3d of an image, column by column
+
+    Attributes:
+        strings (list[str]): Every distinct string of the string fields; codes index into this
+    """
+
+    def __init__(self):
+        self._count = 0
+        self._set = array("Q")    # Per op, bit i is set if FIELDS[i] was set
+        self._null = array("Q")   # Per op, bit i is set if FIELDS[i] is None
+        self._uuids = {name: bytearray() for name in _UUIDS}
+        self.strings = []
+        self._codes = {}
+        self._string_columns = {name: array("H") for name in _STRINGS}
+        self._int_columns = {name: array("q") for name in _INTS}
+        self._float_columns = {name: array("d") for name in _FLOATS + _NUMBERS}
+        self._is_int = array("b")  # Per op, whether quantity is an int
+        self._large_ints = {}      # (name, index) -> ints of _NUMBERS too large for a float64 to hold exactly
+        self._bool_columns = {name: array("b") for name in _BOOLS}
+        # Per op, where its point starts in the field's values (-1 if none)
+        self._point_starts = {name: array("l") for name in _POINTS}
+        self._point_lengths = {name: array("B") for name in _POINTS}
+        self._point_values = {name: array("d") for name in _POINTS}
+        self._json_columns = {name: [] for name in _JSON}
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _encode(self, value: str) -> int:
+        try:
+            return self._codes[value]
+        except KeyError:
+            self._codes[value] = len(self.strings)
+            self.strings.append(value)
+            return self._codes[value]
+
+    def extend(self, ops_3d: typing.List[typing.Dict[str, typing.Any]]):
+        """Add ops, column by column
+
+        Parameters:
+            ops_3d (list[dict]):
+                Validated ops, as dumped by ImageFile.model_dump(mode="json", exclude_unset=True)
+        """
+        set_masks = array("Q", [sum(map(_BITS.__getitem__, op_3d)) for op_3d in ops_3d])
+        self._set += set_masks
+        self._null.extend(
+            sum(_BITS[name] for name, value in op_3d.items() if value is None) for op_3d in ops_3d)
+
+        any_set = 0
+        for set_mask in set_masks:
+            any_set |= set_mask
+        unset = [None] * len(ops_3d)
+
+        def values(name):
+            return [op_3d.get(name) for op_3d in ops_3d] if any_set & _BITS[name] else unset
+
+        for name, column in self._uuids.items():
+            # As dumped, UUIDs are in canonical form
+            column += b"".join(
+                bytes(16) if value is None else bytes.fromhex(value.replace("-", "")) for value in values(name))
+        for name in _STRINGS:
+            codes = [0 if value is None else self._encode(value) for value in values(name)]
+            if len(self.strings) > 0xFFFF and self._string_columns[name].typecode == "H":
+                self._string_columns = {name: array("I", column) for name, column in self._string_columns.items()}
+            self._string_columns[name].extend(codes)
+        for name, column in self._int_columns.items():
+            column.extend(value or 0 for value in values(name))
+        for name, column in self._float_columns.items():
+            column.extend(math.nan if value is None else value for value in values(name))
+        for name in _NUMBERS:
+            for index, value in enumerate(values(name), self._count):
+                if isinstance(value, int) and abs(value) > _EXACT_INTS:
+                    self._large_ints[name, index] = value
+        self._is_int.extend(isinstance(value, int) for value in values("quantity"))
+        for name, column in self._bool_columns.items():
+            column.extend(map(bool, values(name)))
+        for name, point_values in self._point_values.items():
+            starts, lengths = self._point_starts[name], self._point_lengths[name]
+            for point in values(name):
+                starts.append(-1 if point is None else len(point_values))
+                lengths.append(0 if point is None else len(point))
+                if point is not None:
+                    point_values.extend(point)
+        for name, column in self._json_columns.items():
+            column.extend(None if value is None else pydantic_core.to_json(value) for value in values(name))
+        self._count += len(ops_3d)
+
+    def get(self, index: int, name: str):
+        """Get the value of a field of the op at index"""
+        bit = _BITS[name]
+        if self._null[index] & bit or not self._set[index] & bit:
+            return None
+        return _GETTERS[name](self, index, name)
+
+    def _get_uuid(self, index: int, name: str) -> UUID:
+        return UUID(bytes=bytes(self._uuids[name][index * 16:index * 16 + 16]))
+
+    def _get_string(self, index: int, name: str) -> str:
+        return self.strings[self._string_columns[name][index]]
+
+    def _get_int(self, index: int, name: str) -> int:
+        return self._int_columns[name][index]
+
+    def _get_float(self, index: int, name: str) -> float:
+        return self._float_columns[name][index]
+
+    def _get_number(self, index: int, name: str) -> float | int:
+        value = self._float_columns[name][index]
+        if self._is_int[index]:
+            return self._large_ints.get((name, index)) or int(value)
+        return value
+
+    def _get_bool(self, index: int, name: str) -> bool:
+        return bool(self._bool_columns[name][index])
+
+    def _get_point(self, index: int, name: str) -> typing.List[float]:
+        start = self._point_starts[name][index]
+        return self._point_values[name][start:start + self._point_lengths[name][index]].tolist()
+
+    def _get_json(self, index: int, name: str):
+        return pydantic_core.from_json(self._json_columns[name][index])
+
+    def set_parent_id(self, index: int, value):
+        """Set (or, with None, null) the parent_id of the op at index"""
+        bit = _BITS["parent_id"]
+        self._set[index] |= bit
+        if value is None:
+            self._null[index] |= bit
+            self._uuids["parent_id"][index * 16:index * 16 + 16] = bytes(16)
+        else:
+            self._null[index] &= ~bit
+            self._uuids["parent_id"][index * 16:index * 16 + 16] = UUID(str(value)).bytes
+
+    def clear_parent_id(self, index: int):
+        """Unset the parent_id of the op at index, as if it never was in the input"""
+        self.set_parent_id(index, None)
+        bit = _BITS["parent_id"]
+        self._set[index] &= ~bit
+        self._null[index] &= ~bit
+
+    def fields_set(self, index: int) -> typing.Set[str]:
+        """Get the names of the fields that were set on the op at index"""
+        mask = self._set[index]
+        return {name for name in FIELDS if mask & _BITS[name]}
+
+    def column(self, name: str, json_compatible: bool = False) -> typing.List[typing.Any]:
+        """Get the values of a field for every op at once
+
+        Values of ops for which the field is None or unset are meaningless.
+
+        Parameters:
+            name (str): The field
+            json_compatible (bool, optional): Give UUIDs as strings
+        """
+        if name in self._uuids:
+            column = self._uuids[name]
+            uuids = (UUID(bytes=bytes(column[i:i + 16])) for i in range(0, len(column), 16))
+            return list(map(str, uuids)) if json_compatible else list(uuids)
+        if name in self._string_columns:
+            return list(map(self.strings.__getitem__, self._string_columns[name]))
+        if name in self._int_columns:
+            return self._int_columns[name].tolist()
+        if name in _NUMBERS:
+            numbers = [int(value) if is_int else value for value, is_int in zip(self._float_columns[name], self._is_int)]
+            for (number_name, index), value in self._large_ints.items():
+                if number_name == name:
+                    numbers[index] = value
+            return numbers
+        if name in self._float_columns:
+            return self._float_columns[name].tolist()
+        if name in self._bool_columns:
+            return list(map(bool, self._bool_columns[name]))
+        if name in self._point_values:
+            values = self._point_values[name].tolist()
+            return [
+                values[start:start + length] if start >= 0 else None
+                for start, length in zip(self._point_starts[name], self._point_lengths[name])]
+        return [None if value is None else pydantic_core.from_json(value) for value in self._json_columns[name]]
+
+    def to_dicts(self) -> typing.List[typing.Dict[str, typing.Any]]:
+        """Get every op as json-compatible python objects, with only the fields that were set"""
+        any_set = 0
+        for set_mask in self._set:
+            any_set |= set_mask
+        columns = {name: self.column(name, json_compatible=True) for name in FIELDS if any_set & _BITS[name]}
+
+        # Most ops share one of a few sets of fields, so only look those up once
+        fields_by_mask = {}
+        ops_3d = []
+        for index, set_mask, null_mask in zip(range(self._count), self._set, self._null):
+            fields = fields_by_mask.get(set_mask)
+            if fields is None:
+                fields = fields_by_mask[set_mask] = [
+                    (name, _BITS[name], columns[name]) for name in FIELDS if set_mask & _BITS[name]]
+            ops_3d.append({
+                name: None if null_mask & bit else column[index] for name, bit, column in fields})
+        return ops_3d
+
+    def nbytes(self) -> int:
+        """Approximate size of the columns, in bytes (not counting the strings table)"""
+        arrays = [
+            self._set, self._null, self._is_int,
+            *self._string_columns.values(), *self._int_columns.values(), *self._float_columns.values(),
+            *self._bool_columns.values(), *self._point_starts.values(), *self._point_lengths.values(),
+            *self._point_values.values()]
+        return (
+            sum(column.itemsize * len(column) for column in arrays)
+            + sum(map(len, self._uuids.values()))
+            + sum(len(value) for column in self._json_columns.values() for value in column if value is not None))
+
+
+# Field name -> OpStore method that reads it
+_GETTERS = {
+    **dict.fromkeys(_UUIDS, OpStore._get_uuid),
+    **dict.fromkeys(_STRINGS, OpStore._get_string),
+    **dict.fromkeys(_INTS, OpStore._get_int),
+    **dict.fromkeys(_FLOATS, OpStore._get_float),
+    **dict.fromkeys(_NUMBERS, OpStore._get_number),
+    **dict.fromkeys(_BOOLS, OpStore._get_bool),
+    **dict.fromkeys(_POINTS, OpStore._get_point),
+    **dict.fromkeys(_JSON, OpStore._get_json),
+}
+
+
+class CompactOp3D:
+    """Flyweight view of one op of an OpStore, with the attributes of ImageFile.Op3D"""
+    __slots__ = ("_store", "_index")
+
+    def __init__(self, store: OpStore, index: int):
+        self._store = store
+        self._index = index
+
+    @property
+    def parent_id(self) -> UUID | None:
+        return self._store.get(self._index, "parent_id")
+
+    @parent_id.setter
+    def parent_id(self, value):
+        self._store.set_parent_id(self._index, value)
+
+    @property
+    def model_fields_set(self) -> typing.Set[str]:
+        """The fields present in the input, or set since (Named for parity with ImageFile)"""
+        return self._store.fields_set(self._index)
+
+    def clear_parent_id(self):
+        """Unset parent_id altogether, as if it never was in the input"""
+        self._store.clear_parent_id(self._index)
+
+    def __eq__(self, other):
+        return isinstance(other, CompactOp3D) and (self._store, self._index) == (other._store, other._index)
+
+    def __hash__(self):
+        return hash((id(self._store), self._index))
+
+    # The correction logic only touches the attributes above, so share it
+    process_correction = ImageFile.Op3D.process_correction
+
+
+def _field_property(name: str) -> property:
+    return property(lambda self: self._store.get(self._index, name), doc=f"The op's {name}")
+
+
+# Read-only properties for every other field
+for _name in FIELDS:
+    if _name != "parent_id":
+        setattr(CompactOp3D, _name, _field_property(_name))
+del _name
+
+
+class CompactOps(typing.Sequence[CompactOp3D]):
+    """The ops_3d of a CompactImageFile, as a sequence of views created on access"""
+    __slots__ = ("_store",)
+
+    def __init__(self, store: OpStore):
+        self._store = store
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [CompactOp3D(self._store, i) for i in range(len(self._store))[index]]
+        if index < 0:
+            index += len(self._store)
+        if not 0 <= index < len(self._store):
+            raise IndexError("op index out of range")
+        return CompactOp3D(self._store, index)
+
+    def __iter__(self) -> typing.Iterator[CompactOp3D]:
+        store = self._store
+        return (CompactOp3D(store, i) for i in range(len(store)))
+
+
+class CompactImageFile:
+    """Image file whose ops_3d are kept in an OpStore
+
+    Attributes:
+        image_info (ImageFile.ImageInfo): Validated image metadata
+        store (OpStore): The ops_3d
+        ops_3d (CompactOps): Views of each op in store
+    """
+
+    def __init__(self, image_info: ImageFile.ImageInfo, store: OpStore):
+        self.image_info = image_info
+        self.store = store
+        self.ops_3d = CompactOps(store)
+
+    @classmethod
+    def from_image_file(cls, image: ImageFile) -> "CompactImageFile":
+        """Move the ops_3d of a validated ImageFile into an OpStore"""
+        store = OpStore()
+        # Dumping is done by pydantic-core at once, and gives exactly the values that ImageFile outputs
+        store.extend(image.model_dump(mode="json", exclude_unset=True, include={"ops_3d"})["ops_3d"])
+        return cls(image.image_info, store)
+
+    @classmethod
+    def model_validate_json(cls, json_data: str | bytes) -> "CompactImageFile":
+        """Parse (and validate) an image file json string (Named for parity with ImageFile)
+
+        The ops_3d are validated and moved into the store a chunk at a time, so
+        that there is never a whole image of Op3D models in memory at once.
+        """
+        document = pydantic_core.from_json(json_data)
+        ops_3d = document.get("ops_3d") if isinstance(document, dict) else None
+        if not isinstance(ops_3d, list):
+            return cls.from_image_file(ImageFile.model_validate(document))
+
+        store = OpStore()
+        try:
+            image = ImageFile.model_validate({**document, "ops_3d": []})
+            for start in range(0, len(ops_3d), _CHUNK):
+                chunk = _OPS.validate_python(ops_3d[start:start + _CHUNK])
+                # Let go of the decoded json of the chunk as soon as it is stored
+                ops_3d[start:start + _CHUNK] = [None] * len(chunk)
+                store.extend(_OPS.dump_python(chunk, mode="json", exclude_unset=True))
+        except pydantic.ValidationError:
+            # Raise the error as ImageFile reports it, with its location in the whole document
+            ImageFile.model_validate_json(json_data)
+            raise
+        return cls(image.image_info, store)
+
+    def model_dump_json(self, exclude_unset: bool = True, indent: int | None = None) -> str:
+        """Serialize this image file back to a json string, like ImageFile (Named for parity with ImageFile)
+
+        Parameters:
+            exclude_unset (bool, optional):
+                Accepted for parity with ImageFile. Only the fields that were set
+                are stored, so this is always effectively true.
+            indent (int, optional): Indentation of the output, or None for compact output
+        """
+        document = {
+            "image_info": self.image_info.model_dump(mode="json", exclude_unset=True),
+            "ops_3d": self.store.to_dicts(),
+        }
+        return pydantic_core.to_json(document, indent=indent).decode()
+
+    # Likewise, only touches image_info.file_name and ops_3d
+    process_corrections = ImageFile.process_corrections
@@ -1,27 +1,51 @@
 """Data model of a Room of images"""
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import mmap
+import os
 from os import PathLike
 from pathlib import Path
 import typing
 
-from .image_file import ImageFile
+from . import dimensions, join, links, spatial, splice
+from .codec import get_codec
 from .correction_file import CorrectionFile
+from .hierarchy import Hierarchy
+from ..metrics import Metrics
+from .. import file_io
 
 
 class Room:
     """Representation of a room of images and associated objects
 
     Attributes:
-        images (list[ImageFile]): 
+        image_files (list[Path]):
+            The paths from which images were parsed
+
+        images (list[ImageFile | LazyImageFile | ...]): 
             A list of the parsed ImageFiles that make up the room
 
+        codec (str):
+            The name of the codec that images were parsed with (see hosta_homework.model.codec)
+
         image_id_to_unique_id (dict[str, UUID]): 
             A dictionary mapping between image_ids and unique_ids.
             Needed for correction processing, as the csv files refer
             to image-ids only, but the output json should employ unique-ids
+
+        metrics (hosta_homework.metrics.Metrics):
+            Timings of each stage, and counters, of processing this Room
     """
 
-    def __init__(self, image_files: typing.List[PathLike]):
+    def __init__(
+            self,
+            image_files: typing.List[PathLike],
+            validate: bool = False,
+            cache=None,
+            metrics: Metrics | None = None,
+            io_workers: int = 4,
+            codec: str | None = None,
+        ):
         """Room constructor
 
         This object parses the provided image json files into a list of
@@ -30,13 +54,67 @@ class Room:
 
         Parameters:
             image_files (list[PathLike]): List of images file paths that comprise the room
+            validate (bool, optional):
+                if true, fully validate the image files into ImageFile models.
+                By default, they are parsed into LazyImageFiles, which only look
+                at the fields needed for correction processing.
+            cache (hosta_homework.cache.IndexCache, optional):
+                if given, parsed images and CSVs are loaded from and stored in this cache
+            metrics (hosta_homework.metrics.Metrics, optional):
+                where to record metrics; by default, a new Metrics object
+            io_workers (int, optional):
+                number of threads that read image files ahead of parsing them.
+                Set to 1 to read in this thread. Default: 4
+            codec (str, optional):
+                how to parse and serialize image files; one of hosta_homework.model.codec.CODECS.
+                Overrides validate. Default: "pydantic" if validate, else "lazy"
         """
+        self.codec = codec or ("pydantic" if validate else "lazy")
+        image_model = get_codec(self.codec)
+
+        self.cache = cache
+        self.metrics = Metrics() if metrics is None else metrics
+        self.image_files = [Path(j) for j in image_files]
         self.images = []
-        for j in image_files:
-            with open(j, "r") as f:
-                data = f.read()
-            self.images.append(ImageFile.model_validate_json(data))
+        self.image_id_to_unique_id = {}
+        self.io_workers = io_workers
+        if cache is None:
+            # Read files in the background while earlier ones are parsed
+            datas = file_io.prefetch(lambda j: self.read_image(j, self.metrics), image_files, io_workers)
+            parsed = (self.parse_image(data, image_model, self.metrics) for data in datas)
+        else:
+            parsed = (
+                cache.get_or_build(
+                    j,
+                    f"image-{image_model.__name__}",
+                    lambda: self.parse_image(self.read_image(j, self.metrics), image_model, self.metrics))
+                for j in image_files)
+
+        for image, index in parsed:
+            self.images.append(image)
+            self.image_id_to_unique_id.update(index)
+
+        self.metrics.count("images", len(self.images))
+        self.metrics.count("ops_3d", sum(len(image.ops_3d) for image in self.images))
 
+        self.join_result = None
+        # The CorrectionFile of the last join
+        self.correction_file = None
+        # Results of check_dimensions
+        self.dimension_check = None
+        # Parents inferred from geometry (see infer_parents)
+        self.inferences = None
+        # parent_id of every op_3d as parsed, and whether it was present at all (see reset_corrections)
+        self._parsed_parent_ids = None
+        # Built on first use (see hierarchy)
+        self._hierarchy = None
+
+
+    def build_index(self):
+        """(Re)build image_id_to_unique_id from scratch, from the parsed images
+
+        The constructor already builds it piecewise, as images are parsed.
+        """
         self.image_id_to_unique_id = {
             str(op_3d.item_id): op_3d.unique_id 
                 for image in self.images 
@@ -44,39 +122,396 @@ class Room:
         }
 
 
-    def process_corrections(self, csv_file: PathLike):
+    @staticmethod
+    def read_image(image_file: PathLike, metrics: Metrics) -> str:
+        """Read an image file, as the constructor does
+
+        Parameters:
+            image_file (PathLike): Path to the image file
+            metrics (Metrics): where to record the time spent, as the "read" stage
+
+        Returns:
+            The contents of the file
+        """
+        with metrics.stage("read"):
+            return file_io.read_text(image_file)
+
+
+    @staticmethod
+    def parse_image(data: str, image_model: type, metrics: Metrics):
+        """Parse an image file's contents, and extract its part of image_id_to_unique_id
+
+        Parameters:
+            data (str): The contents of an image file (see read_image)
+            image_model (type): The codec to parse it with (see hosta_homework.model.codec.get_codec)
+            metrics (Metrics): where to record the time spent, as the "validate" and "index" stages
+
+        Returns:
+            A tuple of the parsed image, and the item_id -> unique_id index of its ops_3d
+        """
+        with metrics.stage("validate"):
+            image = image_model.model_validate_json(data)
+        with metrics.stage("index"):
+            return image, {str(op_3d.item_id): op_3d.unique_id for op_3d in image.ops_3d}
+
+
+    def process_corrections(self, csv_file: PathLike | CorrectionFile, engine: str = "batch", keep_rows: bool = False):
         """Given a csv corrections file, process them into the contained images
 
         It is required that the number of image object columns in the CSV file
         will equal the number of images that comprise the room.
 
         Parameters:
-            csv_file (PathLike): Path to a csv file to process
+            csv_file (PathLike | CorrectionFile): Path to a csv file to process, or an already parsed one
+            engine (str, optional):
+                Name of the join engine to use (see hosta_homework.model.join).
+                "batch" (default) joins all ops at once; "reference" joins
+                one op at a time, logging each; "identity" also follows every
+                alias of each object (see hosta_homework.model.identity)
+            keep_rows (bool, optional):
+                if true, parse csv_file with keep_rows=True (as check_dimensions requires).
+                Engines that need it always do
+
+        Returns:
+            This Room, so that calls can be chained
         """
-        csv = CorrectionFile(csv_file)
+        keep_rows = keep_rows or engine in join.KEEP_ROWS_ENGINES
+        if isinstance(csv_file, CorrectionFile):
+            csv = csv_file
+        elif self.cache is None:
+            csv = CorrectionFile(csv_file, metrics=self.metrics, keep_rows=keep_rows)
+        else:
+            csv = self.cache.get_or_build(
+                csv_file, "CorrectionFile-rows" if keep_rows else "CorrectionFile",
+                lambda: CorrectionFile(csv_file, metrics=self.metrics, keep_rows=keep_rows))
+        self.metrics.count("csv_rows", csv.num_rows)
 
         if csv.num_images != len(self.images):
             raise ValueError(f"Correction file ({csv_file}) processed a different number of images ({csv.num_images}) than comprise this Room ({len(self.images)})!")
 
-        for image in self.images:
-            image.process_corrections(csv, self.image_id_to_unique_id)
+        return self.join_corrections(csv, engine)
+
+
+    def join_corrections(self, csv: CorrectionFile, engine: str = "batch"):
+        """Join the images against already parsed corrections, without checking csv against them
+
+        This is process_corrections without its checks, for callers that have
+        already checked csv against a larger room than this one, such as
+        hosta_homework.two_pass, whose Rooms hold one image of the room at a time.
+
+        Parameters:
+            csv (CorrectionFile): The parsed corrections
+            engine (str, optional): Name of the join engine to use (see process_corrections)
+
+        Returns:
+            This Room, so that calls can be chained
+        """
+        try:
+            join_engine = join.ENGINES[engine]
+        except KeyError:
+            raise ValueError(f"Unknown join engine '{engine}'") from None
+
+        self._snapshot_parent_ids()
+        with self.metrics.stage("join"):
+            self.join_result = join_engine(self.images, csv, self.image_id_to_unique_id)
+        self.correction_file = csv
+        self.metrics.count_join(self.join_result)
+
+        if self._hierarchy is not None:
+            ops = (op_3d for image in self.images for op_3d in image.ops_3d)
+            for op_3d, outcome in zip(ops, self.join_result.outcomes):
+                if outcome == join.JoinOutcome.SUCCESS:
+                    self._hierarchy.refresh(op_3d.unique_id)
+
+        return self
+
+
+    def check_dimensions(self, rel_tol: float = 0.5, abs_tol: float = 0.5, reject: bool = False):
+        """Compare the dimensions of every op with a correction against those in the CSV
+
+        See hosta_homework.model.dimensions. The results are kept in dimension_check,
+        and the ops whose dimensions disagree, or could not be compared because
+        their CSV row's dimensions could not be parsed, are logged.
+
+        This requires process_corrections to have been run with keep_rows=True.
+
+        Parameters:
+            rel_tol (float, optional): Relative tolerance
+            abs_tol (float, optional): Absolute tolerance, in feet
+            reject (bool, optional):
+                if true, also undo the joins of the ops whose dimensions disagree;
+                their outcome becomes JoinOutcome.REJECTED
+
+        Returns:
+            This Room, so that calls can be chained
+        """
+        if self.join_result is None:
+            raise ValueError("The room has not been processed yet")
+
+        with self.metrics.stage("check"):
+            self.dimension_check = dimensions.check_dimensions(
+                self.images, self.correction_file, rel_tol, abs_tol)
+        mismatches = self.dimension_check.mismatches()
+        self.metrics.count("dimension_mismatches", len(mismatches))
+        if mismatches:
+            logging.warning("The dimensions of %d ops_3d disagree with their corrections", len(mismatches))
+        invalids = self.dimension_check.invalids()
+        self.metrics.count("dimension_invalid", len(invalids))
+        if invalids:
+            logging.warning("The corrections of %d ops_3d have dimensions that could not be parsed", len(invalids))
+
+        ops = [op_3d for image in self.images for op_3d in image.ops_3d]
+        rejected = 0
+        for index in mismatches:
+            op_3d = ops[index]
+            logging.debug("Dimensions of op_3d %s (item_id %s) differ from those of Object_ID %s by %.0f%%",
+                op_3d.unique_id, op_3d.item_id,
+                self.correction_file.row(self.dimension_check.rows[index]).object_id,
+                100 * self.dimension_check.deviations[index])
+            if reject and self.join_result.outcomes[index] == join.JoinOutcome.SUCCESS:
+                self._restore_parent_id(index, op_3d)
+                self.join_result.outcomes[index] = join.JoinOutcome.REJECTED
+                self.join_result.parent_ids[index] = None
+                rejected += 1
+
+        if reject:
+            outcomes = self.metrics.join_outcomes
+            outcomes["success"] -= rejected
+            outcomes["rejected"] += rejected
+            logging.info("Rejected %d corrections", rejected)
+        return self
+
+
+    def infer_parents(self, max_distance: float = 1.0, min_confidence: float = 0.5):
+        """Give the hosted ops_3d that still have no parent the nearest wall of their image
 
+        This is meant to run after process_corrections, for the ops that the
+        join could not resolve. See hosta_homework.model.spatial.
 
-    def save_images(self, output_dir: PathLike, force: bool = False):
+        Parameters:
+            max_distance (float, optional): How far from a wall (in metres) an op may be, to be hosted by it
+            min_confidence (float, optional): Parents inferred with a lower confidence (0 to 1) are not set
+
+        Returns:
+            This Room, so that calls can be chained
+        """
+        self._snapshot_parent_ids()
+        with self.metrics.stage("infer"):
+            self.inferences = spatial.infer_parents(self.images, max_distance, min_confidence)
+
+        ops = [op_3d for image in self.images for op_3d in image.ops_3d]
+        for inference in self.inferences:
+            op_3d = ops[inference.op_index]
+            op_3d.parent_id = inference.parent_id
+            if self._hierarchy is not None:
+                self._hierarchy.refresh(op_3d.unique_id)
+
+        self.metrics.count("inferred_parents", len(self.inferences))
+        logging.info("Inferred the parents of %d ops_3d from their geometry", len(self.inferences))
+        return self
+
+
+    def _snapshot_parent_ids(self):
+        """Record the parsed parent_ids, before anything changes them (see reset_corrections)"""
+        if self._parsed_parent_ids is None:
+            self._parsed_parent_ids = [
+                (op_3d.parent_id, self._has_parent_id(op_3d))
+                    for image in self.images
+                        for op_3d in image.ops_3d]
+
+
+    def _restore_parent_id(self, index: int, op_3d):
+        """Restore the parsed parent_id of the op_3d at index (in Room order)"""
+        parent_id, present = self._parsed_parent_ids[index]
+        changed = op_3d.parent_id != parent_id
+        if present:
+            op_3d.parent_id = parent_id
+        else:
+            op_3d.clear_parent_id()
+        if changed and self._hierarchy is not None:
+            self._hierarchy.refresh(op_3d.unique_id)
+
+
+    def reset_corrections(self):
+        """Undo process_corrections (and what followed), restoring every parent_id to its parsed state
+
+        This allows a Room to be kept around (e.g. by hosta_homework.service) and
+        processed again, possibly against a different correction file.
+
+        Returns:
+            This Room, so that calls can be chained
+        """
+        if self._parsed_parent_ids is None:
+            return self
+
+        ops = (op_3d for image in self.images for op_3d in image.ops_3d)
+        for index, op_3d in enumerate(ops):
+            self._restore_parent_id(index, op_3d)
+
+        self.join_result = None
+        self.dimension_check = None
+        self.inferences = None
+        return self
+
+
+    @property
+    def hierarchy(self) -> Hierarchy:
+        """Parent/child index of the objects of this Room (see hosta_homework.model.hierarchy)
+
+        It is built on first use, and from then on kept up to date by
+        process_corrections, infer_parents and reset_corrections.
+        """
+        if self._hierarchy is None:
+            self._hierarchy = Hierarchy.from_room(self)
+        return self._hierarchy
+
+
+    @staticmethod
+    def _has_parent_id(op_3d) -> bool:
+        """Check whether parent_id was given (or set) on an op_3d, even if to None"""
+        return "parent_id" in op_3d.model_fields_set
+
+
+    def save_images(
+            self,
+            output_dir: PathLike,
+            force: bool = False,
+            mode: str = "model",
+            use_mmap: bool = True,
+            only: typing.Container[int] | None = None,
+            compression: str | None = None,
+        ):
         """Save out the output json data that we generated
 
+        There are four output modes:
+          - "model": Re-serialize each image from its parsed representation
+          - "splice": Copy each original image file through byte-for-byte,
+                only inserting/replacing the parent_id fields that changed.
+                See hosta_homework.model.splice
+          - "links" / "jsonpatch": Only write a sidecar table of the parent links
+                made by process_corrections, in one file for the whole room
+                (binary, or as JSON Patch). See hosta_homework.model.links
+
+        Files are written by self.io_workers threads, each through a temporary
+        file that is atomically renamed into place (see hosta_homework.file_io).
+
         Parameters:
             output_dir (PathLike): a directory to put the data in
             force (bool, optional): if true, clobber output data files if they already exist
+            mode (str, optional): one of "model" (default), "splice", "links" or "jsonpatch"
+            use_mmap (bool, optional): in "splice" mode, read original files through mmap
+            only (container[int], optional): if given, only save the images at these indexes
+            compression (str, optional): "gzip" or "zstd" to compress the output files
+
+        Returns:
+            This Room, so that calls can be chained
         """
-        for image in self.images:
-            out_filepath = (Path(output_dir) / image.image_info.file_name).with_suffix(".json")
+        if mode not in ("model", "splice", *links.LINK_MODES):
+            raise ValueError(f"Unknown save mode '{mode}'")
+        if compression is not None and compression not in file_io.COMPRESSIONS:
+            raise ValueError(f"Unknown compression '{compression}'")
+        if mode in links.LINK_MODES:
+            return self._save_links(output_dir, force, links.LINK_MODES[mode], compression)
+
+        with ThreadPoolExecutor(max_workers=max(1, self.io_workers)) as pool:
+            writes = []
+            for index, (image, source) in enumerate(zip(self.images, self.image_files)):
+                if only is not None and index not in only:
+                    continue
+
+                out_filepath = self.output_path(output_dir, image, compression)
+
+                if out_filepath.exists() and not force:
+                    raise ValueError(f"Desired output filepath {out_filepath} already exists and force==False")
+
+                logging.info("Saving %s...", out_filepath)
+                if mode == "splice":
+                    # Mostly file I/O, so entirely in the background
+                    writes.append(pool.submit(
+                        self._splice_image, image, source, out_filepath, use_mmap, self.metrics, compression))
+                else:
+                    # Serialize here, while earlier images are being written in the background
+                    with self.metrics.stage("serialize"):
+                        json_str = image.model_dump_json(exclude_unset=True, indent=2)
+                    writes.append(pool.submit(self._write, out_filepath, json_str, self.metrics, compression))
+
+                self.metrics.count("images_written")
+                self.metrics.count("parent_links_written", sum(op_3d.parent_id is not None for op_3d in image.ops_3d))
+
+            # Raise the first failure, if any
+            for write in writes:
+                write.result()
+
+        return self
+
+
+    def _save_links(self, output_dir: PathLike, force: bool, format: str, compression: str | None):
+        out_filepath = file_io.compressed_path(Path(output_dir) / links.FORMATS[format], compression)
+        if out_filepath.exists() and not force:
+            raise ValueError(f"Desired output filepath {out_filepath} already exists and force==False")
+
+        logging.info("Saving %s...", out_filepath)
+        with self.metrics.stage("serialize"):
+            table = links.LinkTable.from_room(self)
+        with self.metrics.stage("write"):
+            links.write_links(out_filepath, table, format, compression)
+
+        self.metrics.count("parent_links_written", len(table))
+        return self
+
+
+    @staticmethod
+    def output_path(output_dir: PathLike, image, compression: str | None = None) -> Path:
+        """Get the path that save_images writes image to, within output_dir"""
+        return file_io.compressed_path(
+            (Path(output_dir) / image.image_info.file_name).with_suffix(".json"), compression)
+
+
+    @staticmethod
+    def _write(out_filepath: Path, data, metrics: Metrics, compression: str | None):
+        with metrics.stage("write"):
+            file_io.atomic_write(out_filepath, data, compression)
+
+
+    @staticmethod
+    def _splice_image(
+            image,
+            source: Path,
+            out_filepath: Path,
+            use_mmap: bool,
+            metrics: Metrics,
+            compression: str | None = None,
+        ):
+        """Write image to out_filepath by splicing changed parent_ids into its source file"""
+        with metrics.stage("read"), open(source, "rb") as f:
+            # An empty file cannot be mapped
+            use_mmap = use_mmap and os.fstat(f.fileno()).st_size > 0
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if use_mmap else f.read()
+
+        try:
+            with metrics.stage("serialize"):
+                spans = splice.scan_ops(buf)
+                if len(spans) != len(image.ops_3d):
+                    raise ValueError(f"Source file {source} no longer matches its parsed image")
 
-            if out_filepath.exists() and not force:
-                raise ValueError(f"Desired output filepath {out_filepath} already exists and force==False")
+                parent_ids = splice.changed_parent_ids(
+                    buf,
+                    spans,
+                    [None if op_3d.parent_id is None else str(op_3d.parent_id) for op_3d in image.ops_3d])
 
-            logging.info("Saving %s...", out_filepath)
-            json_str = image.model_dump_json(exclude_unset=True, indent=2)
-            with open(out_filepath, "w") as f:
-                f.write(json_str)
+            def chunks():
+                for chunk in splice.splice_parent_ids(buf, spans, parent_ids):
+                    yield chunk
+                    # Views into the mmap must be released before it can be closed
+                    if isinstance(chunk, memoryview):
+                        chunk.release()
 
+            output = chunks()
+            try:
+                Room._write(out_filepath, output, metrics, compression)
+            finally:
+                # Releases any outstanding views, should the write have failed
+                output.close()
+        finally:
+            if use_mmap:
+                buf.close()
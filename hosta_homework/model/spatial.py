@@ -0,0 +1,206 @@
+"""Inference of missing parents from the geometry of ops_3d
+
+The join can only give an op a parent if the CSV says which object hosts it
+(see hosta_homework.model.join), so ops without a correction, or whose Host_ID
+is not in the CSV, are left without one. Most of them are objects that are
+hosted by a wall (cabinets, countertops, doors...), and sit right against it.
+
+This infers such parents from the geometry instead: each unresolved hosted op is
+assigned the nearest wall of its image, with a confidence score.
+
+The coordinates of an image are in metres, in the frame of its camera (y down),
+so the walls are matched in the horizontal (x, z) plane, and images are never
+mixed. A wall is either:
+  - a segment, from its bottom_width_left to its bottom_width_right point, or
+  - if it has no such points, a disc around its centre, as wide as its width
+    (in feet), since its orientation is unknown
+and, if it has both height_bottom and height_top points, it also spans the
+vertical range between them.
+
+The walls of each image are placed in a uniform grid of max_distance-sized
+cells, so that each op is only compared against the walls in the 3x3 cells
+around it, rather than against every wall of the image.
+
+The confidence of a match is 1 for an op inside the wall, and falls linearly to
+0 at max_distance away from it. It is halved unless the op is known to be in
+front of the wall, i.e. if its projection onto the wall falls outside of it (it
+is beside, above or below it), or if the wall is a disc.
+"""
+from array import array
+import math
+import typing
+
+
+# Supercategories of the ops that may be hosted by a wall, and of walls
+HOSTED_SUPERCATEGORIES = frozenset({
+    "base_cabinet_single", "base_cabinet_double", "upper_cabinet_single", "upper_cabinet_double",
+    "countertop", "reference_object", "window", "door"})
+WALL_SUPERCATEGORY = "interior_wall"
+
+_FEET = 0.3048
+
+
+class Inference(typing.NamedTuple):
+    """A parent inferred for one op_3d
+
+    Attributes:
+        op_index (int): Index of the op, in Room order (image by image, op by op)
+        parent_id (UUID | str): unique_id of the wall
+        confidence (float): From 0 (no confidence) to 1
+        distance (float): Horizontal distance from the op's centre to the wall, in metres
+    """
+    op_index: int
+    parent_id: typing.Any
+    confidence: float
+    distance: float
+
+
+class WallIndex:
+    """Uniform grid over the walls of one image, for nearest wall queries
+
+    Attributes:
+        cell_size (float): Side of a grid cell, in metres
+        unique_ids (list[UUID | str]): unique_id of each wall
+    """
+
+    def __init__(self, cell_size: float = 1.0):
+        if cell_size <= 0:
+            raise ValueError("The cell size must be positive")
+        self.cell_size = cell_size
+        self.unique_ids = []
+        # Geometry of each wall: segment (ax, az)-(bx, bz), radius and vertical span (NaN if unknown)
+        self._ax, self._az, self._bx, self._bz = array("d"), array("d"), array("d"), array("d")
+        self._radius, self._y_min, self._y_max = array("d"), array("d"), array("d")
+        self._cells = {}
+
+    @classmethod
+    def from_ops(cls, ops_3d: typing.Iterable[typing.Any], cell_size: float = 1.0) -> "WallIndex":
+        """Index the walls among the ops_3d of an image (of any codec)"""
+        index = cls(cell_size)
+        for op_3d in ops_3d:
+            if op_3d.supercategory == WALL_SUPERCATEGORY:
+                index.add(op_3d)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.unique_ids)
+
+    def add(self, op_3d) -> bool:
+        """Index a wall; return False if it has too little geometry to be placed"""
+        left, right = op_3d.bottom_width_left, op_3d.bottom_width_right
+        if left is not None and right is not None:
+            (ax, _, az), (bx, _, bz) = left, right
+            radius = 0.0
+        elif op_3d.centre is not None and op_3d.width is not None:
+            ax, _, az = bx, _, bz = op_3d.centre
+            radius = op_3d.width * _FEET / 2
+        else:
+            return False
+
+        bottom, top = op_3d.height_bottom, op_3d.height_top
+        if bottom is not None and top is not None:
+            y_min, y_max = sorted((bottom[1], top[1]))
+        else:
+            y_min = y_max = math.nan
+
+        wall = len(self.unique_ids)
+        self.unique_ids.append(op_3d.unique_id)
+        for column, value in zip(
+                (self._ax, self._az, self._bx, self._bz, self._radius, self._y_min, self._y_max),
+                (ax, az, bx, bz, radius, y_min, y_max)):
+            column.append(value)
+
+        # Every cell that the wall's bounding box overlaps
+        size = self.cell_size
+        for i in range(math.floor((min(ax, bx) - radius) / size), math.floor((max(ax, bx) + radius) / size) + 1):
+            for j in range(math.floor((min(az, bz) - radius) / size), math.floor((max(az, bz) + radius) / size) + 1):
+                self._cells.setdefault((i, j), []).append(wall)
+        return True
+
+    def nearest(self, point: typing.Sequence[float]) -> typing.Tuple[int, float, bool] | None:
+        """Find the nearest wall to a point, within one cell_size of it
+
+        Returns:
+            The index of the wall, the horizontal distance to it, and whether the
+            point is in front of it; or None if there is no wall near enough
+        """
+        x, y, z = point
+        size = self.cell_size
+        i, j = math.floor(x / size), math.floor(z / size)
+        candidates = {
+            wall
+                for di in (-1, 0, 1)
+                    for dj in (-1, 0, 1)
+                        for wall in self._cells.get((i + di, j + dj), ())}
+
+        best = None
+        for wall in sorted(candidates):
+            ax, az, bx, bz = self._ax[wall], self._az[wall], self._bx[wall], self._bz[wall]
+            dx, dz = bx - ax, bz - az
+            length_2 = dx * dx + dz * dz
+            t = ((x - ax) * dx + (z - az) * dz) / length_2 if length_2 else 0.0
+            clamped = min(1.0, max(0.0, t))
+            to_axis = math.hypot(x - (ax + clamped * dx), z - (az + clamped * dz))
+            radius = self._radius[wall]
+            distance = max(0.0, to_axis - radius)
+            if distance > size:
+                continue
+
+            # Without an orientation, nothing is known to be in front of a disc
+            beside = t != clamped if length_2 else True
+            y_min, y_max = self._y_min[wall], self._y_max[wall]
+            # Comparisons with NaN are False, so an unknown vertical span always contains y
+            above_or_below = y < y_min or y > y_max
+            # Ties (e.g. inside overlapping discs) go to the wall whose axis is nearest
+            key = (distance, to_axis)
+            if best is None or key < best[0]:
+                best = key, wall, not (beside or above_or_below)
+
+        if best is None:
+            return None
+        (distance, _), wall, in_front = best
+        return wall, distance, in_front
+
+
+def confidence(distance: float, in_front: bool, max_distance: float) -> float:
+    """Score a match of an op to a wall, from 0 to 1 (see the module documentation)"""
+    score = max(0.0, 1.0 - distance / max_distance)
+    return score if in_front else score / 2
+
+
+def infer_parents(
+        images,
+        max_distance: float = 1.0,
+        min_confidence: float = 0.5,
+    ) -> typing.List[Inference]:
+    """Infer the parent wall of every hosted op_3d that has no parent_id
+
+    This does not change the ops; see Room.infer_parents to apply the results.
+
+    Parameters:
+        images (list[ImageFile | LazyImageFile]): The images of a Room
+        max_distance (float, optional): How far from a wall (in metres) an op may be, to be hosted by it
+        min_confidence (float, optional): Inferences with a lower confidence are dropped
+
+    Returns:
+        The inferred parents, in Room order
+    """
+    inferences = []
+    op_index = 0
+    for image in images:
+        walls = None
+        for op_3d in image.ops_3d:
+            if (op_3d.parent_id is None
+                    and op_3d.supercategory in HOSTED_SUPERCATEGORIES
+                    and op_3d.centre is not None):
+                # Only index the walls of the images that have an op to infer
+                if walls is None:
+                    walls = WallIndex.from_ops(image.ops_3d, max_distance)
+                match = walls.nearest(op_3d.centre)
+                if match is not None:
+                    wall, distance, in_front = match
+                    score = confidence(distance, in_front, max_distance)
+                    if score >= min_confidence:
+                        inferences.append(Inference(op_index, walls.unique_ids[wall], score, distance))
+            op_index += 1
+    return inferences
@@ -0,0 +1,249 @@
+"""Byte-level splicing of parent_id fields into original image file json
+
+Correction processing only ever adds (or changes) `parent_id` on some ops_3d[]
+elements, so re-serializing an entire image file to write it back out is mostly
+wasted work, and it is lossy in the sense that formatting, key order and float
+representation are whatever the serializer chooses.
+
+Instead, scan_ops locates each ops_3d[] element in the original bytes, and
+splice_parent_ids copies those bytes through verbatim, only inserting a new
+`"parent_id": "..."` member (or replacing the value of an existing one) where
+needed. Everything else in the output is byte-identical to the input.
+
+The scanner is not a general purpose json parser: it assumes well-formed input
+(which is the case for any file that made it through Room's parsing), and only
+understands as much structure as it needs to.
+"""
+import json
+import re
+import typing
+
+
+# Strings (which may hide structure), and characters that open/close nested structure
+_TOKEN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}]')
+_PARENT_KEY = b'"parent_id"'
+_WHITESPACE = re.compile(rb"[ \t\r\n]*")
+_SCALAR = re.compile(rb"[^,\]}\s]*")
+
+
+class OpSpan(typing.NamedTuple):
+    """Location of one ops_3d[] element within an image file
+
+    Attributes:
+        start (int): Offset of the element's opening brace
+        end (int): Offset one past the element's closing brace
+        parent_value (tuple[int, int] | None): Span of an existing parent_id value, if any
+    """
+    start: int
+    end: int
+    parent_value: typing.Tuple[int, int] | None
+
+
+def _skip_ws(buf, i: int) -> int:
+    return _WHITESPACE.match(buf, i).end()
+
+
+def _string_end(buf, i: int) -> int:
+    """Given the offset of an opening quote, return the offset one past its closing quote"""
+    j = i
+    while True:
+        j = buf.find(b'"', j + 1)
+        if j < 0:
+            raise ValueError(f"Unterminated string at offset {i}")
+        # An odd number of preceding backslashes means this quote is escaped
+        k = j
+        while buf[k - 1] == 0x5C:  # b"\\"
+            k -= 1
+        if (j - k) % 2 == 0:
+            return j + 1
+
+
+def _value_end(buf, i: int) -> int:
+    """Given the offset of the first byte of a json value, return the offset one past its end"""
+    c = buf[i]
+    if c == 0x22:  # b'"'
+        return _string_end(buf, i)
+    if c not in (0x5B, 0x7B):  # b"[", b"{"
+        return _SCALAR.match(buf, i).end()
+
+    depth = 0
+    for m in _TOKEN.finditer(buf, i):
+        c = buf[m.start()]
+        if c == 0x22:
+            continue
+        depth += 1 if c in (0x5B, 0x7B) else -1
+        if depth == 0:
+            return m.end()
+    raise ValueError(f"Unterminated structure at offset {i}")
+
+
+def _members(buf, i: int) -> typing.Iterator[typing.Tuple[bytes, int, int, int]]:
+    """Iterate the members of the object whose opening brace is at offset i
+
+    Yields:
+        (raw key, offset of the key, offset of the value, offset one past the value)
+        and finally returns the offset one past the closing brace via StopIteration.value
+    """
+    j = _skip_ws(buf, i + 1)
+    if buf[j] == 0x7D:  # b"}"
+        return j + 1
+    while True:
+        key_end = _string_end(buf, j)
+        value_start = _skip_ws(buf, _skip_ws(buf, key_end) + 1)  # skip the colon
+        value_end = _value_end(buf, value_start)
+        yield bytes(buf[j + 1:key_end - 1]), j, value_start, value_end
+
+        j = _skip_ws(buf, value_end)
+        if buf[j] == 0x7D:
+            return j + 1
+        j = _skip_ws(buf, j + 1)  # skip the comma
+
+
+def _insertion(buf, span: OpSpan) -> typing.Tuple[int, bytes, bytes]:
+    """Work out where and how to insert a new member into an ops_3d element
+
+    Only needed for the (few) elements that get a new parent_id, so scan_ops
+    leaves this out.
+
+    Returns:
+        The offset at which to insert (just after the last member), what to put
+        before the new member (e.g. b',\\n      '), and what goes between its key
+        and value (e.g. b': ')
+    """
+    start = span.start
+    member_sep = b", "
+    key_sep = b": "
+
+    # Just after the last member, i.e. before any whitespace preceding the closing brace
+    insert_at = span.end - 1
+    while buf[insert_at - 1] in b" \t\r\n":
+        insert_at -= 1
+
+    # Mimic the formatting of the first members for any inserted member
+    previous_end = None
+    for num_members, (_, key_start, value_start, value_end) in enumerate(_members(buf, start)):
+        if num_members == 0:
+            key_sep = bytes(buf[_string_end(buf, key_start):value_start])
+            leading = bytes(buf[start + 1:key_start])
+            if b"\n" in leading:
+                member_sep = b"," + leading
+            else:
+                # Inline object; guess whether it is compact from the key separator
+                member_sep = b", " if key_sep.endswith(b" ") else b","
+        else:
+            # Better: the actual separator between the first two members
+            member_sep = bytes(buf[previous_end:key_start])
+            break
+        previous_end = value_end
+
+    return insert_at, member_sep, key_sep
+
+
+def scan_ops(buf) -> typing.List[OpSpan]:
+    """Locate every element of the top-level ops_3d array
+
+    This is the hot path of splicing: rather than walking every member of every
+    element, a single regex pass visits only strings and brackets, and keeps
+    track of nesting depth.
+
+    Parameters:
+        buf (bytes | mmap): The raw image file json
+
+    Returns:
+        An OpSpan for each element of ops_3d, in order
+    """
+    top = _skip_ws(buf, 0)
+    if buf[top:top + 1] != b"{":  # Also if buf is empty
+        raise ValueError("Image file is not a json object")
+
+    for key, _, value_start, _ in _members(buf, top):
+        if key != b"ops_3d":
+            continue
+
+        spans = []
+        depth = 0
+        op_start = 0
+        parent_value = None
+        for m in _TOKEN.finditer(buf, value_start + 1):
+            i = m.start()
+            c = buf[i]
+            if c == 0x22:  # b'"'
+                if depth == 1 and m.end() - i == len(_PARENT_KEY) and buf[i:m.end()] == _PARENT_KEY:
+                    colon = _skip_ws(buf, m.end())
+                    if buf[colon] == 0x3A:  # b":", i.e. this is a key, not a value
+                        parent_start = _skip_ws(buf, colon + 1)
+                        parent_value = (parent_start, _value_end(buf, parent_start))
+            elif c in (0x5B, 0x7B):  # b"[", b"{"
+                if depth == 0:
+                    op_start = i
+                    parent_value = None
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    spans.append(OpSpan(op_start, m.end(), parent_value))
+                elif depth < 0:
+                    # End of ops_3d
+                    return spans
+        raise ValueError("Unterminated ops_3d")
+
+    raise ValueError("Image file has no ops_3d")
+
+
+def changed_parent_ids(
+        buf,
+        spans: typing.Sequence[OpSpan],
+        parent_ids: typing.Sequence[str | None],
+    ) -> typing.Dict[int, str | None]:
+    """Work out which ops_3d elements need a new parent_id
+
+    Parameters:
+        buf (bytes | mmap): The raw image file json
+        spans (list[OpSpan]): Result of scan_ops(buf)
+        parent_ids (list[str | None]): The desired parent_id of every ops_3d element
+
+    Returns:
+        A mapping of ops_3d index to parent_id, for only those that differ from buf
+    """
+    changed = {}
+    for index, (span, parent_id) in enumerate(zip(spans, parent_ids)):
+        if span.parent_value is None:
+            if parent_id is not None:
+                changed[index] = parent_id
+        elif json.loads(bytes(buf[slice(*span.parent_value)])) != parent_id:
+            changed[index] = parent_id
+    return changed
+
+
+def splice_parent_ids(
+        buf,
+        spans: typing.Sequence[OpSpan],
+        parent_ids: typing.Mapping[int, str | None],
+    ) -> typing.Iterator[memoryview | bytes]:
+    """Copy buf through, setting parent_id on some ops_3d elements
+
+    Parameters:
+        buf (bytes | mmap): The raw image file json
+        spans (list[OpSpan]): Result of scan_ops(buf)
+        parent_ids (dict[int, str | None]): New parent_id for each modified ops_3d index
+
+    Yields:
+        Chunks of the output; mostly zero-copy views of buf
+    """
+    view = memoryview(buf)
+    pos = 0
+    for index in sorted(parent_ids):
+        span = spans[index]
+        value = json.dumps(parent_ids[index]).encode()
+        if span.parent_value is not None:
+            value_start, value_end = span.parent_value
+            yield view[pos:value_start]
+            yield value
+            pos = value_end
+        else:
+            insert_at, member_sep, key_sep = _insertion(buf, span)
+            yield view[pos:insert_at]
+            sep = member_sep if insert_at != span.start + 1 else b""
+            yield sep + b'"parent_id"' + key_sep + value
+            pos = insert_at
+    yield view[pos:]
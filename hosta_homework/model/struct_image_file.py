@@ -0,0 +1,135 @@
+"""msgspec-based counterpart to hosta_homework.model.image_file
+
+Unlike LazyImageFile, this validates the whole image file against its schema, like
+ImageFile does; but msgspec decodes straight into (and encodes straight from) slotted
+structs, which is several times faster than building pydantic models.
+
+The structs are generated from the pydantic models, so that ImageFile stays the
+single definition of the schema. To keep the round-trip guarantee of ImageFile's
+model_dump_json(exclude_unset=True), optional fields that are absent from the input
+are UNSET (and left out on encoding) rather than None. They are stored under a
+trailing underscore (e.g. `parent_id_`), and exposed under their own name as
+properties which read as None when UNSET, for parity with ImageFile.
+
+Like ImageFile (and unlike LazyImageFile), this drops json fields that are not in
+the schema.
+
+Requires the optional msgspec package.
+"""
+import functools
+import operator
+import types
+import typing
+
+import msgspec
+from pydantic import BaseModel
+
+from .image_file import ImageFile
+
+
+def _optional_property(raw_name: str, default):
+    def get(self):
+        value = getattr(self, raw_name)
+        return default if value is msgspec.UNSET else value
+
+    def set(self, value):
+        setattr(self, raw_name, value)
+
+    return property(get, set)
+
+
+def _model_fields_set(self) -> typing.Set[str]:
+    """The fields that were given, or set since; like pydantic's"""
+    return {
+        name for name, raw_name in type(self).__model_fields__.items()
+        if getattr(self, raw_name) is not msgspec.UNSET}
+
+
+def _struct_type(annotation, structs: typing.Dict[type, type]):
+    """Translate an annotation of a pydantic model, replacing models by their structs"""
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return _struct_for(annotation, structs)
+
+    args = typing.get_args(annotation)
+    if not args:
+        return annotation
+    args = tuple(_struct_type(arg, structs) for arg in args)
+    origin = typing.get_origin(annotation)
+    if origin in (typing.Union, types.UnionType):
+        return functools.reduce(operator.or_, args)
+    return origin[args]
+
+
+def _struct_for(model: typing.Type[BaseModel], structs: typing.Dict[type, type], namespace=None) -> type:
+    """Generate (once) the msgspec struct mirroring a pydantic model"""
+    if model in structs:
+        return structs[model]
+
+    fields = []
+    rename = {}
+    model_fields = {}
+    namespace = dict(namespace or {})
+    for name, field in model.model_fields.items():
+        annotation = _struct_type(field.annotation, structs)
+        if field.is_required():
+            fields.append((name, annotation))
+            model_fields[name] = name
+        else:
+            raw_name = f"{name}_"
+            fields.append((raw_name, annotation | msgspec.UnsetType, msgspec.UNSET))
+            rename[raw_name] = name
+            model_fields[name] = raw_name
+            namespace[name] = _optional_property(raw_name, field.default)
+
+    namespace["__model_fields__"] = model_fields
+    namespace["model_fields_set"] = property(_model_fields_set)
+    # Picklable (e.g. by hosta_homework.cache) as a global of this module
+    struct = msgspec.defstruct(
+        f"Struct{model.__name__}", fields, namespace=namespace, rename=rename, kw_only=True, module=__name__)
+    globals()[struct.__name__] = struct
+    structs[model] = struct
+    return struct
+
+
+def _clear_parent_id(self):
+    """Unset parent_id altogether, as if it never was in the input"""
+    self.parent_id_ = msgspec.UNSET
+
+
+_structs = {}
+
+StructOp3D = _struct_for(ImageFile.Op3D, _structs, namespace={
+    # Shared verbatim with the pydantic models, as for LazyImageFile
+    "process_correction": ImageFile.Op3D.process_correction,
+    "clear_parent_id": _clear_parent_id,
+})
+
+
+@classmethod
+def _model_validate_json(cls, json_data: str | bytes):
+    """Parse and validate an image file json string (Named for parity with ImageFile)"""
+    return _decoder.decode(json_data)
+
+
+def _model_dump_json(self, exclude_unset: bool = True, indent: int | None = None) -> str:
+    """Serialize this image file back to a json string (Named for parity with ImageFile)
+
+    Parameters:
+        exclude_unset (bool, optional):
+            Accepted for parity with ImageFile; UNSET fields are always left out
+        indent (int, optional): Indentation of the output, or None for compact output
+    """
+    data = _encoder.encode(self)
+    if indent is not None:
+        data = msgspec.json.format(data, indent=indent)
+    return data.decode()
+
+
+StructImageFile = _struct_for(ImageFile, _structs, namespace={
+    "model_validate_json": _model_validate_json,
+    "model_dump_json": _model_dump_json,
+    "process_corrections": ImageFile.process_corrections,
+})
+
+_decoder = msgspec.json.Decoder(StructImageFile)
+_encoder = msgspec.json.Encoder()
@@ -0,0 +1,355 @@
+"""Long-running correction service, with a warm cache of parsed rooms
+
+Every CLI invocation pays for interpreter startup, building the pydantic schemas
+and parsing every input from scratch. When rooms arrive one at a time (e.g. from
+an upstream pipeline), that dominates the latency of each room. This module
+instead runs as a daemon, which accepts jobs over a Unix socket (or a localhost
+TCP port) and keeps recently used Rooms and CorrectionFiles parsed in memory.
+
+Protocol: newline-delimited json. Each request line is a job:
+
+    {"id": 1, "images": ["/rooms/a/1.json", ...], "csv": "/rooms/a/corrections.csv",
+     "output_dir": "/out/a", "engine": "batch", "save_mode": "model", "force": true}
+
+("id", "engine", "save_mode", "compression", "force", "validate" and "codec" are optional.) Each job is
+answered by one response line, carrying the same "id":
+
+    {"id": 1, "ok": true, "seconds": 0.012, "cached": {"room": true, "csv": false}, "metrics": {...}}
+    {"id": 2, "ok": false, "error": "..."}
+
+A connection may send any number of jobs without waiting for the responses, which
+come back in order of completion, not submission. A line longer than the
+stream's limit (64KiB) is answered with an error, and ends the connection.
+
+Concurrency and backpressure: jobs are queued in a bounded queue, and executed by
+a fixed number of workers (each in a thread, so that the event loop stays
+responsive). When the queue is full, the service stops reading from connections
+until there is room again, which in turn blocks clients in their writes.
+Jobs on the same room are serialized, as a Room is mutated by processing.
+
+The caches are keyed by input paths, and are invalidated when any input file's
+size or mtime changes. They are bounded by the total size of the input files of
+their entries, which is roughly proportional to the memory they take up.
+
+Usage:
+    python -m hosta_homework.service --socket /tmp/hosta.sock
+    python -m hosta_homework.service --port 8765
+"""
+from argparse import ArgumentParser
+import asyncio
+from collections import OrderedDict
+import json
+import logging
+import os
+from pathlib import Path
+import time
+import typing
+import weakref
+
+from . import model
+from .metrics import Metrics
+
+
+class LRUCache:
+    """An LRU cache of parsed files, bounded by the size of the files
+
+    Entries are stamped with the size and mtime of their files; an entry whose
+    files changed since it was stored is a miss.
+
+    Attributes:
+        max_bytes (int): Upper bound on the total size of the input files of all entries
+        size (int): Current total size of the input files of all entries
+        hits (int): Number of lookups that were served from the cache
+        misses (int): Number of lookups that were not
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (stamp, size, value)
+
+    @staticmethod
+    def stamp(paths: typing.Sequence[os.PathLike]) -> typing.Tuple[typing.Tuple[int, int], ...]:
+        """Get the size and mtime of every path"""
+        return tuple((stat.st_size, stat.st_mtime_ns) for stat in map(os.stat, paths))
+
+    def get(self, key, stamp):
+        """Get the value stored under key, if its files still match stamp"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != stamp:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[2]
+
+    def put(self, key, stamp, value):
+        """Store value under key, then evict least recently used entries until it fits"""
+        self.discard(key)
+        size = sum(file_size for file_size, _ in stamp)
+        self._entries[key] = (stamp, size, value)
+        self.size += size
+        # Always keep the newest entry, even if it alone exceeds the bound
+        while self.size > self.max_bytes and len(self._entries) > 1:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def discard(self, key):
+        """Remove the entry under key, if any"""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CorrectionService:
+    """The job queue, workers and warm caches of the correction service
+
+    Attributes:
+        rooms (LRUCache): Parsed Rooms, keyed by their image files (and codec)
+        correction_files (LRUCache): Parsed CorrectionFiles, keyed by path and whether all rows were kept
+        queue (asyncio.Queue): Pending jobs
+    """
+
+    def __init__(self, cache_size: int = 1 << 30, concurrency: int = 4, max_pending: int = 64):
+        """CorrectionService constructor
+
+        Parameters:
+            cache_size (int, optional):
+                Upper bound on the size of the input files of the cached rooms,
+                and, separately, the cached correction files. Default: 1GiB
+            concurrency (int, optional): Number of jobs to run at once. Default: 4
+            max_pending (int, optional): Number of jobs that may be queued before applying backpressure
+        """
+        self.rooms = LRUCache(cache_size)
+        self.correction_files = LRUCache(cache_size)
+        self.concurrency = concurrency
+        self.queue = asyncio.Queue(max_pending)
+        self._locks = weakref.WeakValueDictionary()
+        self._workers = []
+
+    def start(self):
+        """Start the workers (requires a running event loop)"""
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        """Cancel the workers"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, job: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        """Queue a job (waiting for room in the queue), and wait for its response"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((job, future))
+        return await future
+
+    async def _worker(self):
+        while True:
+            job, future = await self.queue.get()
+            try:
+                response = await self.process(job)
+            except Exception as e:
+                logging.exception("Failed to process job %s", job.get("id"))
+                response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            if "id" in job:
+                response["id"] = job["id"]
+            if not future.cancelled():
+                future.set_result(response)
+            self.queue.task_done()
+
+    def _lock(self, key) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    async def process(self, job: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        """Process one job, reusing cached parsed inputs where possible"""
+        start = time.perf_counter()
+        image_files = [Path(p) for p in job["images"]]
+        csv_file = Path(job["csv"])
+        output_dir = Path(job["output_dir"])
+        codec = job.get("codec") or ("pydantic" if job.get("validate") else "lazy")
+        # As Room.process_corrections would parse it; a cached CorrectionFile is used as it is
+        keep_rows = job.get("engine", "batch") in model.join.KEEP_ROWS_ENGINES
+        metrics = Metrics()
+
+        room_key = (tuple(map(str, image_files)), codec)
+        csv_key = (str(csv_file), keep_rows)
+        async with self._lock(room_key):
+            # Cache bookkeeping happens on the event loop, parsing and processing in a thread
+            csv_stamp = LRUCache.stamp([csv_file])
+            csv = self.correction_files.get(csv_key, csv_stamp)
+            csv_cached = csv is not None
+            if csv is None:
+                csv = await asyncio.to_thread(model.CorrectionFile, csv_file, metrics, keep_rows)
+                self.correction_files.put(csv_key, csv_stamp, csv)
+
+            room_stamp = LRUCache.stamp(image_files)
+            room = self.rooms.get(room_key, room_stamp)
+            room_cached = room is not None
+            if room is None:
+                room = await asyncio.to_thread(model.Room, image_files, metrics=metrics, codec=codec)
+                self.rooms.put(room_key, room_stamp, room)
+
+            await asyncio.to_thread(self._run, room, csv, output_dir, job, metrics)
+
+        return {
+            "ok": True,
+            "seconds": time.perf_counter() - start,
+            "cached": {"room": room_cached, "csv": csv_cached},
+            "metrics": metrics.report(),
+        }
+
+    @staticmethod
+    def _run(room: model.Room, csv: model.CorrectionFile, output_dir: Path, job, metrics: Metrics):
+        room.metrics = metrics
+        output_dir.mkdir(parents=True, exist_ok=True)
+        (room.reset_corrections()
+            .process_corrections(csv, engine=job.get("engine", "batch"))
+            .save_images(
+                output_dir,
+                force=bool(job.get("force", False)),
+                mode=job.get("save_mode", "model"),
+                compression=job.get("compression")))
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve the jobs of one client connection"""
+        loop = asyncio.get_running_loop()
+        write_lock = asyncio.Lock()
+        responses = set()
+
+        async def respond(future):
+            response = await future
+            async with write_lock:
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+
+        def answer(future):
+            task = asyncio.create_task(respond(future))
+            responses.add(task)
+            task.add_done_callback(responses.discard)
+
+        try:
+            while True:
+                future = loop.create_future()
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError) as e:
+                    # A line beyond the stream's limit: where the next job starts is lost, so stop reading
+                    future.set_result({"ok": False, "error": f"Malformed job: {e}"})
+                    answer(future)
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+
+                try:
+                    job = json.loads(line)
+                    if not isinstance(job, dict):
+                        raise ValueError("a job must be a json object")
+                except ValueError as e:
+                    future.set_result({"ok": False, "error": f"Malformed job: {e}"})
+                else:
+                    # Blocks while the queue is full, and thereby stops reading: that is the backpressure
+                    await self.queue.put((job, future))
+                answer(future)
+            await asyncio.gather(*responses)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(
+        socket_path: os.PathLike | None = None,
+        port: int | None = None,
+        host: str = "127.0.0.1",
+        ready: typing.Callable[[], None] | None = None,
+        **service_options,
+    ):
+    """Run the correction service until cancelled
+
+    Parameters:
+        socket_path (PathLike, optional): Listen on this Unix socket
+        port (int, optional): Otherwise, listen on this TCP port of host
+        host (str, optional): Interface to listen on with port. Default: localhost only
+        ready (callable, optional): Called once the service accepts connections
+        **service_options: Passed on to CorrectionService
+    """
+    service = CorrectionService(**service_options)
+    service.start()
+    if socket_path is not None:
+        server = await asyncio.start_unix_server(service.handle_connection, path=socket_path)
+    elif port is not None:
+        server = await asyncio.start_server(service.handle_connection, host=host, port=port)
+    else:
+        raise ValueError("Either a socket path or a port is required")
+
+    logging.info("Correction service listening on %s", socket_path or f"{host}:{port}")
+    try:
+        async with server:
+            if ready is not None:
+                ready()
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+async def request(
+        jobs: typing.Sequence[typing.Dict[str, typing.Any]],
+        socket_path: os.PathLike | None = None,
+        port: int | None = None,
+        host: str = "127.0.0.1",
+    ) -> typing.List[typing.Dict[str, typing.Any]]:
+    """Send jobs to a running service, and wait for all of their responses
+
+    Returns:
+        The responses, in order of completion
+    """
+    if socket_path is not None:
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+
+    try:
+        for job in jobs:
+            writer.write(json.dumps(job).encode() + b"\n")
+        await writer.drain()
+        return [json.loads(await reader.readline()) for _ in jobs]
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog="hosta_homework.service", description="Run the correction service")
+    address = parser.add_mutually_exclusive_group(required=True)
+    address.add_argument("--socket", type=Path, help="Listen on this Unix socket")
+    address.add_argument("--port", type=int, help="Listen on this localhost TCP port")
+    parser.add_argument("--cache-size", type=int, default=1024,
+        help="Upper bound on the input size of the cached rooms (and of the cached CSVs), in MiB. Default: 1024")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of jobs to run at once. Default: 4")
+    parser.add_argument("--max-pending", type=int, default=64,
+        help="Number of queued jobs beyond which clients are made to wait. Default: 64")
+    parser.add_argument("--log-level", choices=logging.getLevelNamesMapping().keys(), default="WARNING",
+        help="Specify which log level to emit at. Default: WARNING")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.getLevelNamesMapping()[args.log_level])
+    try:
+        asyncio.run(serve(
+            args.socket,
+            args.port,
+            cache_size=args.cache_size << 20,
+            concurrency=args.concurrency,
+            max_pending=args.max_pending))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,265 @@
+"""Deterministic generator of synthetic rooms, for testing and benchmarking
+
+Generated rooms are shaped like the example data in data/: a number of image json
+files, and a UTF-16, tab-separated correction CSV with an ImageN_Object_ID column
+per image. They can be scaled to any number of images and ops per image.
+
+The generated data reproduces the quirks of the real data that the correction
+logic has to cope with:
+  - Objects seen in several images, with an item_id per image and every alias
+    listed in imageIds
+  - Walls (hosts) without a Host_ID, children hosted by walls
+  - Ops that are not in the CSV at all
+  - CSV rows whose Host_ID refers to an object that is not in the CSV
+  - Image object IDs in the CSV that are not an item_id in any image
+  - Duplicate CSV rows, "0" and "" image object IDs, and rows without any IDs
+
+For the same parameters and seed, the output is always byte-for-byte identical.
+
+Usage:
+    python -m hosta_homework.synthetic OUTPUT_DIR --images 3 --ops-per-image 1000
+"""
+from argparse import ArgumentParser
+import csv
+import json
+import os
+from pathlib import Path
+import random
+import typing
+import uuid
+
+
+CHILD_CATEGORIES = [
+    ("base_cabinet_single", "drawer_and_door-wood", "base_cabinet: base_cabinet"),
+    ("base_cabinet_double", "drawer_and_door-wood", "base_cabinet: base_cabinet"),
+    ("upper_cabinet_single", "wood", "upper_cabinet: upper_cabinet"),
+    ("upper_cabinet_double", "wood", "upper_cabinet: upper_cabinet"),
+    ("countertop", "granite", "countertop: countertop"),
+    ("reference_object", "refrigerator-side_by_side", "special_equipment-refrigerator: 36in"),
+    ("window", "double_hung", "window: double_hung"),
+    ("door", "hinged", "door: hinged"),
+]
+
+
+class _Object:
+    """An object of the room, as it exists before being split into images"""
+    __slots__ = ("object_id", "is_wall", "host", "category", "dims", "position", "item_ids", "listed")
+
+    def __init__(self, object_id, is_wall, host, category, dims, position, listed):
+        self.object_id = object_id
+        self.is_wall = is_wall
+        self.host = host
+        self.category = category
+        self.dims = dims
+        self.position = position
+        self.item_ids = {}  # image index -> item_id
+        self.listed = listed
+
+
+def _point(rng: random.Random, centre, spread: float):
+    return [c + rng.uniform(-spread, spread) for c in centre]
+
+
+def _wall_op(rng: random.Random, obj: _Object, unique_id: str, item_id: int, image_ids):
+    x, y, z = obj.position
+    half = obj.dims[2] / 2 * 0.3048
+    left = [x - half, y + 1.2, z]
+    right = [x + half, y + 1.2, z]
+    return {
+        "supercategory": "interior_wall",
+        "bottom_width_left": left,
+        "bottom_width_right": right,
+        "height_bottom": left,
+        "height_top": [x - half, y - 1.2, z],
+        "width": obj.dims[2],
+        "height": obj.dims[0],
+        "centre": [x, y, z],
+        "unit": "SF",
+        "quantity": obj.dims[0] * obj.dims[2],
+        "quantity_field": "area",
+        "baseboard": rng.random() < 0.5,
+        "chair_guard": False,
+        "wall_protection": False,
+        "molding": False,
+        "corner_guard": False,
+        "unique_id": unique_id,
+        "wall_type": None,
+        "detections": [{
+            "subcategory": "gypsum",
+            "width": None,
+            "height": None,
+            "centre": None,
+            "unit": None,
+            "quantity": None,
+            "quantity_field": "area",
+            "unique_id": str(uuid.UUID(int=rng.getrandbits(128))),
+        }],
+        "item_id": item_id,
+        "sqft": obj.dims[0] * obj.dims[2],
+        "imageIds": image_ids,
+    }
+
+
+def _child_op(rng: random.Random, obj: _Object, unique_id: str, item_id: int, image_ids):
+    supercategory, subcategory, _ = obj.category
+    centre = list(obj.position)
+    return {
+        "supercategory": supercategory,
+        "subcategory": subcategory,
+        "height_bottom": _point(rng, centre, 0.5),
+        "height_top": _point(rng, centre, 0.5),
+        "bottom_width_left": _point(rng, centre, 0.5),
+        "bottom_width_right": _point(rng, centre, 0.5),
+        "depth_front": None,
+        "depth_back": None,
+        "width": obj.dims[2],
+        "height": obj.dims[0],
+        "depth": obj.dims[1],
+        "centre": centre,
+        "unit": "EA",
+        "quantity": 1,
+        "quantity_field": "ea",
+        "unique_id": unique_id,
+        "parent_structure": "interior_wall",
+        "item_id": item_id,
+        "imageIds": image_ids,
+    }
+
+
+def generate_room(
+        directory: os.PathLike,
+        num_images: int = 3,
+        ops_per_image: int = 50,
+        csv_rows: int = 0,
+        seed: int = 0,
+        shared_fraction: float = 0.1,
+        unlisted_fraction: float = 0.1,
+        missing_host_fraction: float = 0.05,
+        duplicate_fraction: float = 0.05,
+        stale_id_fraction: float = 0.02,
+    ) -> typing.Tuple[typing.List[Path], Path]:
+    """Generate a synthetic room into directory
+
+    Parameters:
+        directory (PathLike): Where to write the room (created if needed)
+        num_images (int, optional): Number of image files
+        ops_per_image (int, optional): Number of ops_3d per image (approximately, with shared objects)
+        csv_rows (int, optional): Pad the CSV with empty rows up to at least this many rows
+        seed (int, optional): Seed of the random number generator
+        shared_fraction (float, optional): Probability that an object is also seen in other images
+        unlisted_fraction (float, optional): Probability that an object is missing from the CSV
+        missing_host_fraction (float, optional): Probability that a child's Host_ID is not in the CSV
+        duplicate_fraction (float, optional): Probability that a CSV row is duplicated
+        stale_id_fraction (float, optional): Probability that a CSV image object ID matches no item_id
+
+    Returns:
+        The paths of the image files, and the path of the CSV file
+    """
+    rng = random.Random(seed)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    walls_per_image = max(1, ops_per_image // 8)
+    next_item_id = 1
+    next_object_id = 1_000_000
+    objects = []
+    image_objects = [[] for _ in range(num_images)]
+
+    for image in range(num_images):
+        image_walls = []
+        while len(image_objects[image]) < ops_per_image:
+            is_wall = len(image_walls) < walls_per_image
+            if is_wall:
+                # Walls are planes facing the camera, at various distances
+                position = (rng.uniform(-4, 4), rng.uniform(-0.2, 0.2), rng.uniform(3, 12))
+                host = None
+                category = None
+                dims = (8.0, 0.5, rng.choice([4.0, 6.5, 9.5, 12.0, 21.0]))
+            else:
+                host = rng.choice(image_walls)
+                category = rng.choice(CHILD_CATEGORIES)
+                # Hosted near its wall, slightly in front of it
+                position = tuple(_point(rng, host.position[:2], 1.5)) + (host.position[2] - rng.uniform(0.1, 0.4),)
+                dims = tuple(rng.choice([0.5, 1.0, 1.25, 1.5, 2.0, 2.5, 2.88, 3.0, 3.5]) for _ in range(3))
+
+            obj = _Object(next_object_id, is_wall, host, category, dims, position, rng.random() >= unlisted_fraction)
+            next_object_id += 1
+            objects.append(obj)
+            if is_wall:
+                image_walls.append(obj)
+
+            visible = [image] + [i for i in range(image + 1, num_images) if rng.random() < shared_fraction]
+            for i in visible:
+                obj.item_ids[i] = next_item_id
+                next_item_id += 1
+                image_objects[i].append(obj)
+
+    # Images
+    image_files = []
+    for image, image_objs in enumerate(image_objects):
+        ops = []
+        for obj in image_objs:
+            item_id = obj.item_ids[image]
+            aliases = [str(item_id)] + [str(obj.item_ids[i]) for i in sorted(obj.item_ids) if i != image]
+            image_ids = aliases if obj.listed else []
+            unique_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            make_op = _wall_op if obj.is_wall else _child_op
+            ops.append(make_op(rng, obj, unique_id, item_id, image_ids))
+
+        name = str(uuid.UUID(int=rng.getrandbits(128)))
+        image_file = directory / f"{name}.json"
+        with open(image_file, "w") as f:
+            json.dump({
+                "image_info": {"file_name": f"{name}.jpeg", "width": 640, "height": 480, "scale": 0.3125},
+                "ops_3d": ops,
+            }, f, indent=2)
+        image_files.append(image_file)
+
+    # Correction CSV
+    image_columns = [f"Image{i}_Object_ID" for i in range(1, num_images + 1)]
+    header = ["Family and Type", "Height", "Depth", "Width", "Trim Length", "Area", *image_columns, "Object_ID", "Host_ID"]
+
+    rows = []
+    for obj in objects:
+        if not obj.listed:
+            continue
+        if obj.is_wall:
+            family, host_id = "Basic Wall: Interior", ""
+        elif rng.random() < missing_host_fraction:
+            family, host_id = obj.category[2], str(next_object_id + rng.randrange(1_000_000))
+        else:
+            family, host_id = obj.category[2], str(obj.host.object_id)
+        height, depth, width = (f"{d:.2f} ft" for d in obj.dims)
+        image_ids = [
+            (str(next_item_id + rng.randrange(1_000_000)) if rng.random() < stale_id_fraction else str(obj.item_ids[i]))
+            if i in obj.item_ids else rng.choice(["0", "0", ""])
+            for i in range(num_images)]
+        row = [family, height, depth, width, "", "", *image_ids, str(obj.object_id), host_id]
+
+        rows.append(row)
+        if rng.random() < duplicate_fraction:
+            rows.append(row)
+
+    while len(rows) < csv_rows:
+        rows.append(["Dimension_Point: Dimension_Point"] + [""] * (len(header) - 1))
+    rng.shuffle(rows)
+
+    csv_file = directory / "EXP_ObjectID_HostID.csv"
+    with open(csv_file, "w", encoding="utf-16", newline="") as f:
+        writer = csv.writer(f, dialect=csv.excel_tab, quoting=csv.QUOTE_ALL, lineterminator="\n")
+        writer.writerow(header)
+        writer.writerows(rows)
+
+    return image_files, csv_file
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog="hosta_homework.synthetic", description="Generate a synthetic room")
+    parser.add_argument("directory", type=Path, help="Where to write the room")
+    parser.add_argument("--images", type=int, default=3, help="Number of images. Default: 3")
+    parser.add_argument("--ops-per-image", type=int, default=50, help="Number of ops_3d per image. Default: 50")
+    parser.add_argument("--csv-rows", type=int, default=0, help="Pad the CSV to at least this many rows")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed. Default: 0")
+    args = parser.parse_args()
+
+    generate_room(args.directory, args.images, args.ops_per_image, args.csv_rows, args.seed)
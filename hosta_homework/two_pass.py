@@ -0,0 +1,128 @@
+"""Low-memory, two-pass processing of a room, one image at a time
+
+A Room keeps every parsed image in memory for the whole run, because any op may
+have its parent in any other image, so the item_id -> unique_id index of the
+whole room is needed before the first correction can be applied. For rooms with
+many large images (e.g. multi-floor scans), that may not fit in memory.
+
+process_two_pass instead makes two passes over the image files:
+  1. Each image is parsed in turn, only to extract its part of the index, and
+     is then dropped
+  2. Each image is parsed again, corrected against the index of the whole room,
+     written out, and dropped
+
+so that at any time, only the index, the corrections and a single image are in
+memory. The price is parsing every image twice.
+
+The outputs are the same as those of Room.process_corrections followed by
+Room.save_images, in every save mode.
+"""
+import logging
+import os
+from pathlib import Path
+import typing
+from uuid import UUID
+
+from . import file_io, model
+from .metrics import Metrics
+
+
+def build_index(image_files: typing.Iterable[os.PathLike], metrics: Metrics) -> typing.Dict[str, typing.Any]:
+    """Pass one: build the item_id -> unique_id index of a room, one image at a time
+
+    Images are parsed with the (non-validating) lazy codec; they are validated,
+    if requested, in pass two.
+    """
+    index = {}
+    for image_file in image_files:
+        data = model.Room.read_image(image_file, metrics)
+        _, image_index = model.Room.parse_image(data, model.LazyImageFile, metrics)
+        index.update(image_index)
+    return index
+
+
+def process_two_pass(
+        image_files: typing.List[os.PathLike],
+        csv_file: "os.PathLike | model.CorrectionFile",
+        output_dir: os.PathLike,
+        engine: str = "batch",
+        save_mode: str = "model",
+        force: bool = False,
+        compression: str | None = None,
+        metrics: Metrics | None = None,
+        infer_parents: float | None = None,
+        check_dimensions: str | None = None,
+        dimension_tolerance: float = 0.5,
+        **room_options,
+    ) -> Metrics:
+    """Process a room in two passes, keeping at most one image in memory at a time
+
+    Parameters:
+        image_files (list[PathLike]): List of images file paths that comprise the room
+        csv_file (PathLike | CorrectionFile): The room's correction csv, or its parsed corrections
+        output_dir (PathLike): a directory to put the outputs in
+        engine (str, optional): which join engine to use (see model.Room.process_corrections)
+        save_mode (str, optional): how to write the output files (see model.Room.save_images)
+        force (bool, optional): if true, clobber output data files if they already exist
+        compression (str, optional): how to compress the output files (see model.Room.save_images)
+        metrics (Metrics, optional): where to record metrics; by default, a new Metrics object
+        infer_parents (float, optional):
+            if given, infer the missing parents from geometry, with this minimum
+            confidence (see model.Room.infer_parents). It only ever looks within an image
+        check_dimensions (str, optional):
+            "flag" or "reject" to check the dimensions of the corrections (see model.Room.check_dimensions)
+        dimension_tolerance (float, optional): relative tolerance of the dimension check
+        **room_options: Passed on to model.Room (e.g. codec, validate, cache)
+
+    Returns:
+        The metrics of the run
+    """
+    if engine in model.join.KEEP_ROWS_ENGINES:
+        # Such engines index the ops of every image of the room at once
+        raise ValueError(f"Engine '{engine}' does not support two-pass processing")
+
+    metrics = Metrics() if metrics is None else metrics
+    csv = csv_file if isinstance(csv_file, model.CorrectionFile) else model.CorrectionFile(
+        csv_file, metrics, keep_rows=check_dimensions is not None)
+    metrics.count("csv_rows", csv.num_rows)
+    if csv.num_images != len(image_files):
+        raise ValueError(f"Correction file ({csv_file}) processed a different number of images ({csv.num_images}) than comprise this Room ({len(image_files)})!")
+
+    index = build_index(image_files, metrics)
+    logging.info("Indexed %d ops_3d over %d images", len(index), len(image_files))
+    codec = room_options.get("codec") or ("pydantic" if room_options.get("validate") else "lazy")
+    if codec in model.codec.VALIDATING:
+        # Pass one's unique_ids are strings, but these codecs' parent_ids are UUIDs
+        index = {image_id: UUID(unique_id) for image_id, unique_id in index.items()}
+
+    link_format = model.links.LINK_MODES.get(save_mode)
+    if link_format is not None:
+        links_path = file_io.compressed_path(Path(output_dir) / model.links.FORMATS[link_format], compression)
+        if links_path.exists() and not force:
+            raise ValueError(f"Desired output filepath {links_path} already exists and force==False")
+        table = model.links.LinkTable([])
+
+    for image_file in image_files:
+        room = model.Room([image_file], metrics=metrics, **room_options)
+        room.image_id_to_unique_id = index
+        # Checked against the whole room above, rather than this one image
+        room.join_corrections(csv, engine)
+        if check_dimensions is not None:
+            room.check_dimensions(rel_tol=dimension_tolerance, reject=check_dimensions == "reject")
+        if infer_parents is not None:
+            room.infer_parents(min_confidence=infer_parents)
+        if link_format is None:
+            room.save_images(output_dir, force=force, mode=save_mode, compression=compression)
+        else:
+            with metrics.stage("serialize"):
+                table.extend(model.links.LinkTable.from_room(room))
+        # Before the next image is parsed
+        del room
+
+    if link_format is not None:
+        logging.info("Saving %s...", links_path)
+        with metrics.stage("write"):
+            model.links.write_links(links_path, table, link_format, compression)
+        metrics.count("parent_links_written", len(table))
+
+    return metrics
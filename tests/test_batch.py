@@ -0,0 +1,63 @@
+import os
+import shutil
+
+from hosta_homework import batch
+from hosta_homework.data import IMAGE_FILES, CSV_FILE
+
+
+def _make_room(directory, csv=True):
+    directory.mkdir(parents=True)
+    for image_file in IMAGE_FILES:
+        shutil.copy(image_file, directory)
+    if csv:
+        shutil.copy(CSV_FILE, directory)
+
+
+def test_find_rooms(tmp_path):
+    _make_room(tmp_path / "in" / "a")
+    _make_room(tmp_path / "in" / "floor_2" / "b")
+    _make_room(tmp_path / "in" / "not_a_room", csv=False)
+
+    jobs = batch.find_rooms(tmp_path / "in", tmp_path / "out")
+    assert [job.name for job in jobs] == ["a", "floor_2/b"]
+    assert jobs[1].output_dir == tmp_path / "out" / "floor_2" / "b"
+    assert len(jobs[0].image_files) == len(IMAGE_FILES)
+
+
+def test_run_batch_isolates_failures(tmp_path):
+    _make_room(tmp_path / "in" / "good")
+    _make_room(tmp_path / "in" / "bad")
+    # Corrupt one image of the bad room
+    (tmp_path / "in" / "bad" / IMAGE_FILES[0].name).write_text("{")
+
+    jobs = batch.find_rooms(tmp_path / "in", tmp_path / "out")
+    results = batch.run_batch(jobs, workers=2)
+
+    assert [(r.name, r.ok) for r in results] == [("bad", False), ("good", True)]
+    assert results[0].error
+    assert len(list((tmp_path / "out" / "good").glob("*.json"))) == len(IMAGE_FILES)
+
+
+def _process_or_die(job, **options):
+    if job.name == "doomed":
+        os._exit(1)
+    return _process_room(job, **options)
+
+
+_process_room = batch.process_room
+
+
+def test_run_batch_survives_dead_worker(tmp_path, monkeypatch):
+    for name in ("a", "b", "doomed", "c", "d"):
+        _make_room(tmp_path / "in" / name)
+    # Forked workers see the patched module, and unpickle the job function from it
+    monkeypatch.setattr(batch, "process_room", _process_or_die)
+
+    jobs = batch.find_rooms(tmp_path / "in", tmp_path / "out")
+    results = batch.run_batch(jobs, workers=2)
+
+    assert [(r.name, r.ok) for r in results] == [
+        ("a", True), ("b", True), ("c", True), ("d", True), ("doomed", False)]
+    assert "BrokenProcessPool" in results[-1].error
+    for name in ("a", "b", "c", "d"):
+        assert len(list((tmp_path / "out" / name).glob("*.json"))) == len(IMAGE_FILES)
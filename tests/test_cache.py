@@ -0,0 +1,52 @@
+import os
+import shutil
+
+import pytest
+
+from hosta_homework.cache import IndexCache
+from hosta_homework.data import IMAGE_FILES, CSV_FILE
+from hosta_homework.model import Room
+
+
+@pytest.mark.parametrize("key_mode", ["content", "stat"])
+def test_cache_skips_parsing(tmp_path, key_mode):
+    cache = IndexCache(tmp_path / "cache", key_mode=key_mode)
+
+    uncached = Room(IMAGE_FILES).process_corrections(CSV_FILE)
+    first = Room(IMAGE_FILES, cache=cache).process_corrections(CSV_FILE)
+    assert (cache.hits, cache.misses) == (0, len(IMAGE_FILES) + 1)
+
+    second = Room(IMAGE_FILES, cache=cache).process_corrections(CSV_FILE)
+    assert (cache.hits, cache.misses) == (len(IMAGE_FILES) + 1, len(IMAGE_FILES) + 1)
+
+    assert first.image_id_to_unique_id == second.image_id_to_unique_id == uncached.image_id_to_unique_id
+    assert first.join_result == second.join_result == uncached.join_result
+
+
+def test_cache_misses_changed_file(tmp_path):
+    cache = IndexCache(tmp_path / "cache")
+    image_file = tmp_path / IMAGE_FILES[0].name
+    shutil.copy(IMAGE_FILES[0], image_file)
+
+    Room([image_file], cache=cache)
+    image_file.write_text(image_file.read_text().replace('"item_id": 13,', '"item_id": 1300,'))
+    room = Room([image_file], cache=cache)
+
+    assert cache.misses == 2
+    assert "1300" in room.image_id_to_unique_id
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = IndexCache(tmp_path / "cache")
+    entries = []
+    for image_file in IMAGE_FILES:
+        cache.get_or_build(image_file, "bytes", image_file.read_bytes)
+        entries.append(cache.directory / f"{cache.key(image_file, 'bytes')}.pickle")
+
+    # Pretend the entries were last used in the order 1, 2, 0
+    for age, entry in zip([0, 2, 1], entries):
+        os.utime(entry, ns=(10**18 - age, 10**18 - age))
+
+    cache.max_bytes = entries[0].stat().st_size + entries[2].stat().st_size
+    cache.evict()
+    assert [entry.exists() for entry in entries] == [True, False, True]
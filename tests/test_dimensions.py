@@ -0,0 +1,98 @@
+import math
+
+import pytest
+
+from hosta_homework import synthetic, two_pass
+from hosta_homework.data import IMAGE_FILES, CSV_FILE
+from hosta_homework.model import CorrectionFile, Room, links
+from hosta_homework.model.dimensions import check_dimensions
+from hosta_homework.model.join import JoinOutcome
+
+
+def test_example_data_dimensions():
+    room = Room(IMAGE_FILES)
+    csv = CorrectionFile(CSV_FILE, keep_rows=True)
+    check = check_dimensions(room.images, csv)
+    assert sum(row >= 0 for row in check.rows) == 29
+    assert check.mismatches() == []
+
+    # Doors have no depth in either, which is not compared
+    ops = [op_3d for image in room.images for op_3d in image.ops_3d]
+    door = next(i for i, op_3d in enumerate(ops) if op_3d.supercategory == "door" and check.rows[i] >= 0)
+    assert check.deviations[door] == pytest.approx(abs(3.0 - 2.5) / 3.0)
+    # Ops without a correction are not compared at all
+    assert all(math.isnan(deviation) for deviation, row in zip(check.deviations, check.rows) if row < 0)
+
+    tight = check_dimensions(room.images, csv, rel_tol=0.25)
+    assert tight.mismatches() and all(check.deviations[i] > 0.25 for i in tight.mismatches())
+    assert check_dimensions(room.images, csv, rel_tol=0.25, abs_tol=10).mismatches() == []
+
+
+def test_check_requires_rows():
+    with pytest.raises(ValueError, match="keep_rows"):
+        check_dimensions(Room(IMAGE_FILES).images, CorrectionFile(CSV_FILE))
+    with pytest.raises(ValueError, match="keep_rows"):
+        Room(IMAGE_FILES).process_corrections(CSV_FILE).check_dimensions()
+
+
+@pytest.fixture
+def bad_room(tmp_path):
+    """A synthetic room, and its corrections with the dimensions of one joined op's row tripled"""
+    image_files, csv_file = synthetic.generate_room(tmp_path / "input", ops_per_image=100, seed=3)
+    csv = CorrectionFile(csv_file, keep_rows=True)
+    room = Room(image_files).process_corrections(csv)
+    ops = [op_3d for image in room.images for op_3d in image.ops_3d]
+    # Exact up to the CSV's rounding
+    assert check_dimensions(room.images, csv, rel_tol=0.01, abs_tol=0.01).mismatches() == []
+
+    bad = next(i for i, outcome in enumerate(room.join_result.outcomes) if outcome == JoinOutcome.SUCCESS)
+    row = csv.corrections_by_id[str(ops[bad].item_id)].index
+    csv.dimensions["width"][row] *= 3
+    return image_files, csv, room, bad
+
+
+def test_flag(bad_room):
+    _, _, room, bad = bad_room
+    parent_ids = list(room.join_result.parent_ids)
+    room.check_dimensions()
+    assert bad in room.dimension_check.mismatches()
+    assert room.metrics.counters["dimension_mismatches"] == len(room.dimension_check.mismatches())
+    assert room.join_result.parent_ids == parent_ids
+
+
+def test_reject(bad_room):
+    _, _, room, bad = bad_room
+    ops = [op_3d for image in room.images for op_3d in image.ops_3d]
+    hierarchy = room.hierarchy
+    joined = len(links.LinkTable.from_room(room))
+
+    room.check_dimensions(reject=True)
+    rejected = [i for i, outcome in enumerate(room.join_result.outcomes) if outcome == JoinOutcome.REJECTED]
+    assert bad in rejected and room.metrics.join_outcomes["rejected"] == len(rejected)
+    assert ops[bad].parent_id is None and room.join_result.parent_ids[bad] is None
+    assert hierarchy.parent_of(ops[bad].unique_id) is None
+    assert len(links.LinkTable.from_room(room)) == joined - len(rejected)
+
+
+def test_two_pass_rejects_the_same(bad_room, tmp_path):
+    image_files, csv, room, _ = bad_room
+    (tmp_path / "room").mkdir()
+    (tmp_path / "two_pass").mkdir()
+    room.check_dimensions(reject=True).save_images(tmp_path / "room")
+    two_pass.process_two_pass(image_files, csv, tmp_path / "two_pass", check_dimensions="reject")
+    for output in (tmp_path / "room").iterdir():
+        assert (tmp_path / "two_pass" / output.name).read_bytes() == output.read_bytes()
+
+
+def test_invalid_dimensions_are_reported(tmp_path):
+    lines = CSV_FILE.read_text(encoding="utf-16").splitlines()
+    # The correction of item 27
+    lines[1] = lines[1].replace('"1.50 ft"', '"1.50 furlongs"')
+    csv_file = tmp_path / CSV_FILE.name
+    csv_file.write_text("\n".join(lines), encoding="utf-16")
+
+    room = Room(IMAGE_FILES).process_corrections(CorrectionFile(csv_file, keep_rows=True)).check_dimensions()
+    ops = [op_3d for image in room.images for op_3d in image.ops_3d]
+    assert [ops[i].item_id for i in room.dimension_check.invalids()] == [27]
+    assert room.dimension_check.mismatches() == []
+    assert room.metrics.counters["dimension_invalid"] == 1
@@ -0,0 +1,188 @@
+"""Differential tests of every fast path against the reference pipeline
+
+The reference is Room with the pydantic codec, the reference engine and the
+"model" save mode, i.e. ImageFile.Op3D.process_correction one op at a time.
+Every other codec, engine, save mode and pipeline must make exactly the same
+parent_id assignments, and write outputs that mean the same:
+  - validating codecs write byte-identical outputs
+  - pass-through paths (the lazy codecs, splicing, link tables) write the input
+    back, with only the parent_ids changed
+The identity engine is the exception: it resolves strictly more ops (see
+hosta_homework.model.identity), so it must only agree wherever the reference
+resolved a parent.
+
+Rooms are random: each case draws its synthetic.generate_room parameters (so,
+how many duplicate rows, "0"/"" image IDs, missing hosts, stale IDs and objects
+seen in several images) from its seed, then perturbs the image files with
+quirks that the generator does not make. Set HOSTA_EQUIVALENCE_CASES to run
+more cases than the default.
+"""
+import json
+import os
+import random
+import uuid
+
+import pytest
+
+from hosta_homework import manifest, synthetic, two_pass
+from hosta_homework.cache import IndexCache
+from hosta_homework.model import ImageFile, Room, codec, links
+from hosta_homework.model.join import ENGINES, JoinOutcome
+
+
+CASES = int(os.environ.get("HOSTA_EQUIVALENCE_CASES", 6))
+
+# e.g. pydantic's, when a field is given a value of the wrong type
+pytestmark = pytest.mark.filterwarnings("error::UserWarning")
+
+
+def _room_parameters(seed: int):
+    rng = random.Random(seed)
+    return {
+        "num_images": rng.randint(1, 5),
+        "ops_per_image": rng.randint(5, 80),
+        "csv_rows": rng.choice([0, 0, 300]),
+        "seed": seed,
+        "shared_fraction": rng.uniform(0, 0.6),
+        "unlisted_fraction": rng.uniform(0, 0.4),
+        "missing_host_fraction": rng.uniform(0, 0.4),
+        "duplicate_fraction": rng.uniform(0, 0.5),
+        "stale_id_fraction": rng.uniform(0, 0.3),
+    }
+
+
+def _perturb(image_file, rng: random.Random):
+    """Add quirks to the ops of an image file: existing parent_ids, unmodelled fields, ints for floats..."""
+    image = json.loads(image_file.read_text())
+    for op_3d in image["ops_3d"]:
+        quirk = rng.random()
+        if quirk < 0.05:
+            op_3d["parent_id"] = None
+        elif quirk < 0.1:
+            op_3d["parent_id"] = str(uuid.UUID(int=rng.getrandbits(128)))
+        elif quirk < 0.15:
+            op_3d["trimLength"] = rng.choice([None, 1.5, "12 ft"])
+        elif quirk < 0.2 and float(op_3d["width"]).is_integer():
+            op_3d["width"] = int(op_3d["width"])
+        elif quirk < 0.22:
+            del op_3d["item_id"]
+    image_file.write_text(json.dumps(image, indent=rng.choice([None, 2, 4])))
+
+
+class Case:
+    """A random room, and what the reference pipeline made of it"""
+
+    def __init__(self, seed: int, directory):
+        self.seed = seed
+        self.parameters = _room_parameters(seed)
+        self.image_files, self.csv_file = synthetic.generate_room(directory / "input", **self.parameters)
+        rng = random.Random(seed)
+        for image_file in self.image_files:
+            _perturb(image_file, rng)
+
+        (directory / "reference").mkdir()
+        room = Room(self.image_files, codec="pydantic").process_corrections(self.csv_file, engine="reference")
+        room.save_images(directory / "reference")
+        self.outcomes = list(room.join_result.outcomes)
+        self.parent_ids = _parent_ids(room)
+        self.outputs = {path.name: path.read_bytes() for path in (directory / "reference").iterdir()}
+        self.inputs = {
+            Room.output_path("", image).name: path.read_bytes() for image, path in zip(room.images, self.image_files)}
+
+    def __repr__(self):
+        return f"Case(seed={self.seed}, {self.parameters})"
+
+
+def _parent_ids(room):
+    return [None if op_3d.parent_id is None else str(op_3d.parent_id) for image in room.images for op_3d in image.ops_3d]
+
+
+def _model_view(data: bytes):
+    """What ImageFile makes of a json output"""
+    return ImageFile.model_validate_json(data).model_dump(mode="json", exclude_unset=True)
+
+
+def _without_parent_ids(data: bytes):
+    image = json.loads(data)
+    for op_3d in image["ops_3d"]:
+        op_3d.pop("parent_id", None)
+    return image
+
+
+def assert_equivalent_outputs(case: Case, outputs, passes_through: bool):
+    """Check outputs (file name -> bytes) against the reference's
+
+    Parameters:
+        passes_through (bool): Whether outputs are the inputs with new parent_ids, rather than re-serialized
+    """
+    assert sorted(outputs) == sorted(case.outputs), case
+    for name, data in outputs.items():
+        if passes_through:
+            # The same data as the reference, and apart from parent_ids, the same as the input
+            assert _model_view(data) == _model_view(case.outputs[name]), (case, name)
+            assert _without_parent_ids(data) == _without_parent_ids(case.inputs[name]), (case, name)
+        else:
+            assert data == case.outputs[name], (case, name)
+
+
+@pytest.fixture(scope="module", params=range(CASES), ids=lambda seed: f"seed{seed}")
+def case(request, tmp_path_factory):
+    return Case(request.param, tmp_path_factory.mktemp(f"case{request.param}"))
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("codec_name", codec.CODECS)
+def test_engines_and_codecs(case, codec_name, engine, tmp_path):
+    if not codec.is_available(codec_name):
+        pytest.skip(f"the {codec_name} codec is not available")
+    room = Room(case.image_files, codec=codec_name).process_corrections(case.csv_file, engine=engine)
+    parent_ids = _parent_ids(room)
+
+    if engine == "identity":
+        for i, (parent_id, outcome) in enumerate(zip(case.parent_ids, case.outcomes)):
+            if outcome == JoinOutcome.SUCCESS:
+                assert parent_ids[i] == parent_id, (case, i)
+        return
+
+    assert parent_ids == case.parent_ids, case
+    assert list(room.join_result.outcomes) == case.outcomes, case
+    room.save_images(tmp_path)
+    outputs = {path.name: path.read_bytes() for path in tmp_path.iterdir()}
+    assert_equivalent_outputs(case, outputs, passes_through=codec_name not in codec.VALIDATING)
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+@pytest.mark.parametrize("save_mode", ["model", "splice", *links.LINK_MODES])
+def test_writers(case, save_mode, compression, tmp_path):
+    from hosta_homework import file_io
+
+    Room(case.image_files).process_corrections(case.csv_file).save_images(
+        tmp_path, mode=save_mode, compression=compression)
+
+    if save_mode in links.LINK_MODES:
+        table = links.read_links(
+            file_io.compressed_path(tmp_path / links.FORMATS[links.LINK_MODES[save_mode]], compression))
+        outputs = {name: table.patch(data) for name, data in case.inputs.items()}
+    else:
+        outputs = {
+            path.name.removesuffix(".gz"): file_io.read_bytes(path) for path in tmp_path.iterdir()}
+    assert_equivalent_outputs(case, outputs, passes_through=True)
+
+
+@pytest.mark.parametrize("pipeline", ["two_pass", "incremental", "cache"])
+def test_pipelines(case, pipeline, tmp_path):
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    if pipeline == "two_pass":
+        two_pass.process_two_pass(case.image_files, case.csv_file, output_dir, codec="pydantic")
+    elif pipeline == "incremental":
+        manifest.process_incremental(case.image_files, case.csv_file, output_dir, codec="pydantic")
+    else:
+        cache = IndexCache(tmp_path / "cache")
+        for _ in range(2):
+            room = Room(case.image_files, codec="pydantic", cache=cache).process_corrections(case.csv_file)
+        assert cache.hits
+        room.save_images(output_dir)
+
+    outputs = {path.name: path.read_bytes() for path in output_dir.iterdir() if path.name != manifest.MANIFEST_NAME}
+    assert_equivalent_outputs(case, outputs, passes_through=False)
@@ -0,0 +1,62 @@
+import gzip
+import json
+import os
+import stat
+
+import pytest
+
+from hosta_homework import file_io
+from hosta_homework.model import Room
+from hosta_homework.data import IMAGE_FILES, CSV_FILE
+
+
+def test_prefetch_keeps_order():
+    for workers in (1, 3):
+        assert list(file_io.prefetch(lambda x: x * x, range(20), workers)) == [x * x for x in range(20)]
+
+
+def test_atomic_write_failure_keeps_old_file(tmp_path):
+    path = tmp_path / "out.json"
+    path.write_text("old")
+
+    def chunks():
+        yield b"new"
+        raise RuntimeError("crash")
+
+    with pytest.raises(RuntimeError):
+        file_io.atomic_write(path, chunks())
+
+    assert path.read_text() == "old"
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_atomic_write_syncs_before_rename(tmp_path, monkeypatch):
+    calls = []
+    fsync, replace = os.fsync, os.replace
+    monkeypatch.setattr(os, "fsync", lambda fd: calls.append(("fsync", stat.S_ISDIR(os.fstat(fd).st_mode))) or fsync(fd))
+    monkeypatch.setattr(os, "replace", lambda *paths: calls.append(("replace",)) or replace(*paths))
+    file_io.atomic_write(tmp_path / "out.json", "new", compression="gzip")
+    # The file, then the directory once the file is renamed into it
+    assert calls[:2] == [("fsync", False), ("replace",)]
+    assert calls[2:] in ([], [("fsync", True)])
+    assert gzip.decompress((tmp_path / "out.json").read_bytes()) == b"new"
+
+@pytest.mark.parametrize("mode", ["model", "splice"])
+def test_save_images_compressed(tmp_path, mode):
+    room = Room(IMAGE_FILES, io_workers=3).process_corrections(CSV_FILE)
+    (tmp_path / "plain").mkdir()
+    room.save_images(tmp_path / "plain", mode=mode)
+    room.save_images(tmp_path, mode=mode, compression="gzip")
+
+    for image in room.images:
+        path = room.output_path(tmp_path, image, "gzip")
+        assert path.name.endswith(".json.gz")
+        with gzip.open(path) as f:
+            assert f.read() == room.output_path(tmp_path / "plain", image).read_bytes()
+
+
+def test_save_images_zstd(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    room = Room(IMAGE_FILES).process_corrections(CSV_FILE).save_images(tmp_path, compression="zstd")
+    with open(room.output_path(tmp_path, room.images[0], "zstd"), "rb") as f:
+        assert json.load(zstandard.ZstdDecompressor().stream_reader(f))["ops_3d"]
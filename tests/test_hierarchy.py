@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+import pytest
+
+from hosta_homework.data import IMAGE_FILES, CSV_FILE
+from hosta_homework.model import Room
+from hosta_homework.model.hierarchy import Hierarchy
+
+
+def _op(unique_id, parent_id=None, supercategory="door"):
+    return SimpleNamespace(unique_id=unique_id, parent_id=parent_id, supercategory=supercategory)
+
+
+def _hierarchy(*ops):
+    hierarchy = Hierarchy()
+    for op_3d in ops:
+        hierarchy.add(op_3d)
+    return hierarchy
+
+
+@pytest.mark.parametrize("codec", ["pydantic", "lazy"])
+def test_room_hierarchy_is_updated_incrementally(codec):
+    """The hierarchy must always match one built from scratch, whenever it was first built"""
+    room = Room(IMAGE_FILES, codec=codec)
+    hierarchy = room.hierarchy
+    assert len(hierarchy) and not hierarchy.children_of(hierarchy.of_supercategory("interior_wall")[0])
+
+    room.process_corrections(CSV_FILE)
+    fresh = Hierarchy.from_room(room)
+    assert room.hierarchy is hierarchy
+    for key in fresh.supercategories:
+        assert hierarchy.parent_of(key) == fresh.parent_of(key)
+        assert hierarchy.children_of(key) == fresh.children_of(key)
+
+    parents = {hierarchy.parent_of(op.unique_id) for image in room.images for op in image.ops_3d} - {None}
+    assert {hierarchy.supercategories[parent] for parent in parents} == {"interior_wall"}
+    assert hierarchy.orphans() == [] and hierarchy.cycles() == []
+
+    room.reset_corrections()
+    assert all(hierarchy.parent_of(key) is None for key in fresh.supercategories)
+
+
+def test_hierarchy_queries():
+    hierarchy = _hierarchy(
+        _op("wall", supercategory="interior_wall"),
+        _op("door", "wall"),
+        _op("window", "wall", supercategory="window"),
+        _op("handle", "door", supercategory="hardware"),
+    )
+    assert hierarchy.parent_of("handle") == "door"
+    assert hierarchy.children_of("wall") == ["door", "window"]
+    assert hierarchy.ancestors("handle") == ["door", "wall"]
+    assert hierarchy.subtree("wall") == ["wall", "door", "handle", "window"]
+    assert hierarchy.of_supercategory("door") == ["door"]
+    assert hierarchy.roots() == ["wall"]
+
+
+def test_hierarchy_last_sighting_with_a_parent_wins():
+    first, second, third = _op("door", "wall_a"), _op("door", "wall_b"), _op("door")
+    hierarchy = _hierarchy(first, second, third)
+    assert hierarchy.parent_of("door") == "wall_b"
+
+    second.parent_id = None
+    hierarchy.refresh("door")
+    assert hierarchy.parent_of("door") == "wall_a"
+    assert hierarchy.children_of("wall_b") == []
+
+
+def test_hierarchy_orphans_and_cycles():
+    hierarchy = _hierarchy(_op("a", "b"), _op("b", "c"), _op("c", "a"), _op("d", "d"), _op("e", "a"), _op("f", "gone"))
+    assert hierarchy.orphans() == ["f"]
+    assert sorted(map(sorted, hierarchy.cycles())) == [["a", "b", "c"], ["d"]]
+    assert hierarchy.ancestors("e") == ["a", "b", "c"]
+    assert sorted(hierarchy.subtree("a")) == ["a", "b", "c", "e"]
@@ -0,0 +1,94 @@
+from types import SimpleNamespace
+
+import pytest
+
+from hosta_homework import synthetic
+from hosta_homework.data import IMAGE_FILES, CSV_FILE
+from hosta_homework.model import CorrectionFile, Room
+from hosta_homework.model.join import JoinOutcome
+from hosta_homework.model.identity import IdentityIndex, UnionFind, item_key, object_key
+from hosta_homework.two_pass import process_two_pass
+
+
+def test_union_find():
+    classes = UnionFind()
+    for a, b in [(1, 2), (3, 4), (2, 4), (5, 5)]:
+        classes.union(a, b)
+    classes.add(6)
+    assert classes.find(1) == classes.find(3) != classes.find(5)
+    assert sorted(map(sorted, classes.classes().values())) == [[1, 2, 3, 4], [5], [6]]
+    assert 6 in classes and 7 not in classes
+
+
+def test_identity_index_merges_every_alias():
+    room = Room(IMAGE_FILES)
+    index = IdentityIndex.build(room.images, CorrectionFile(CSV_FILE, keep_rows=True))
+
+    # Item 13 of the first image is listed as 49 and 3 in the others
+    assert index.same_object(item_key(13), item_key(49))
+    assert index.same_object(item_key(13), item_key(3))
+    assert not index.same_object(item_key(13), item_key(14))
+    ops = {str(op_3d.item_id): op_3d for image in room.images for op_3d in image.ops_3d}
+    assert set(index.unique_ids(item_key(3))) == {ops[item].unique_id for item in ("13", "49", "3")}
+    assert index.unique_ids(item_key("not an item")) == []
+    assert index.correction(object_key("not an object")) is None
+
+
+def test_identity_index_follows_csv_aliases():
+    """An op whose item_id is only listed in another column of its object's row still gets its correction"""
+    ops = [
+        SimpleNamespace(item_id=1, imageIds=["1"], unique_id="wall"),
+        SimpleNamespace(item_id=2, imageIds=["2", "20"], unique_id="door"),
+    ]
+    csv = SimpleNamespace(
+        keep_rows=True,
+        ids=["", "100", "200", "1", "20", "98", "99"],
+        object_ids=[1, 2],
+        image_object_ids={"Image1_Object_ID": [3, 4], "Image2_Object_ID": [5, 6]},
+        object_id_to_image_id={"100": "98", "200": "99"},
+        corrections_by_id={"20": "correction of the door"},
+    )
+    index = IdentityIndex.build([SimpleNamespace(ops_3d=ops)], csv)
+    assert index.correction(item_key(2)) == "correction of the door"
+    assert index.unique_ids(object_key("100")) == ["wall"]
+
+
+def test_identity_index_skips_ops_without_item_id():
+    """Ops without an item_id are not merged into one object (and so across their imageIds)"""
+    ops = [
+        SimpleNamespace(item_id=None, imageIds=["1"], unique_id="wall"),
+        SimpleNamespace(item_id=None, imageIds=["2"], unique_id="door"),
+        SimpleNamespace(item_id=3, imageIds=["3"], unique_id="window"),
+        SimpleNamespace(item_id=4, imageIds=["3"], unique_id="window"),
+    ]
+    csv = SimpleNamespace(keep_rows=False, object_id_to_image_id={}, corrections_by_id={})
+    index = IdentityIndex.build([SimpleNamespace(ops_3d=ops)], csv)
+    assert not index.same_object(item_key(1), item_key(2))
+    assert index.unique_ids(item_key(None)) == [] and index.unique_ids(item_key(1)) == []
+    assert index.unique_ids(item_key(4)) == ["window"]
+
+
+@pytest.mark.parametrize("keep_rows", [False, True])
+def test_identity_engine_only_adds_links(tmp_path, keep_rows):
+    image_files, csv_file = synthetic.generate_room(
+        tmp_path, ops_per_image=200, seed=1, shared_fraction=0.5, stale_id_fraction=0.3)
+    csv = CorrectionFile(csv_file, keep_rows=keep_rows)
+    batch = Room(image_files).process_corrections(csv, engine="batch").join_result
+    identity = Room(image_files).process_corrections(csv, engine="identity").join_result
+
+    for outcome, parent_id, batch_outcome, batch_parent_id in zip(
+            identity.outcomes, identity.parent_ids, batch.outcomes, batch.parent_ids):
+        if batch_outcome == JoinOutcome.SUCCESS:
+            assert (outcome, parent_id) == (batch_outcome, batch_parent_id)
+    assert identity.counts()[JoinOutcome.SUCCESS] > batch.counts()[JoinOutcome.SUCCESS]
+
+
+def test_identity_engine_on_example_data():
+    batch = Room(IMAGE_FILES).process_corrections(CSV_FILE, engine="batch").join_result
+    identity = Room(IMAGE_FILES).process_corrections(CSV_FILE, engine="identity").join_result
+    assert identity.parent_ids == batch.parent_ids
+
+
+def test_identity_engine_rejects_two_pass(tmp_path):
+    with pytest.raises(ValueError, match="two-pass"):
+        process_two_pass(IMAGE_FILES, CSV_FILE, tmp_path, engine="identity")
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from hosta_homework.data import IMAGE_FILES, CSV_FILE
+from hosta_homework.model import Room, links
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+@pytest.mark.parametrize("mode", ["links", "jsonpatch"])
+def test_link_table_reproduces_model_output(tmp_path, mode, compression):
+    """Applying the sidecar links to the originals must give the same documents as saving whole images"""
+    room = Room(IMAGE_FILES).process_corrections(CSV_FILE)
+    (tmp_path / "model").mkdir()
+    room.save_images(tmp_path / "model")
+    room.save_images(tmp_path, mode=mode, compression=compression)
+
+    [links_file] = [path for path in tmp_path.iterdir() if path.is_file()]
+    table = links.read_links(links_file)
+    assert len(table) == room.join_result.counts()[0] == 19
+
+    for image_file in IMAGE_FILES:
+        source = image_file.read_bytes()
+        expected = json.loads((tmp_path / "model" / image_file.name).read_bytes())
+        assert table.apply(json.loads(source)) == expected
+        assert json.loads(table.patch(source)) == expected
+
+
+def test_link_table_formats_agree():
+    room = Room(IMAGE_FILES).process_corrections(CSV_FILE)
+    table = links.LinkTable.from_room(room)
+    for decoded in (links.LinkTable.from_bytes(table.to_bytes()), links.LinkTable.from_json_patch(table.to_json_patch())):
+        for file_name in table.file_names:
+            assert decoded.links(file_name) == table.links(file_name)
+
+
+def test_link_table_checks_unique_ids():
+    room = Room(IMAGE_FILES).process_corrections(CSV_FILE)
+    table = links.LinkTable.from_room(room)
+    image = json.loads(IMAGE_FILES[0].read_bytes())
+    assert table.links(image["image_info"]["file_name"])
+    for op_3d in image["ops_3d"]:
+        op_3d["unique_id"] = "00000000-0000-0000-0000-000000000000"
+    with pytest.raises(ValueError):
+        table.apply(image)
+
+
+def test_link_table_requires_processing():
+    with pytest.raises(ValueError):
+        links.LinkTable.from_room(Room(IMAGE_FILES))
+
+
+def test_link_table_index_follows_appends():
+    table = links.LinkTable(["a.jpeg", "b.jpeg"], [1, 0, 1], [5, 2, 7], *(["u1", "u2", "u3"] for _ in range(5)))
+    assert [link.op_index for link in table.links("b.jpeg")] == [5, 7]
+    assert table.links("c.jpeg") == []
+
+    table.extend(links.LinkTable(["c.jpeg", "a.jpeg"], [0, 1], [3, 4], *(["u4", "u5"] for _ in range(5))))
+    assert [link.op_index for link in table.links("c.jpeg")] == [3]
+    # A repeated file name is the first image of that name
+    assert [link.op_index for link in table.links("a.jpeg")] == [2]
+    table.image_indexes.append(1)
+    table.op_indexes.append(9)
+    for name in links.LinkTable._STRING_COLUMNS:
+        getattr(table, name).append("u6")
+    assert [link.op_index for link in table.links("b.jpeg")] == [5, 7, 9]
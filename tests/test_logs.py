@@ -0,0 +1,119 @@
+import io
+import json
+import logging
+import shutil
+import subprocess
+import sys
+
+from hosta_homework import logs
+from hosta_homework.data import IMAGE_FILES, CSV_FILE
+from hosta_homework.model import Room
+from hosta_homework.model.join import JoinOutcome
+
+
+def test_json_lines_have_the_join_outcome():
+    stream = io.StringIO()
+    with logs.logging_session(json_lines=True, stream=stream):
+        room = Room(IMAGE_FILES).process_corrections(CSV_FILE, engine="reference")
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    outcomes = [line["outcome"] for line in lines if "outcome" in line]
+    assert len(outcomes) == len(room.join_result.outcomes)
+    assert outcomes == [JoinOutcome(outcome).name.lower() for outcome in room.join_result.outcomes]
+    success = next(line for line in lines if line.get("outcome") == "success")
+    assert success["level"] == "INFO" and success["item_id"] in success["message"]
+    assert success["parent_id"] in success["message"]
+
+
+def test_aggregation():
+    stream = io.StringIO()
+    with logs.logging_session(samples=2, stream=stream):
+        for i in range(10):
+            logging.info("Repeated %d", i, extra={"outcome": "success"})
+        logging.warning("Once")
+    assert stream.getvalue().splitlines() == [
+        "INFO:root:Repeated 0",
+        "INFO:root:Repeated 1",
+        "WARNING:root:Once",
+        "INFO:root:Suppressed 8 more (of 10) records like: Repeated %d",
+    ]
+
+
+def test_aggregation_keeps_progress_and_errors():
+    stream = io.StringIO()
+    with logs.logging_session(samples=1, stream=stream):
+        for i in range(3):
+            logging.info("[%d/3] Processed room", i + 1)
+            logging.error("Failed %d", i, extra={"outcome": "failure"})
+    assert len(stream.getvalue().splitlines()) == 6
+    assert "Suppressed" not in stream.getvalue()
+
+
+def test_rate_limit():
+    aggregator = logs.AggregatingFilter(samples=1, rate_limit=3)
+    records = [
+        logging.makeLogRecord({"msg": "Repeated %d", "args": (i,), "levelno": logging.INFO, "outcome": "success"})
+        for i in range(10)]
+    # The sample, then a second's worth
+    assert [aggregator.filter(record) for record in records].count(True) == 4
+    ((record, logged, suppressed),) = aggregator.summary()
+    assert (record.args, logged, suppressed) == ((0,), 4, 6)
+
+
+def test_reference_join_aggregated():
+    stream = io.StringIO()
+    with logs.logging_session(samples=3, stream=stream):
+        Room(IMAGE_FILES).process_corrections(CSV_FILE, engine="reference")
+    output = stream.getvalue()
+    assert output.count("INFO:root:Successfully updated Op3D record") == 3
+    assert "Suppressed 16 more (of 19) records like: Successfully updated Op3D record:\n" in output
+
+
+def test_background_keeps_every_record_in_order():
+    stream = io.StringIO()
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    with logs.logging_session(background=True, stream=stream) as session:
+        assert session.listener is not None
+        for i in range(1000):
+            logging.info("Record %d", i)
+    assert stream.getvalue().splitlines() == [f"INFO:root:Record {i}" for i in range(1000)]
+    # The previous set-up is back
+    assert root.handlers == handlers and logs.worker_config() is None
+
+
+def test_repeated_sessions_register_one_exit_hook(monkeypatch):
+    registered = []
+    monkeypatch.setattr(logs.atexit, "register", registered.append)
+    monkeypatch.setattr(logs, "_atexit_registered", False)
+    srcfile = logging._srcfile
+    for _ in range(3):
+        with logs.logging_session(background=True, stream=io.StringIO()):
+            assert logging._srcfile is srcfile and not logging.logThreads
+    assert registered == [logs._close_session]
+    assert logging.logThreads
+
+def test_worker_config():
+    with logs.logging_session(json_lines=True, samples=1, stream=io.StringIO()):
+        assert logs.worker_config() == logs.LoggingConfig(logging.INFO, True, False, 1, None)
+    assert logs.worker_config() is None
+
+
+def test_cli_batch_logs_json_lines(tmp_path):
+    (tmp_path / "rooms" / "room").mkdir(parents=True)
+    for path in [*IMAGE_FILES, CSV_FILE]:
+        shutil.copy(path, tmp_path / "rooms" / "room")
+    result = subprocess.run([
+        sys.executable, "-m", "hosta_homework",
+        "--batch-root", str(tmp_path / "rooms"),
+        "--output-dir", str(tmp_path / "out"),
+        "--workers", "1",
+        "--engine", "reference",
+        "--log-format", "json",
+        "--log-background",
+        "--log-aggregate", "2",
+    ], capture_output=True, text=True, check=True)
+    lines = [json.loads(line) for line in result.stderr.splitlines()]
+    # Including the worker's, with its summary
+    assert [line["outcome"] for line in lines if line.get("outcome") == "success"] == ["success"] * 2
+    assert any(line.get("suppressed") and "Successfully updated" in line["message"] for line in lines)
@@ -0,0 +1,16 @@
+import subprocess
+import sys
+
+from hosta_homework.model.correction_file import CorrectionEntry
+
+
+def test_cli_help_does_not_import_pydantic():
+    """The CLI's fixed start-up cost must not include pydantic, unless a room is processed"""
+    code = "import sys, hosta_homework.__main__; print('pydantic' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "False"
+
+
+def test_correction_entry_models_are_memoized():
+    assert CorrectionEntry.with_images(3) is CorrectionEntry.with_images(3)
+    assert CorrectionEntry.with_images(3) is not CorrectionEntry.with_images(4)
@@ -0,0 +1,66 @@
+import shutil
+
+from hosta_homework import manifest
+from hosta_homework.data import IMAGE_FILES, CSV_FILE
+
+
+def _copy_room(tmp_path):
+    room_dir = tmp_path / "room"
+    room_dir.mkdir()
+    for f in [*IMAGE_FILES, CSV_FILE]:
+        shutil.copy(f, room_dir)
+    return [room_dir / f.name for f in IMAGE_FILES], room_dir / CSV_FILE.name
+
+
+def test_incremental_skips_unchanged(tmp_path):
+    image_files, csv_file = _copy_room(tmp_path)
+    out = tmp_path / "out"
+    out.mkdir()
+
+    assert len(manifest.process_incremental(image_files, csv_file, out)) == len(IMAGE_FILES)
+    assert (out / manifest.MANIFEST_NAME).exists()
+    assert manifest.process_incremental(image_files, csv_file, out) == []
+
+    # A deleted output is rewritten
+    (out / IMAGE_FILES[1].name).unlink()
+    assert manifest.process_incremental(image_files, csv_file, out) == [out / IMAGE_FILES[1].name]
+
+
+def test_incremental_rewrites_only_affected_images(tmp_path):
+    image_files, csv_file = _copy_room(tmp_path)
+    out = tmp_path / "out"
+    out.mkdir()
+    manifest.process_incremental(image_files, csv_file, out)
+
+    # Unchanged parent links: the CSV is rewritten, but with the same content
+    csv_file.write_bytes(csv_file.read_bytes() + "\r\n".encode("utf-16-le"))
+    assert manifest.process_incremental(image_files, csv_file, out) == []
+
+    # Re-host item 27 (only in the first image) onto the wall with image object id 3
+    csv = csv_file.read_text(encoding="utf-16")
+    csv = csv.replace('"1869523"\t"1309015"', '"1869523"\t"1308969"')
+    csv_file.write_text(csv, encoding="utf-16")
+    assert manifest.process_incremental(image_files, csv_file, out) == [out / IMAGE_FILES[0].name]
+
+
+def test_incremental_rewrites_on_new_options(tmp_path):
+    image_files, csv_file = _copy_room(tmp_path)
+    out = tmp_path / "out"
+    out.mkdir()
+    manifest.process_incremental(image_files, csv_file, out)
+
+    all_outputs = sorted(out / f.name for f in IMAGE_FILES)
+    for options in ({"engine": "identity"}, {"engine": "identity", "codec": "pydantic"}, {"save_mode": "splice"}):
+        assert sorted(manifest.process_incremental(image_files, csv_file, out, **options)) == all_outputs
+        assert manifest.process_incremental(image_files, csv_file, out, **options) == []
+
+
+def test_incremental_from_another_directory(tmp_path, monkeypatch):
+    image_files, csv_file = _copy_room(tmp_path)
+    out = tmp_path / "out"
+    out.mkdir()
+    manifest.process_incremental(image_files, csv_file, out)
+
+    monkeypatch.chdir(tmp_path / "room")
+    relative = [image_file.relative_to(tmp_path / "room") for image_file in image_files]
+    assert manifest.process_incremental(relative, csv_file.name, out) == []
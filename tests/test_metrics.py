@@ -0,0 +1,42 @@
+import json
+import pickle
+
+from hosta_homework.metrics import Metrics, STAGES
+from hosta_homework.model import Room
+from hosta_homework.data import IMAGE_FILES, CSV_FILE
+
+
+def test_room_metrics(tmp_path):
+    metrics = Metrics(trace_memory=True)
+    Room(IMAGE_FILES, metrics=metrics).process_corrections(CSV_FILE).save_images(tmp_path)
+
+    for name in STAGES:
+        assert metrics.stages[name].calls > 0
+        assert metrics.stages[name].peak_bytes > 0
+    assert metrics.join_outcomes["success"] == 19
+    assert sum(metrics.join_outcomes.values()) == metrics.counters["ops_3d"]
+    assert metrics.counters["parent_links_written"] == sum(
+        "parent_id" in op for f in tmp_path.glob("*.json") for op in json.loads(f.read_text())["ops_3d"])
+
+    report = json.loads(metrics.to_json())
+    assert report["join_outcomes"] == metrics.join_outcomes
+
+    prometheus = metrics.to_prometheus()
+    assert 'hosta_join_outcomes_total{outcome="success"} 19' in prometheus
+    assert 'hosta_stage_seconds{stage="join"}' in prometheus
+
+
+def test_nested_stages_and_merge():
+    metrics = Metrics(trace_memory=True)
+    with metrics.stage("join"):
+        with metrics.stage("index"):
+            data = bytearray(1 << 20)
+        del data
+
+    # The outer stage's peak includes the inner's
+    assert metrics.stages["join"].peak_bytes >= metrics.stages["index"].peak_bytes >= 1 << 20
+
+    total = Metrics()
+    total.merge(metrics)
+    total.merge(pickle.loads(pickle.dumps(metrics)))
+    assert total.stages["join"].calls == 2
@@ -1,9 +1,15 @@
+import gzip
 import json
+import math
+from pathlib import Path
 
 import pytest
 
+from hosta_homework.metrics import Metrics
 from hosta_homework.data import IMAGE_FILES, CSV_FILE
-from hosta_homework.model import CorrectionFile, ImageFile, Room
+from hosta_homework import model
+from hosta_homework.model import CorrectionFile, ImageFile, LazyImageFile, Room, codec, join, splice
+from hosta_homework.model.correction_file import parse_dimension
 
 
 @pytest.mark.parametrize("image_file", IMAGE_FILES)
@@ -34,3 +40,200 @@ def test_room():
 
 def test_correction_file():
     cf = CorrectionFile(CSV_FILE)
+
+
+@pytest.mark.parametrize("image_file", IMAGE_FILES)
+def test_lazy_image_file_completeness(image_file):
+    """Like test_image_file_completeness, but the lazy model must not even drop unmodelled fields"""
+    with open(image_file, "r") as f:
+        json_str = f.read()
+    image = LazyImageFile.model_validate_json(json_str)
+    assert json.loads(image.model_dump_json(indent=2)) == json.loads(json_str)
+
+
+def test_lazy_room_matches_validated_room(tmp_path):
+    """The fast path must make exactly the same corrections as the validated models"""
+    validated = Room(IMAGE_FILES, validate=True).process_corrections(CSV_FILE)
+    lazy = Room(IMAGE_FILES).process_corrections(CSV_FILE)
+
+    for validated_image, lazy_image in zip(validated.images, lazy.images):
+        assert isinstance(lazy_image, LazyImageFile)
+        assert [str(op.parent_id) if op.parent_id else None for op in validated_image.ops_3d] == \
+            [op.parent_id for op in lazy_image.ops_3d]
+
+
+def _get_codec(name):
+    if not codec.is_available(name):
+        pytest.skip(f"the {name} codec is not available")
+    return codec.get_codec(name)
+
+
+@pytest.mark.parametrize("codec_name", codec.CODECS)
+@pytest.mark.parametrize("image_file", IMAGE_FILES)
+def test_codec_completeness(image_file, codec_name):
+    """Every codec must round-trip like ImageFile (the lazy ones even keep unmodelled fields)"""
+    image_model = _get_codec(codec_name)
+    json_bytes = image_file.read_bytes()
+    if codec_name in ("lazy", "orjson"):
+        expected = json.loads(json_bytes)
+    else:
+        expected = json.loads(ImageFile.model_validate_json(json_bytes).model_dump_json(exclude_unset=True))
+    image = image_model.model_validate_json(json_bytes)
+    assert json.loads(image.model_dump_json(exclude_unset=True, indent=2)) == expected
+
+
+@pytest.mark.parametrize("codec_name", codec.CODECS)
+def test_codecs_make_the_same_corrections(codec_name):
+    _get_codec(codec_name)
+    reference = Room(IMAGE_FILES, codec="pydantic")
+    room = Room(IMAGE_FILES, codec=codec_name)
+    parsed = [op.model_fields_set for image in room.images for op in image.ops_3d]
+
+    def parent_ids(room):
+        return [str(op.parent_id) if op.parent_id else None for image in room.images for op in image.ops_3d]
+
+    assert parent_ids(room.process_corrections(CSV_FILE)) == \
+        parent_ids(reference.process_corrections(CSV_FILE))
+    assert room.join_result.counts() == reference.join_result.counts()
+
+    # Unsetting parent_id again must leave it out of the output, as it was
+    room.reset_corrections()
+    assert [op.model_fields_set for image in room.images for op in image.ops_3d] == parsed
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        Room(IMAGE_FILES, codec="pickle")
+
+
+@pytest.mark.parametrize("use_mmap", [True, False])
+def test_splice_save_matches_model_save(tmp_path, use_mmap):
+    """Spliced output must have the same content as re-serialized output"""
+    (tmp_path / "model").mkdir()
+    (tmp_path / "splice").mkdir()
+    room = Room(IMAGE_FILES).process_corrections(CSV_FILE)
+    room.save_images(tmp_path / "model")
+    room.save_images(tmp_path / "splice", mode="splice", use_mmap=use_mmap)
+
+    for image_file in IMAGE_FILES:
+        with open(tmp_path / "model" / image_file.name) as f:
+            model_json = json.load(f)
+        with open(tmp_path / "splice" / image_file.name) as f:
+            splice_json = json.load(f)
+        assert model_json == splice_json
+
+
+@pytest.mark.parametrize("use_mmap", [True, False])
+def test_splice_save_of_emptied_source(tmp_path, use_mmap):
+    """A source file emptied since it was parsed is an error, however it is read"""
+    (tmp_path / "input").mkdir()
+    (tmp_path / "output").mkdir()
+    image_files = [tmp_path / "input" / f.name for f in IMAGE_FILES]
+    for source, image_file in zip(IMAGE_FILES, image_files):
+        image_file.write_bytes(source.read_bytes())
+    room = Room(image_files).process_corrections(CSV_FILE)
+    image_files[0].write_bytes(b"")
+    with pytest.raises(ValueError, match="not a json object"):
+        room.save_images(tmp_path / "output", mode="splice", use_mmap=use_mmap, only={0})
+
+def test_splice_only_touches_parent_id():
+    """Everything but the parent_id members must come through byte-for-byte"""
+    source = b'{"image_info": {"file_name": "x\\\\\\"}"}, "ops_3d": [{}, {"a": [1, {"b": "}"}]}, {"parent_id": null, "c": 2}]}'
+    spans = splice.scan_ops(source)
+    assert len(spans) == 3
+
+    changed = splice.changed_parent_ids(source, spans, [None, "p1", "p2"])
+    assert changed == {1: "p1", 2: "p2"}
+
+    result = b"".join(splice.splice_parent_ids(source, spans, changed))
+    assert result == source.replace(b'"}"}]}', b'"}"}], "parent_id": "p1"}').replace(b"null", b'"p2"')
+    assert json.loads(result)["ops_3d"][1] == {"a": [1, {"b": "}"}], "parent_id": "p1"}
+
+
+def test_correction_file_columns():
+    cf = CorrectionFile(CSV_FILE, keep_rows=True)
+    assert cf.num_images == 3
+    assert len(cf) == len(cf.object_ids) == len(cf.host_ids) == len(cf.dimensions["height"])
+
+    row = cf.corrections_by_id["27"]
+    assert (row.object_id, row.host_id) == ("1869523", "1309015")
+    assert row.image_object_id("Image2_Object_ID") == "27"
+    assert row.image_object_id("Image1_Object_ID") == ""
+    assert (row.height, row.depth, row.width) == (2.88, 2.0, 1.5)
+    assert math.isnan(row.area)
+
+
+def test_correction_file_streaming_matches_kept_rows():
+    streamed = CorrectionFile(CSV_FILE)
+    kept = CorrectionFile(CSV_FILE, keep_rows=True)
+    assert len(streamed) < len(kept) == streamed.num_rows
+
+    def corrections(cf):
+        return {image_id: (row.object_id, row.host_id) for image_id, row in cf.corrections_by_id.items()}
+
+    assert corrections(streamed) == corrections(kept)
+    assert streamed.object_id_to_image_id == kept.object_id_to_image_id
+
+    # Rebuilding from the kept columns gives the same result as streaming
+    kept.build_indexes()
+    assert corrections(streamed) == corrections(kept)
+    assert streamed.object_id_to_image_id == kept.object_id_to_image_id
+
+
+@pytest.mark.parametrize("encoding", ["utf-16", "utf-16-le", "utf-8", "utf-8-sig"])
+@pytest.mark.parametrize("compress", [False, True])
+def test_correction_file_formats(tmp_path, encoding, compress):
+    data = CSV_FILE.read_text(encoding="utf-16").encode(encoding)
+    csv_file = tmp_path / "corrections.csv"
+    csv_file.write_bytes(gzip.compress(data) if compress else data)
+
+    cf = CorrectionFile(csv_file)
+    expected = CorrectionFile(CSV_FILE)
+    assert cf.object_id_to_image_id == expected.object_id_to_image_id
+    assert cf.corrections_by_id.keys() == expected.corrections_by_id.keys()
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2.88 ft", 2.88),
+    ("16.50 LF", 16.5),
+    ("20.25 SF", 20.25),
+    ("6 in", 0.5),
+    ("1m", 1 / 0.3048),
+])
+def test_parse_dimension(value, expected):
+    assert parse_dimension(value) == pytest.approx(expected)
+
+
+def test_invalid_dimensions_are_kept_as_nan(tmp_path):
+    lines = CSV_FILE.read_text(encoding="utf-16").splitlines()
+    lines[1] = lines[1].replace('"2.88 ft"\t"2.00 ft"\t"1.50 ft"', '"tall"\t"2.00 ft"\t"1.50 furlongs"')
+    csv_file = tmp_path / CSV_FILE.name
+    csv_file.write_text("\n".join(lines), encoding="utf-16")
+
+    metrics = Metrics()
+    csv = CorrectionFile(csv_file, metrics, keep_rows=True)
+    assert len(csv) == len(CorrectionFile(CSV_FILE, keep_rows=True))
+    assert csv.invalid_dimensions == {0: ["height", "width"]}
+    assert math.isnan(csv.dimensions["height"][0]) and csv.dimensions["depth"][0] == 2.0
+    assert metrics.counters["invalid_dimension_rows"] == 1
+
+
+@pytest.mark.parametrize("engine", join.ENGINES)
+def test_join_engines_agree(engine):
+    reference = Room(IMAGE_FILES).process_corrections(CSV_FILE, engine="reference")
+    room = Room(IMAGE_FILES).process_corrections(CSV_FILE, engine=engine)
+
+    assert room.join_result == reference.join_result
+    assert [op.parent_id for image in room.images for op in image.ops_3d] == \
+        [op.parent_id for image in reference.images for op in image.ops_3d]
+
+    counts = room.join_result.counts()
+    assert counts[join.JoinOutcome.SUCCESS] == 19
+    assert sum(counts.values()) == sum(len(image.ops_3d) for image in room.images)
+
+
+def test_every_submodule_is_exported():
+    """Every module of hosta_homework.model is reachable as an attribute of it, and listed in __all__"""
+    names = {path.stem for path in Path(model.__file__).parent.glob("*.py")} - {"__init__"}
+    assert names <= set(model.__all__)
+    assert model.op_store.OpStore
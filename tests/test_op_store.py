@@ -0,0 +1,124 @@
+import json
+from uuid import UUID
+
+import pydantic
+import pytest
+
+from hosta_homework import bench, synthetic
+from hosta_homework.data import IMAGE_FILES, CSV_FILE
+from hosta_homework.model import ImageFile, Room
+from hosta_homework.model import op_store
+from hosta_homework.model.op_store import CompactImageFile, OpStore
+
+
+def test_every_field_is_stored():
+    kinds = [
+        op_store._UUIDS, op_store._STRINGS, op_store._INTS, op_store._FLOATS, op_store._NUMBERS, op_store._BOOLS,
+        op_store._POINTS, op_store._JSON]
+    names = [name for kind in kinds for name in kind]
+    assert sorted(names) == sorted(op_store.FIELDS) and len(op_store.FIELDS) <= 64
+
+
+@pytest.mark.parametrize("image_file", IMAGE_FILES)
+def test_same_output_as_image_file(image_file):
+    json_bytes = image_file.read_bytes()
+    validated = ImageFile.model_validate_json(json_bytes)
+    compact = CompactImageFile.model_validate_json(json_bytes)
+    assert compact.model_dump_json(indent=2) == validated.model_dump_json(exclude_unset=True, indent=2)
+    assert compact.model_dump_json() == validated.model_dump_json(exclude_unset=True)
+
+
+def test_parses_in_chunks(tmp_path):
+    image_files, _ = synthetic.generate_room(tmp_path, ops_per_image=2 * op_store._CHUNK + 1, seed=2)
+    json_bytes = image_files[0].read_bytes()
+    compact = CompactImageFile.model_validate_json(json_bytes)
+    assert compact.model_dump_json() == ImageFile.model_validate_json(json_bytes).model_dump_json(exclude_unset=True)
+
+    document = json.loads(json_bytes)
+    document["ops_3d"][op_store._CHUNK + 1]["centre"] = "nowhere"
+    with pytest.raises(pydantic.ValidationError) as error:
+        CompactImageFile.model_validate_json(json.dumps(document))
+    assert error.value.errors()[0]["loc"] == ("ops_3d", op_store._CHUNK + 1, "centre")
+
+
+@pytest.mark.parametrize("image_file", IMAGE_FILES)
+def test_views_match_models(image_file):
+    validated = ImageFile.model_validate_json(image_file.read_bytes())
+    compact = CompactImageFile.from_image_file(validated)
+    assert len(compact.ops_3d) == len(validated.ops_3d)
+    assert compact.ops_3d[-1] == compact.ops_3d[len(validated.ops_3d) - 1]
+    for model_op, view in zip(validated.ops_3d, compact.ops_3d):
+        assert view.model_fields_set == model_op.model_fields_set
+        dumped = model_op.model_dump(mode="json", exclude_unset=True)
+        for name in op_store.FIELDS:
+            value = getattr(view, name)
+            if name in op_store._JSON:
+                assert value == dumped.get(name)
+            else:
+                assert value == getattr(model_op, name)
+                assert type(value) is type(getattr(model_op, name))
+
+
+def test_types_and_nulls():
+    store = OpStore()
+    # In FIELDS order, as in the output
+    ops_3d = [
+        {"supercategory": "door", "unique_id": str(UUID(int=1)), "parent_id": None, "width": 3.0, "quantity": 2},
+        {"supercategory": "door", "unique_id": str(UUID(int=2)), "centre": [1.0, 2.0, 3.0, 4.0], "quantity": 2.5},
+    ]
+    store.extend(ops_3d)
+    assert store.to_dicts() == ops_3d
+    assert store.strings == ["door"]
+    assert store.get(0, "parent_id") is None and "parent_id" in store.fields_set(0)
+    assert store.get(1, "width") is None and "width" not in store.fields_set(1)
+    assert store.get(0, "unique_id") == UUID(int=1)
+    assert json.dumps(store.to_dicts()) == json.dumps(ops_3d)  # 2 stays an int, 2.5 a float
+
+
+def test_many_strings_and_large_ints():
+    store = OpStore()
+    ops_3d = [{"supercategory": f"category {i}", "quantity": 2 ** 60 + i} for i in range(1 << 16)]
+    store.extend(ops_3d[:10])
+    store.extend(ops_3d[10:])
+    store.extend([{"supercategory": "door", "quantity": 3}])
+    assert len(store.strings) == (1 << 16) + 1
+    assert store.to_dicts() == [*ops_3d, {"supercategory": "door", "quantity": 3}]
+    assert store.get(1 << 15, "quantity") == 2 ** 60 + (1 << 15) and store.get(1 << 16, "quantity") == 3
+
+
+def test_parent_id():
+    image = CompactImageFile.model_validate_json(IMAGE_FILES[0].read_bytes())
+    op_3d, other = image.ops_3d[0], image.ops_3d[1]
+    op_3d.parent_id = other.unique_id
+    assert op_3d.parent_id == other.unique_id and "parent_id" in op_3d.model_fields_set
+    assert json.loads(image.model_dump_json())["ops_3d"][0]["parent_id"] == str(other.unique_id)
+
+    op_3d.parent_id = str(other.unique_id)
+    assert op_3d.parent_id == other.unique_id
+    op_3d.parent_id = None
+    assert json.loads(image.model_dump_json())["ops_3d"][0]["parent_id"] is None
+    op_3d.clear_parent_id()
+    assert op_3d.parent_id is None and "parent_id" not in json.loads(image.model_dump_json())["ops_3d"][0]
+
+
+def test_room_makes_the_same_corrections(tmp_path):
+    image_files, csv_file = synthetic.generate_room(tmp_path / "input", ops_per_image=200, seed=5)
+    for name, (images, csv) in {"example": (IMAGE_FILES, CSV_FILE), "synthetic": (image_files, csv_file)}.items():
+        for codec in ("pydantic", "compact"):
+            (tmp_path / name / codec).mkdir(parents=True)
+            room = Room(images, codec=codec).process_corrections(csv, engine="identity")
+            room.check_dimensions(reject=True).infer_parents().save_images(tmp_path / name / codec)
+        for output in (tmp_path / name / "pydantic").iterdir():
+            assert (tmp_path / name / "compact" / output.name).read_bytes() == output.read_bytes()
+
+
+def test_takes_less_memory(tmp_path):
+    image_files, _ = synthetic.generate_room(tmp_path, ops_per_image=2000, seed=1)
+    compact = bench.measure_memory(image_files, "compact")
+    assert compact["retained"] * 3 < bench.measure_memory(image_files, "pydantic")["retained"]
+    assert compact["retained"] < bench.measure_memory(image_files, "lazy")["retained"]
+    assert compact["peak"] * 2 < bench.measure_memory(image_files, "pydantic")["peak"]
+
+    room = Room(image_files, codec="compact")
+    num_ops = sum(len(image.ops_3d) for image in room.images)
+    assert sum(image.store.nbytes() for image in room.images) < 400 * num_ops
@@ -0,0 +1,104 @@
+import asyncio
+import json
+
+from hosta_homework import service
+from hosta_homework.data import IMAGE_FILES, CSV_FILE
+
+
+def _num_parent_links(output_dir):
+    return sum("parent_id" in op for f in output_dir.glob("*.json") for op in json.loads(f.read_text())["ops_3d"])
+
+
+def test_lru_cache():
+    cache = service.LRUCache(max_bytes=100)
+    cache.put("a", ((60, 0),), "A")
+    cache.put("b", ((30, 0),), "B")
+    assert cache.get("a", ((60, 0),)) == "A"
+    # A changed file is a miss
+    assert cache.get("b", ((30, 1),)) is None
+
+    # "b" is now least recently used
+    cache.put("c", ((30, 0),), "C")
+    assert cache.get("b", ((30, 0),)) is None
+    assert cache.get("a", ((60, 0),)) == "A"
+    assert cache.size == 90
+
+
+def test_service(tmp_path):
+    socket_path = tmp_path / "service.sock"
+    # Only the header: no corrections at all
+    empty_csv = tmp_path / "empty.csv"
+    empty_csv.write_text(CSV_FILE.read_text(encoding="utf-16").splitlines()[0] + "\n", encoding="utf-16")
+
+    def job(id, csv, output_dir):
+        return {"id": id, "images": [str(f) for f in IMAGE_FILES], "csv": str(csv),
+                "output_dir": str(tmp_path / output_dir), "force": True}
+
+    async def scenario():
+        ready = asyncio.Event()
+        server = asyncio.create_task(service.serve(socket_path, ready=ready.set, concurrency=2, max_pending=2))
+        await ready.wait()
+        try:
+            first = await service.request([job(1, CSV_FILE, "first")], socket_path)
+            responses = await service.request(
+                [job(2, CSV_FILE, "second"), job(3, empty_csv, "empty"), {"id": 4}, "nonsense"], socket_path)
+        finally:
+            server.cancel()
+        return first, {response.get("id"): response for response in responses}
+
+    [first], responses = asyncio.run(scenario())
+
+    assert first["ok"] and first["cached"] == {"room": False, "csv": False}
+    assert first["metrics"]["join_outcomes"]["success"] == 19
+    assert responses[2]["ok"] and responses[2]["cached"] == {"room": True, "csv": True}
+    assert not responses[4]["ok"]
+    assert not responses[None]["ok"]
+
+    assert _num_parent_links(tmp_path / "first") == _num_parent_links(tmp_path / "second") > 0
+    # The cached room must not carry over the parent links of the previous jobs
+    assert responses[3]["ok"]
+    assert _num_parent_links(tmp_path / "empty") == 0
+
+
+def test_service_keeps_rows_for_identity(tmp_path):
+    """The identity engine needs every row of the CSV, so it must not reuse a CorrectionFile cached for another"""
+    def job(engine):
+        return {"images": [str(f) for f in IMAGE_FILES], "csv": str(CSV_FILE),
+                "output_dir": str(tmp_path / engine), "engine": engine, "force": True}
+
+    async def scenario():
+        correction_service = service.CorrectionService()
+        responses = [await correction_service.process(job(engine)) for engine in ("batch", "identity", "identity")]
+        return correction_service, responses
+
+    correction_service, responses = asyncio.run(scenario())
+    assert [response["cached"]["csv"] for response in responses] == [False, False, True]
+    csv = correction_service.correction_files.get((str(CSV_FILE), True), service.LRUCache.stamp([CSV_FILE]))
+    assert csv.keep_rows
+    assert _num_parent_links(tmp_path / "identity") == _num_parent_links(tmp_path / "batch")
+
+
+def test_service_over_long_line(tmp_path):
+    socket_path = tmp_path / "service.sock"
+
+    async def scenario():
+        ready = asyncio.Event()
+        server = asyncio.create_task(service.serve(socket_path, ready=ready.set))
+        await ready.wait()
+        try:
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+            writer.write(b'{"id": 1, "padding": "' + b"x" * (1 << 17) + b'"}\n')
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            # Then the connection is closed
+            assert await reader.readline() == b""
+            writer.close()
+            # The service still serves other connections
+            [other] = await service.request(["nonsense"], socket_path)
+        finally:
+            server.cancel()
+        return response, other
+
+    response, other = asyncio.run(scenario())
+    assert not response["ok"] and "Malformed job" in response["error"]
+    assert not other["ok"]
@@ -0,0 +1,116 @@
+import math
+from types import SimpleNamespace
+
+import pytest
+
+from hosta_homework import manifest, two_pass
+from hosta_homework.data import IMAGE_FILES, CSV_FILE
+from hosta_homework.model import Room, links
+from hosta_homework.model.join import JoinOutcome
+from hosta_homework.model.spatial import WallIndex, infer_parents
+
+
+def _wall(unique_id, left, right, top=-1.2, bottom=1.2):
+    (lx, lz), (rx, rz) = left, right
+    return SimpleNamespace(
+        supercategory="interior_wall", unique_id=unique_id, parent_id=None, width=None,
+        centre=[(lx + rx) / 2, 0.0, (lz + rz) / 2],
+        bottom_width_left=[lx, bottom, lz], bottom_width_right=[rx, bottom, rz],
+        height_bottom=[lx, bottom, lz], height_top=[lx, top, lz])
+
+
+def _disc(unique_id, centre, width):
+    return SimpleNamespace(
+        supercategory="interior_wall", unique_id=unique_id, parent_id=None, width=width, centre=centre,
+        bottom_width_left=None, bottom_width_right=None, height_bottom=None, height_top=None)
+
+
+def _op(unique_id, centre, supercategory="base_cabinet_single", parent_id=None):
+    return SimpleNamespace(supercategory=supercategory, unique_id=unique_id, parent_id=parent_id, centre=centre)
+
+
+def test_nearest_wall():
+    # Two parallel walls, 3m apart, and a perpendicular one at their end
+    walls = WallIndex.from_ops([
+        _wall("front", (0, 5), (4, 5)),
+        _wall("back", (0, 2), (4, 2)),
+        _wall("side", (4, 2), (4, 5)),
+    ])
+    assert len(walls) == 3
+
+    wall, distance, in_front = walls.nearest([1.0, 0.0, 4.8])
+    assert (walls.unique_ids[wall], in_front) == ("front", True) and distance == pytest.approx(0.2)
+    wall, _, in_front = walls.nearest([1.0, 0.0, 2.3])
+    assert (walls.unique_ids[wall], in_front) == ("back", True)
+    wall, _, _ = walls.nearest([3.8, 0.0, 3.5])
+    assert walls.unique_ids[wall] == "side"
+    # Beside the end of a wall, or below it
+    assert walls.nearest([-0.5, 0.0, 4.8])[2] is False
+    assert walls.nearest([1.0, 2.0, 4.8])[2] is False
+    # Too far from any wall
+    assert walls.nearest([2.0, 0.0, 3.5]) is None
+    assert walls.nearest([100.0, 0.0, 100.0]) is None
+
+
+def test_disc_walls():
+    walls = WallIndex.from_ops([_disc("wall", [0.0, 0.0, 5.0], 10.0), _disc("no geometry", None, 10.0)])
+    assert walls.unique_ids == ["wall"]
+    assert walls.nearest([1.0, 0.0, 5.0]) == (0, 0.0, False)
+    wall, distance, _ = walls.nearest([0.0, 0.0, 7.0])
+    assert distance == pytest.approx(2.0 - 10.0 * 0.3048 / 2)
+
+
+def test_infer_parents():
+    image = SimpleNamespace(ops_3d=[
+        _wall("wall", (0, 5), (4, 5)),
+        _op("near", [1.0, 0.0, 4.9]),
+        _op("further", [2.0, 0.0, 4.4]),
+        _op("beside", [4.2, 0.0, 4.9]),
+        _op("far", [2.0, 0.0, 2.0]),
+        _op("has a parent", [1.0, 0.0, 4.9], parent_id="other"),
+        _op("not hosted", [1.0, 0.0, 4.9], supercategory="floor"),
+    ])
+    inferences = infer_parents([image], max_distance=1.0, min_confidence=0)
+    assert [(i.op_index, i.parent_id) for i in inferences] == [(1, "wall"), (2, "wall"), (3, "wall")]
+    near, further, beside = (i.confidence for i in inferences)
+    assert near == pytest.approx(0.9) and further == pytest.approx(0.4)
+    # Nearest to the end of the wall, and beside it
+    assert beside == pytest.approx((1 - math.hypot(0.2, 0.1)) / 2)
+    assert [i.op_index for i in infer_parents([image], min_confidence=0.5)] == [1]
+
+
+def test_room_infer_parents():
+    room = Room(IMAGE_FILES).process_corrections(CSV_FILE)
+    joined = [op_3d.parent_id for image in room.images for op_3d in image.ops_3d]
+    hierarchy = room.hierarchy
+    room.infer_parents()
+
+    ops = [op_3d for image in room.images for op_3d in image.ops_3d]
+    assert len(room.inferences) == 10 == room.metrics.counters["inferred_parents"]
+    for inference in room.inferences:
+        assert joined[inference.op_index] is None
+        assert ops[inference.op_index].parent_id == inference.parent_id
+        assert hierarchy.supercategories[str(inference.parent_id)] == "interior_wall"
+        assert hierarchy.parent_of(ops[inference.op_index].unique_id) == str(inference.parent_id)
+
+    table = links.LinkTable.from_room(room)
+    assert len(table) == room.join_result.counts()[JoinOutcome.SUCCESS] + len(room.inferences)
+    assert table.host_ids.count("") == len(room.inferences)
+
+    room.reset_corrections()
+    assert room.inferences is None and all(op_3d.parent_id is None for op_3d in ops)
+
+
+@pytest.mark.parametrize("save_mode", ["model", "links"])
+def test_two_pass_infers_the_same_parents(tmp_path, save_mode):
+    (tmp_path / "room").mkdir()
+    (tmp_path / "two_pass").mkdir()
+    Room(IMAGE_FILES).process_corrections(CSV_FILE).infer_parents().save_images(tmp_path / "room", mode=save_mode)
+    two_pass.process_two_pass(IMAGE_FILES, CSV_FILE, tmp_path / "two_pass", save_mode=save_mode, infer_parents=0.5)
+    for output in (tmp_path / "room").iterdir():
+        assert (tmp_path / "two_pass" / output.name).read_bytes() == output.read_bytes()
+
+
+def test_incremental_rejects_inference(tmp_path):
+    with pytest.raises(ValueError, match="incremental"):
+        manifest.process_incremental(IMAGE_FILES, CSV_FILE, tmp_path, infer_parents=0.5)
@@ -0,0 +1,39 @@
+import subprocess
+import sys
+
+from hosta_homework import bench, synthetic
+from hosta_homework.model import Room, join
+
+
+def test_generate_room_is_deterministic(tmp_path):
+    first_images, first_csv = synthetic.generate_room(tmp_path / "a", num_images=4, ops_per_image=30, seed=7)
+    second_images, second_csv = synthetic.generate_room(tmp_path / "b", num_images=4, ops_per_image=30, seed=7)
+
+    assert [f.name for f in first_images] == [f.name for f in second_images]
+    for first, second in zip([*first_images, first_csv], [*second_images, second_csv]):
+        assert first.read_bytes() == second.read_bytes()
+
+
+def test_generated_room_is_processable(tmp_path):
+    image_files, csv_file = synthetic.generate_room(tmp_path, num_images=4, ops_per_image=100, csv_rows=1000)
+
+    room = Room(image_files, validate=True).process_corrections(csv_file)
+    counts = room.join_result.counts()
+    # Only Room.check_dimensions rejects
+    assert all(counts[outcome] for outcome in join.JoinOutcome if outcome != join.JoinOutcome.REJECTED)
+    assert sum(counts.values()) >= 4 * 100
+
+
+def test_run_benchmark():
+    report = bench.run_benchmark(ops_per_image=20, repeat=1)
+    assert len(report["runs"]) == len(join.ENGINES) * 2
+    for run in report["runs"]:
+        assert set(run["stages"]) == set(bench.STAGES)
+        assert all(run["stages"][stage] > 0 for stage in ("read", "validate", "index", "join"))
+
+
+def test_benchmark_rejects_unknown_options():
+    for option, value in (("--engines", "bach"), ("--save-modes", "splcie")):
+        result = subprocess.run(
+            [sys.executable, "-m", "hosta_homework.bench", option, value], capture_output=True, text=True)
+        assert result.returncode == 2 and "invalid choice" in result.stderr
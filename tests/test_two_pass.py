@@ -0,0 +1,57 @@
+import tracemalloc
+
+import pytest
+
+from hosta_homework import synthetic, two_pass
+from hosta_homework.data import IMAGE_FILES, CSV_FILE
+from hosta_homework.model import Room
+
+
+@pytest.mark.parametrize("save_mode", ["model", "splice", "links"])
+def test_two_pass_matches_room(tmp_path, save_mode):
+    (tmp_path / "room").mkdir()
+    (tmp_path / "two_pass").mkdir()
+    room = Room(IMAGE_FILES).process_corrections(CSV_FILE).save_images(tmp_path / "room", mode=save_mode)
+    metrics = two_pass.process_two_pass(IMAGE_FILES, CSV_FILE, tmp_path / "two_pass", save_mode=save_mode)
+
+    assert metrics.join_outcomes == room.metrics.join_outcomes
+    assert metrics.counters == room.metrics.counters
+    for output in (tmp_path / "room").iterdir():
+        assert (tmp_path / "two_pass" / output.name).read_bytes() == output.read_bytes()
+
+
+def test_two_pass_peak_memory(tmp_path):
+    """Only one image at a time may be held in memory"""
+    image_files, csv_file = synthetic.generate_room(tmp_path / "input", num_images=6, ops_per_image=300)
+    peaks = []
+    for name in ("room", "two_pass"):
+        output_dir = tmp_path / name
+        output_dir.mkdir()
+        tracemalloc.start()
+        try:
+            if name == "room":
+                Room(image_files).process_corrections(csv_file).save_images(output_dir)
+            else:
+                two_pass.process_two_pass(image_files, csv_file, output_dir)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+
+    assert peaks[1] < peaks[0] / 2
+
+
+def test_two_pass_checks_image_count(tmp_path):
+    with pytest.raises(ValueError):
+        two_pass.process_two_pass(IMAGE_FILES[:2], CSV_FILE, tmp_path)
+
+
+@pytest.mark.filterwarnings("error::UserWarning")
+@pytest.mark.parametrize("codec", ["pydantic", "compact"])
+def test_two_pass_parent_ids_match_codec(tmp_path, codec):
+    """Pass one indexes unique_ids as strings; validating codecs must still get UUID parent_ids"""
+    (tmp_path / "room").mkdir()
+    (tmp_path / "two_pass").mkdir()
+    Room(IMAGE_FILES, codec=codec).process_corrections(CSV_FILE).save_images(tmp_path / "room")
+    two_pass.process_two_pass(IMAGE_FILES, CSV_FILE, tmp_path / "two_pass", codec=codec)
+    for output in (tmp_path / "room").iterdir():
+        assert (tmp_path / "two_pass" / output.name).read_bytes() == output.read_bytes()